@@ -1,10 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
+from datetime import date, datetime
+from typing import Union
 
-from .schema import NewGeneralLedgerAccountRequestSchema, GeneralLedgerAccountSchema, NewSubLedgerAccountRequestSchema, SubLedgerAccountSchema, NewLinkedAccountRequestSchema, LinkedAccountSchema, PublicAccountSchema, AccountBalanceSchema
+from .schema import NewGeneralLedgerAccountRequestSchema, GeneralLedgerAccountSchema, NewSubLedgerAccountRequestSchema, SubLedgerAccountSchema, NewLinkedAccountRequestSchema, LinkedAccountSchema, PublicAccountSchema, AccountBalanceSchema, AccountBalanceAsOfSchema, AccountPageSchema
 
-from ...core.accounts.services import AccountService
+from ..responses import ORJSONResponse
+from ..transactions.schema import AccountSummarySchema, ExportFormat, TransactionPageSchema, TransactionMethod, TransactionStatus, TransactionType
 
-acc_svc = AccountService()
+from ...core import config
+from ...core.accounts.services import AccountService, get_account_service
+from ...core.transactions.services import TransactionsService, get_transactions_service
 
 router = APIRouter(
     prefix="/accounts",
@@ -15,6 +21,7 @@ router = APIRouter(
 @router.post("/", response_model=GeneralLedgerAccountSchema)
 async def create_general_ledger_account(
     request: NewGeneralLedgerAccountRequestSchema,
+    acc_svc: AccountService = Depends(get_account_service),
     # user: User = Depends(get_current_active_user),
 ):
     """Create a new general ledger account."""
@@ -22,7 +29,7 @@ async def create_general_ledger_account(
     created = await acc_svc.create_general_ledger_account(request)
     if not created:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Account not created")
-    return created
+    return ORJSONResponse(created)
 
 
 @router.post("/sub/", response_model=SubLedgerAccountSchema)
@@ -44,44 +51,117 @@ async def create_linked_account(
 @router.get("/{account_id}", response_model=PublicAccountSchema)
 async def get_account(
     account_id: str,
+    acc_svc: AccountService = Depends(get_account_service),
     # user: User = Depends(get_current_active_user),
 ):
     response = await acc_svc.get_account(account_id)
-    return response
+    return ORJSONResponse(response)
 
 
 @router.get("/{account_id}/balance/"
-, response_model=AccountBalanceSchema
+, response_model=Union[AccountBalanceSchema, AccountBalanceAsOfSchema]
 )
 async def get_account_balance(
     account_id: str,
+    as_of: datetime = None,
+    acc_svc: AccountService = Depends(get_account_service),
+    txn_svc: TransactionsService = Depends(get_transactions_service),
     # user: User = Depends(get_current_active_user),
 ):
-    response = await acc_svc.get_account_balance(account_id)
-    return response
+    """Get an account's current balance, or with `as_of` its balance at that time (UTC unless it has an offset)."""
+    if as_of:
+        response = await txn_svc.get_balance_as_of(account_id, as_of)
+    else:
+        response = await acc_svc.get_account_balance(account_id)
+    return ORJSONResponse(response)
 
 
-@router.get("/", response_model=list[PublicAccountSchema])
+@router.get("/{account_id}/transactions", response_model=TransactionPageSchema)
+async def get_account_transactions(
+    account_id: str,
+    transaction_status: TransactionStatus = Query(None, alias="status"),
+    transaction_type: TransactionType = Query(None, alias="type"),
+    transaction_method: TransactionMethod = Query(None, alias="method"),
+    disputed: bool = None,
+    created_from: datetime = Query(None, alias="from"),
+    created_to: datetime = Query(None, alias="to"),
+    cursor: str = None,
+    limit: int = Query(config.TRANSACTION_PAGE_SIZE, ge=1, le=config.TRANSACTION_PAGE_SIZE_MAX),
+    txn_svc: TransactionsService = Depends(get_transactions_service),
+    # user: User = Depends(get_current_active_user),
+):
+    """Get an account's transactions newest first, one page at a time."""
+    page = await txn_svc.get_transactions(account_id,
+        transaction_status=transaction_status,
+        transaction_type=transaction_type,
+        transaction_method=transaction_method,
+        disputed=disputed,
+        created_from=created_from,
+        created_to=created_to,
+        cursor=cursor,
+        limit=limit,
+    )
+    return ORJSONResponse(page)
+
+
+@router.get("/{account_id}/transactions/export", response_class=StreamingResponse)
+async def export_account_transactions(
+    account_id: str,
+    export_format: ExportFormat = Query(ExportFormat.CSV, alias="format"),
+    txn_svc: TransactionsService = Depends(get_transactions_service),
+    # user: User = Depends(get_current_active_user),
+):
+    """Download all of an account's transactions, oldest first, as CSV, NDJSON or Parquet, streamed as they are read."""
+    media_type, body = txn_svc.export_transactions(account_id, export_format)
+    return StreamingResponse(body, media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{account_id}-transactions.{export_format.value}"'})
+
+
+@router.get("/{account_id}/summary", response_model=AccountSummarySchema)
+async def get_account_summary(
+    account_id: str,
+    from_day: date = Query(None, alias="from"),
+    to_day: date = Query(None, alias="to"),
+    txn_svc: TransactionsService = Depends(get_transactions_service),
+    # user: User = Depends(get_current_active_user),
+):
+    """Get an account's transaction counts and totals per type and status, for the UTC days from `from` up to, not including, `to`."""
+    summary = await txn_svc.get_summary(account_id, from_day=from_day, to_day=to_day)
+    return ORJSONResponse(summary)
+
+
+@router.get("/", response_model=AccountPageSchema)
 async def get_accounts(
-    # account_holder_id: str = None,
+    account_holder_id: str = None,
+    active: bool = None,
+    cursor: str = None,
+    limit: int = Query(config.ACCOUNT_PAGE_SIZE, ge=1, le=config.ACCOUNT_PAGE_SIZE_MAX),
+    acc_svc: AccountService = Depends(get_account_service),
     # user: User = Depends(get_current_active_user),
 ):
-    """Get all accounts."""
+    """Get all accounts, optionally for one account holder, one page at a time."""
+    page = await acc_svc.get_all_accounts(account_holder_id=account_holder_id, active=active, cursor=cursor, limit=limit)
+    return StreamingResponse(page, media_type="application/json")
 
 
-@router.get("/sub/", response_model=list[SubLedgerAccountSchema])
+# Sub ledger and linked accounts share the account table with no column to
+# tell them apart, so there is nothing to list them by yet; GET /accounts/
+# lists every account.
+@router.get("/sub/", response_model=list[SubLedgerAccountSchema], responses={501: {"description": "Not implemented yet"}})
 async def get_sub_ledger_accounts(
     account_holder_id: str = None,
     # user: User = Depends(get_current_active_user),
 ):
     """Get all sub ledger accounts."""
+    raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="Listing sub ledger accounts is not supported yet, use GET /accounts/")
 
 
-@router.get("/linked/", response_model=list[LinkedAccountSchema])
+@router.get("/linked/", response_model=list[LinkedAccountSchema], responses={501: {"description": "Not implemented yet"}})
 async def get_linked_accounts(
     account_holder_id: str = None,
     # user: User = Depends(get_current_active_user),
 ):
     """Get all linked accounts."""
+    raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="Listing linked accounts is not supported yet, use GET /accounts/")
 
 
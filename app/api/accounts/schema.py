@@ -54,6 +54,11 @@ class PublicAccountSchema(BaseAccountSchema):
     pass
 
 
+class AccountPageSchema(BaseSchema):
+    items: list[PublicAccountSchema] = Field(description="The accounts on this page")
+    next_cursor: Optional[str] = Field(None, description="Pass as `cursor` to fetch the next page, null on the last page")
+
+
 class SubLedgerAccountSchema(BaseAccountSchema):
     parent_account_id: str
 
@@ -118,3 +123,10 @@ class AccountBalanceSchema(BaseSchema):
     available_balance: float = Field(0, description="The current available balance of the account", example=0)
     created_at: datetime
     updated_at: datetime
+
+
+class AccountBalanceAsOfSchema(BaseSchema):
+    """An account's balance at a point in time."""
+    id: str
+    balance: float = Field(description="The balance with everything posted up to and including as_of", example=0)
+    as_of: datetime = Field(description="The point in time, in UTC")
@@ -0,0 +1,87 @@
+from time import perf_counter
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from ..core.metrics import (
+    Counter, Gauge, RequestStats, registry, request_stats, recent_request_seconds,
+    http_requests_in_flight, http_request_duration_seconds, http_request_db_queries, http_request_db_seconds,
+)
+from ..core.accounts.cache import account_cache, balance_cache
+from ..core.transactions.idempotency import idempotent_requests
+from ..db.sqlite.transactions.db import database as ledger_database
+
+
+CACHES = {"account": account_cache, "balance": balance_cache, "idempotency": idempotent_requests.cache}
+
+registry.register(Gauge("cache_entries", "Entries held by each cache", labels=("cache",),
+    function=lambda: {(name,): len(cache) for name, cache in CACHES.items()}))
+for stat in ("hits", "misses", "evictions"):
+    registry.register(Counter(f"cache_{stat}_total", f"Cache {stat} since the worker started", labels=("cache",),
+        function=lambda stat=stat: {(name,): getattr(cache, stat) for name, cache in CACHES.items()}))
+registry.register(Gauge("transaction_writer_queue_depth", "Transactions waiting for the group commit writer",
+    function=lambda: {(): ledger_database.queue_depth}))
+
+
+class MetricsMiddleware:
+    """Times every HTTP request and counts the SQL it runs, by method, route and status.
+
+    Routes are labelled with their path template, such as
+    /accounts/{account_id}, so ids don't each become a new series. Requests
+    that match no route are labelled "unmatched".
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.route_paths = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        http_requests_in_flight.inc()
+        started = perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = perf_counter() - started
+            http_requests_in_flight.dec()
+            request_stats.reset(token)
+
+            method, route = scope["method"], self.route_path(scope)
+            http_request_duration_seconds.observe(elapsed, method, route, status_code)
+            recent_request_seconds.observe(elapsed)
+            http_request_db_queries.observe(stats.queries, method, route)
+            http_request_db_seconds.observe(stats.query_seconds, method, route)
+
+    def route_path(self, scope: Scope) -> str:
+        # The router leaves the matched endpoint in the scope, not the route itself.
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        path = self.route_paths.get(endpoint)
+        if path is None:
+            path = next((route.path for route in scope["app"].routes if getattr(route, "endpoint", None) is endpoint), "unmatched")
+            self.route_paths[endpoint] = path
+        return path
+
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics():
+    """Every metric in the Prometheus text format."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,46 @@
+import json
+import logging
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from ..core import config
+from ..core.profiler import RequestProfile, request_profile
+
+
+logger = logging.getLogger("app.sql_profile")
+
+
+class SQLProfilerMiddleware:
+    """Profiles the SQL run by each request. Only installed when SQL_PROFILE is on.
+
+    A one-line summary goes in the X-SQL-Profile response header. It only
+    counts statements run before the response starts, so for streamed
+    responses it can be partial. The full profile, with every statement, its
+    duration and its query plan, is logged once the response is sent: at
+    WARNING when something was flagged, otherwise at DEBUG.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(n_plus_one_threshold=config.SQL_PROFILE_N_PLUS_ONE)
+
+        async def send_with_profile(message: Message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append("X-SQL-Profile", profile.header())
+            await send(message)
+
+        token = request_profile.set(profile)
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            request_profile.reset(token)
+            level = logging.WARNING if profile.flagged else logging.DEBUG
+            if logger.isEnabledFor(level):
+                logger.log(level, "SQL profile for %s %s: %s", scope["method"], scope["path"], json.dumps(profile.report()))
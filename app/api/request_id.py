@@ -0,0 +1,43 @@
+import re
+from uuid import uuid4
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from ..core.logs import request_id
+
+
+HEADER = "X-Request-ID"
+# Anything else from a caller is replaced, so ids can't forge log lines or run on forever.
+VALID_ID = re.compile(rb"[A-Za-z0-9._-]{1,128}")
+
+
+class RequestIdMiddleware:
+    """Gives each request an id that every log line it writes carries.
+
+    The id comes from the caller's X-Request-ID header when it sends a
+    reasonable one, so logs can be matched up across services, and is made up
+    otherwise. Either way it is sent back in the response's X-Request-ID.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = next((value for name, value in scope["headers"] if name == b"x-request-id"), b"")
+        rid = incoming.decode() if VALID_ID.fullmatch(incoming) else uuid4().hex
+
+        async def send_with_request_id(message: Message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append(HEADER, rid)
+            await send(message)
+
+        token = request_id.set(rid)
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id.reset(token)
@@ -0,0 +1,31 @@
+from decimal import Decimal
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+
+def _default(value):
+    # Match FastAPI's jsonable_encoder, which sends Decimals as floats.
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, BaseModel):
+        return value.dict(by_alias=True)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class ORJSONResponse(JSONResponse):
+    """Serializes content straight to JSON bytes with orjson.
+
+    Returning one from a route skips FastAPI's response_model validation and
+    jsonable_encoder pass, so build the content with BaseSchema.dump() or an
+    already validated schema. response_model then only documents the route.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -1,5 +1,10 @@
+from datetime import datetime, timezone
 from pydantic import BaseModel
 from pydantic.generics import GenericModel
+from typing import Union
+
+
+_MISSING = object()
 
 
 def _snake_to_camel(name: str) -> str:
@@ -13,6 +18,29 @@ class BaseSchema(BaseModel):
         allow_population_by_field_name = True
         alias_generator = _snake_to_camel
 
+    @classmethod
+    def dump(cls, row: Union[dict, BaseModel]) -> dict:
+        """Shape a row we already trust, a model or a dict, into this schema's aliased JSON fields.
+
+        Gives what cls.from_orm(row).dict(by_alias=True) would, without
+        validating and copying every value again. Fields the row lacks get
+        their defaults. Datetimes come out as naive UTC, the way they are
+        stored, whether the row was read back or built in this request.
+        """
+        if not isinstance(row, dict):
+            # Only read the model's own fields: a table model's class carries
+            # attributes like `metadata` that aren't columns.
+            row = {name: getattr(row, name) for name in row.__fields__}
+        dumped = {}
+        for name, field in cls.__fields__.items():
+            value = row.get(name, _MISSING)
+            if value is _MISSING:
+                value = field.get_default()
+            elif isinstance(value, datetime) and value.tzinfo is not None:
+                value = value.astimezone(timezone.utc).replace(tzinfo=None)
+            dumped[field.alias] = value
+        return dumped
+
 
 class GenericSchema(GenericModel):
     class Config:
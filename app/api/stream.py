@@ -0,0 +1,161 @@
+import codecs
+import json
+from typing import AsyncIterator, Union
+
+
+MAX_ROW_SIZE = 1024 * 1024 # chars
+
+_WHITESPACE = " \t\r\n"
+
+
+class RowTooLong(ValueError):
+    def __init__(self):
+        super().__init__(f"Row is longer than {MAX_ROW_SIZE} characters")
+
+
+class _Reader:
+    def __init__(self, chunks: AsyncIterator[bytes]):
+        self.chunks = chunks.__aiter__()
+        self.text = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.more = True
+
+    async def read(self):
+        try:
+            chunk = await self.chunks.__anext__()
+        except StopAsyncIteration:
+            self.buffer += self.text.decode(b"", final=True)
+            self.more = False
+            return
+        self.buffer += self.text.decode(chunk)
+
+
+async def iter_json_rows(chunks: AsyncIterator[bytes]) -> AsyncIterator[Union[object, ValueError]]:
+    """Decode a streamed request body one row at a time.
+
+    Accepts either NDJSON (one value per line) or a single JSON array. Only
+    the row being decoded is held in memory. A row that can't be decoded is
+    yielded as a ValueError so the caller can report it by position, and one
+    longer than MAX_ROW_SIZE as a single RowTooLong, skipped without being
+    held.
+    """
+    reader = _Reader(chunks)
+    while reader.more and not reader.buffer.lstrip(_WHITESPACE):
+        await reader.read()
+    reader.buffer = reader.buffer.lstrip(_WHITESPACE)
+
+    if reader.buffer.startswith("["):
+        reader.buffer = reader.buffer[1:]
+        rows = _iter_array(reader)
+    else:
+        rows = _iter_lines(reader)
+
+    async for row in rows:
+        yield row
+
+
+async def _iter_lines(reader: _Reader):
+    pos = 0
+    while pos < len(reader.buffer) or reader.more:
+        newline = reader.buffer.find("\n", pos)
+        if newline == -1 and reader.more:
+            if len(reader.buffer) - pos <= MAX_ROW_SIZE:
+                reader.buffer, pos = reader.buffer[pos:], 0
+                await reader.read()
+                continue
+
+            # Drop the rest of the line a chunk at a time.
+            yield RowTooLong()
+            reader.buffer = ""
+            while reader.more and "\n" not in reader.buffer:
+                reader.buffer = ""
+                await reader.read()
+            pos = reader.buffer.find("\n") + 1 or len(reader.buffer)
+            continue
+
+        if newline == -1:
+            newline = len(reader.buffer)
+        line, pos = reader.buffer[pos:newline], newline + 1
+
+        if len(line) > MAX_ROW_SIZE:
+            yield RowTooLong()
+        elif line.strip(_WHITESPACE):
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                yield e
+
+
+async def _iter_array(reader: _Reader):
+    decoder = json.JSONDecoder()
+    pos = 0
+    while True:
+        while pos < len(reader.buffer) and reader.buffer[pos] in _WHITESPACE + ",":
+            pos += 1
+
+        if reader.buffer.startswith("]", pos):
+            return
+
+        if pos == len(reader.buffer):
+            if not reader.more:
+                yield ValueError("Unterminated JSON array")
+                return
+            reader.buffer, pos = "", 0
+            await reader.read()
+            continue
+
+        try:
+            row, end = decoder.raw_decode(reader.buffer, pos)
+        except ValueError as e:
+            row, end = e, None
+
+        # A value that runs to the end of the buffer may continue in the next chunk.
+        if (end is None or end == len(reader.buffer)) and reader.more:
+            if len(reader.buffer) - pos <= MAX_ROW_SIZE:
+                reader.buffer, pos = reader.buffer[pos:], 0
+                await reader.read()
+                continue
+
+            yield RowTooLong()
+            pos = await _skip_value(reader, pos)
+            continue
+
+        if end is None:
+            # The rest of the array can't be located once an element is malformed.
+            yield row
+            return
+
+        if end - pos > MAX_ROW_SIZE:
+            row = RowTooLong()
+        pos = end
+        yield row
+
+
+async def _skip_value(reader: _Reader, pos: int) -> int:
+    """Find the end of the array element starting at pos without decoding it, dropping each chunk once scanned."""
+    depth, in_string, escaped = 0, False, False
+    while True:
+        for pos in range(pos, len(reader.buffer)):
+            char = reader.buffer[pos]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == "\\":
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+            elif char == '"':
+                in_string = True
+            elif char in "[{":
+                depth += 1
+            elif char in "]}":
+                if depth == 0:
+                    return pos
+                depth -= 1
+            elif char == "," and depth == 0:
+                return pos
+
+        if not reader.more:
+            return len(reader.buffer)
+        reader.buffer, pos = "", 0
+        await reader.read()
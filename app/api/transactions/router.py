@@ -1,9 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from .schema import PublicTransactionSchema, CreatedTransactionSchema, NewTransactionRequestSchema, UpdateTransactionRequestSchema
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response, status
+from .schema import PublicTransactionSchema, CreatedTransactionSchema, NewTransactionRequestSchema, UpdateTransactionRequestSchema, ProcessTransactionRequestSchema, VoidTransactionRequestSchema, BatchTransactionResultSchema, BatchProcessTransactionsRequestSchema, BatchVoidTransactionsRequestSchema, BatchStatusResultSchema
 
-from ...core.transactions.services import TransactionsService
+from ..responses import ORJSONResponse
+from ..stream import iter_json_rows
 
-txn_svc = TransactionsService()
+from ...core.transactions.services import TransactionsService, get_transactions_service
 
 
 router = APIRouter(
@@ -16,18 +17,62 @@ router = APIRouter(
 @router.post("/",
 # , response_model=CreatedTransactionSchema, 
 status_code=status.HTTP_201_CREATED)
-async def create_transaction(request: NewTransactionRequestSchema):
-    return await txn_svc.create_transaction(request)
+async def create_transaction(
+    request: NewTransactionRequestSchema,
+    idempotency_key: str = Header(None, description="Retries with the same key get the first response back instead of creating another transaction"),
+    txn_svc: TransactionsService = Depends(get_transactions_service),
+):
+    if idempotency_key is None:
+        created = await txn_svc.create_transaction(request)
+        return ORJSONResponse(created, status_code=status.HTTP_201_CREATED)
+
+    (status_code, body), replayed = await txn_svc.create_transaction_once(request, idempotency_key)
+    return Response(body, status_code=status_code, media_type="application/json",
+        headers={"Idempotent-Replayed": "true"} if replayed else None)
+
+
+@router.post("/batch", response_model=BatchTransactionResultSchema)
+async def create_transactions_batch(request: Request, txn_svc: TransactionsService = Depends(get_transactions_service)):
+    """Create transactions from a streamed NDJSON or JSON array body of NewTransactionRequestSchema rows."""
+    return await txn_svc.create_transactions_batch(iter_json_rows(request.stream()))
+
+
+@router.post("/process", response_model=BatchStatusResultSchema)
+async def process_transactions(request: BatchProcessTransactionsRequestSchema, txn_svc: TransactionsService = Depends(get_transactions_service)):
+    """Process the pending transactions among `transactionIds`, or all of `accountId`'s pending transactions created before `createdBefore`."""
+    return await txn_svc.process_transactions(request)
+
+
+@router.post("/void", response_model=BatchStatusResultSchema)
+async def void_transactions(request: BatchVoidTransactionsRequestSchema, txn_svc: TransactionsService = Depends(get_transactions_service)):
+    """Void the transactions among `transactionIds`, or all of `accountId`'s pending transactions created before `createdBefore`."""
+    return await txn_svc.void_transactions(request)
 
 
 @router.get("/{transaction_id}", response_model=PublicTransactionSchema)
-async def get_transaction(transaction_id: str):
-    return await txn_svc.get_transaction(transaction_id)
+async def get_transaction(transaction_id: str, txn_svc: TransactionsService = Depends(get_transactions_service)):
+    transaction = await txn_svc.get_transaction(transaction_id)
+    return ORJSONResponse(transaction)
 
 
 @router.put("/{transaction_id}", response_model=PublicTransactionSchema)
-async def update_transaction(transaction_id: str, request: UpdateTransactionRequestSchema):
-    return await txn_svc.update_transaction(transaction_id, request)
+async def update_transaction(transaction_id: str, request: UpdateTransactionRequestSchema, txn_svc: TransactionsService = Depends(get_transactions_service)):
+    updated = await txn_svc.update_transaction(transaction_id, request)
+    return ORJSONResponse(updated)
+
+
+@router.post("/{transaction_id}/process", response_model=PublicTransactionSchema)
+async def process_transaction(transaction_id: str, request: ProcessTransactionRequestSchema, txn_svc: TransactionsService = Depends(get_transactions_service)):
+    """Process a pending transaction, posting it to its account's balance."""
+    processed = await txn_svc.process_transaction(transaction_id, request)
+    return ORJSONResponse(processed)
+
+
+@router.post("/{transaction_id}/void", response_model=PublicTransactionSchema)
+async def void_transaction(transaction_id: str, request: VoidTransactionRequestSchema, txn_svc: TransactionsService = Depends(get_transactions_service)):
+    """Void a transaction, reversing its balance posting if it was processed."""
+    voided = await txn_svc.void_transaction(transaction_id, request)
+    return ORJSONResponse(voided)
 
 # Path: slick-ledger/app/api/transactions/schema.py
 
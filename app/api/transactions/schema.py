@@ -1,8 +1,9 @@
 from ..schema import BaseSchema
-from datetime import datetime
+from datetime import date, datetime
 from pydantic import Field
 from enum import Enum
 from decimal import Decimal
+from typing import Optional
 import time
 
 from ...db.sqlite.transactions.db import TransactionInDBModel, TransactionMethod, TransactionStatus, TransactionType
@@ -78,6 +79,12 @@ class PublicTransactionSchema(BaseTransactionSchema):
     # pass
 
 
+class TransactionPageSchema(BaseSchema):
+    """A page of transactions, newest first."""
+    items: list[PublicTransactionSchema] = Field(description="The transactions on this page")
+    next_cursor: Optional[str] = Field(None, description="Pass as `cursor` to fetch the next page, null on the last page")
+
+
 class UpdateTransactionRequestSchema(BaseSchema):
     """Update transaction request schema."""
     # account_id: str = Field(description="The ID of the account this transaction belongs to")
@@ -86,21 +93,80 @@ class UpdateTransactionRequestSchema(BaseSchema):
     description: str = Field(description="Description of the transaction", max_length=255)
     transaction_method: TransactionMethod = Field(description="The method of the transaction")
     transaction_method_id: str = Field(description="The ID of the transaction method such as a card id", default=None)
-    transaction_status: TransactionStatus = Field(description="The status of the transaction")
-    processed_at: datetime = Field(description="The date and time the transaction was processed in UTC", default=None)
-    voided_at: datetime = Field(description="The date and time the transaction was voided in UTC", default=None)
+    # The status and its timestamps only change by processing or voiding, which post to the balance.
 
 
 class VoidTransactionRequestSchema(BaseSchema):
     """Void transaction request schema."""
-    transaction_id: str = Field(description="The ID of the transaction to void")
     account_id: str = Field(description="The ID of the account this transaction belongs to")
     voided_at: datetime = Field(description="The date and time the transaction was voided in UTC", default=None)
 
 
 class ProcessTransactionRequestSchema(BaseSchema): 
     """Process transaction request schema."""
-    transaction_id: str = Field(description="The ID of the transaction to process")
     account_id: str = Field(description="The ID of the account this transaction belongs to")
     processed_at: datetime = Field(description="The date and time the transaction was processed in UTC", default=None)
 
+
+class BatchStatusRequestSchema(BaseSchema):
+    """Which transactions a batch process or void applies to: a list of ids, or an account's pending transactions."""
+    transaction_ids: Optional[list[str]] = Field(None, description="The IDs of the transactions")
+    account_id: Optional[str] = Field(None, description="Only change this account's transactions; without transaction_ids, change all its pending transactions")
+    created_before: Optional[datetime] = Field(None, description="Without transaction_ids, only change the pending transactions created before this time")
+
+
+class BatchProcessTransactionsRequestSchema(BatchStatusRequestSchema):
+    """Batch process transactions request schema."""
+    processed_at: datetime = Field(description="The date and time the transactions were processed in UTC", default=None)
+
+
+class BatchVoidTransactionsRequestSchema(BatchStatusRequestSchema):
+    """Batch void transactions request schema."""
+    voided_at: datetime = Field(description="The date and time the transactions were voided in UTC", default=None)
+
+
+class BatchStatusResultSchema(BaseSchema):
+    """Batch process or void result schema."""
+    matched: int = Field(description="The number of transactions asked for, or found by the filter")
+    updated: int = Field(description="The number of transactions processed or voided")
+    failed: int = Field(description="The number of transactions that were not")
+    failed_ids: list[str] = Field(description="The IDs of the transactions that were not, up to the configured reporting limit")
+
+
+class BatchTransactionErrorSchema(BaseSchema):
+    """A row of a batch upload that was not created."""
+    row: int = Field(description="The zero-based position of the row in the upload")
+    detail: str = Field(description="Why the row was rejected")
+
+
+class BatchTransactionResultSchema(BaseSchema):
+    """Batch transaction upload result schema."""
+    received: int = Field(description="The number of rows read from the upload")
+    created: int = Field(description="The number of transactions created")
+    failed: int = Field(description="The number of rows that were not created")
+    errors: list[BatchTransactionErrorSchema] = Field(description="The failed rows, up to the configured reporting limit")
+
+
+class TransactionTotalsSchema(BaseSchema):
+    """The count and total amount per status of an account's transactions of one type."""
+    transaction_type: TransactionType = Field(description="The type of the transactions")
+    pending_count: int = Field(description="The number of pending transactions")
+    pending_amount: float = Field(description="The total amount of the pending transactions")
+    processed_count: int = Field(description="The number of processed transactions")
+    processed_amount: float = Field(description="The total amount of the processed transactions")
+    void_count: int = Field(description="The number of voided transactions")
+    void_amount: float = Field(description="The total amount of the voided transactions")
+
+
+class AccountSummarySchema(BaseSchema):
+    """An account's transaction totals over a range of days."""
+    account_id: str = Field(description="The ID of the account")
+    from_day: Optional[date] = Field(None, alias="from", description="The first day included, in UTC, or null from the first transaction")
+    to_day: Optional[date] = Field(None, alias="to", description="The day the summary stops before, in UTC, or null up to now")
+    totals: list[TransactionTotalsSchema] = Field(description="One entry per transaction type with any transactions in the range")
+
+
+class ExportFormat(str, Enum):
+    CSV = 'csv'
+    NDJSON = 'ndjson'
+    PARQUET = 'parquet'
@@ -0,0 +1,61 @@
+from ..cache import TTLCache
+from .. import config
+
+from ...db.repository import AccountRepository
+
+
+# Shared by every request in this worker. Other workers keep their own copies,
+# so a write made elsewhere is visible here after at most ACCOUNT_CACHE_TTL.
+account_cache = TTLCache(maxsize=config.ACCOUNT_CACHE_SIZE, ttl=config.ACCOUNT_CACHE_TTL)
+balance_cache = TTLCache(maxsize=config.ACCOUNT_CACHE_SIZE, ttl=config.ACCOUNT_CACHE_TTL)
+
+
+class CachedAccountRepository:
+    """Read-through cache in front of an account repository.
+
+    Account and balance reads are served from the caches; the writes that can
+    change them drop the cached entry. Every other call goes straight through.
+    """
+
+    def __init__(self, account_repo: AccountRepository):
+        self.account_repo = account_repo
+
+    def __getattr__(self, name):
+        return getattr(self.account_repo, name)
+
+    async def get_account_by_id(self, account_id: str) -> dict:
+        account = account_cache.get(account_id)
+        if account is None:
+            # Taken before the read, so a write that lands during it keeps its result out of the cache.
+            generation = account_cache.generation(account_id)
+            account = await self.account_repo.get_account_by_id(account_id)
+            if account:
+                account_cache.set(account_id, account, generation)
+        return account
+
+    async def get_account_balance(self, account_id: str) -> dict:
+        account_balance = balance_cache.get(account_id)
+        if account_balance is None:
+            generation = balance_cache.generation(account_id)
+            account_balance = await self.account_repo.get_account_balance(account_id)
+            if account_balance:
+                balance_cache.set(account_id, account_balance, generation)
+        return account_balance
+
+    async def update_account(self, account):
+        account_cache.invalidate(account.id)
+        updated = await self.account_repo.update_account(account)
+        account_cache.invalidate(account.id)
+        return updated
+
+    async def update_sub_ledger_account(self, sub_ledger_account):
+        account_cache.invalidate(sub_ledger_account.id)
+        updated = await self.account_repo.update_sub_ledger_account(sub_ledger_account)
+        account_cache.invalidate(sub_ledger_account.id)
+        return updated
+
+    async def update_account_balance(self, account_id: str, balance: float = None, available_balance: float = None) -> dict:
+        balance_cache.invalidate(account_id)
+        updated = await self.account_repo.update_account_balance(account_id, balance, available_balance)
+        balance_cache.invalidate(account_id)
+        return updated
@@ -1,60 +1,66 @@
 from fastapi import Depends, HTTPException, status
 from ...api.accounts.schema import NewSubLedgerAccountRequestSchema, SubLedgerAccountSchema, PublicAccountSchema, NewGeneralLedgerAccountRequestSchema, GeneralLedgerAccountSchema, NewLinkedAccountRequestSchema, LinkedAccountSchema, AccountBalanceSchema
 
+import json
+import logging
 from time import time
-from datetime import datetime
+from typing import AsyncIterator
+from datetime import datetime, timezone
 from uuid import uuid4
 
-from ...db.sqlite.accounts.db import AccountsDBController as AccountRepository
+from ...api.responses import dumps
+
+from ...db.repository import AccountRepository
+from ...db.registry import get_account_repository
+from .cache import CachedAccountRepository
+from .. import config
+from ..pagination import encode_cursor, decode_cursor
+
+
+logger = logging.getLogger(__name__)
+
 
 class AccountService:
-    def __init__(self, account_repo: AccountRepository = AccountRepository()):
+    def __init__(self, account_repo: AccountRepository):
         self.account_repo = account_repo
 
-    async def get_account(self, account_id: str) -> PublicAccountSchema:
+    async def get_account(self, account_id: str) -> dict:
         try: 
             account = await self.account_repo.get_account_by_id(account_id)
             if not account:
-                # print(e)
-                return None
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Account not found")
 
             # balance = await self.get_account_balance(account_id)
 
-            account_response = PublicAccountSchema(**account)
-            return account_response
+            return PublicAccountSchema.dump(account)
 
-        except Exception as e:
-            print(e)
+        except HTTPException:
+            raise
+        except Exception:
+            logger.exception("Could not get account %s", account_id)
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Account not found")
 
 
-    async def create_general_ledger_account(self, request: NewGeneralLedgerAccountRequestSchema) -> GeneralLedgerAccountSchema:
+    async def create_general_ledger_account(self, request: NewGeneralLedgerAccountRequestSchema) -> dict:
         try: 
-            new_created_account = GeneralLedgerAccountSchema(**request.dict(),
-            id=uuid4().hex,
-            created_at=time().__trunc__(),
-            updated_at=time().__trunc__(),
-            )
-            print(new_created_account.dict())
-
-            new_account_balance = AccountBalanceSchema(**request.dict(),
-            id=new_created_account.id,
-            created_at=time().__trunc__(),
-            updated_at=time().__trunc__(),
-            )
-            print(new_account_balance.dict())
-
-            created = await self.account_repo.create_account(new_created_account.dict())
-            balance = await self.account_repo.create_account_balance(new_account_balance.dict())
-
-            print(created, balance)
+            # The request is already validated, so build the rows from it directly.
+            now = datetime.fromtimestamp(time().__trunc__(), timezone.utc)
+            new_account = {**request.dict(), "id": uuid4().hex, "balance": 0.0, "available_balance": 0.0, "created_at": now, "updated_at": now}
+            new_account["metadata"] = new_account["metadata"] or {}
+            new_account_balance = {"id": new_account["id"], "balance": 0.0, "available_balance": 0.0, "created_at": now, "updated_at": now}
+
+            created = await self.account_repo.create_account(new_account)
+            balance = await self.account_repo.create_account_balance(new_account_balance)
+
             if not created or not balance:
                 raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Account not created")
             
-            return PublicAccountSchema(**new_created_account.dict())
+            return GeneralLedgerAccountSchema.dump(new_account)
         
-        except Exception as e:
-            print(e)
+        except HTTPException:
+            raise
+        except Exception:
+            logger.exception("Could not create account for holder %s", request.account_holder_id)
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Account not created")
         
 
@@ -113,17 +119,31 @@ class AccountService:
         return created_account
 
 
-    async def get_all_accounts(self, account_holder_id: str = None) -> list[PublicAccountSchema]:
-        try: 
-            accounts = await self.account_repo.get_all_accounts(account_holder_id=account_holder_id)
-            if not accounts:
-                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Accounts not found")
+    async def get_all_accounts(self, account_holder_id: str = None, active: bool = None, cursor: str = None, limit: int = config.ACCOUNT_PAGE_SIZE) -> AsyncIterator[bytes]:
+        """Return a page of accounts as JSON chunks, serialized one row at a time as they are read."""
+        try:
+            after = decode_cursor(cursor)[0] if cursor else None
+        except (ValueError, IndexError):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
 
-            accounts_response = [PublicAccountSchema(**account) for account in accounts]
-            return accounts_response
+        accounts = self.account_repo.get_all_accounts(account_holder_id=account_holder_id, active=active, after=after, limit=limit + 1)
+        return self._stream_account_page(accounts, limit)
 
-        except Exception as e:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unable to retrieve accounts")
+
+    @staticmethod
+    async def _stream_account_page(accounts: AsyncIterator, limit: int) -> AsyncIterator[bytes]:
+        yield b'{"items":['
+        count, last_id = 0, None
+        async for account in accounts:
+            if count == limit:
+                # The extra row only tells us there is another page.
+                break
+            yield (b"," if count else b"") + dumps(PublicAccountSchema.dump(account))
+            count, last_id = count + 1, account.id
+        else:
+            last_id = None
+
+        yield b'],"nextCursor":' + json.dumps(last_id and encode_cursor(last_id)).encode() + b"}"
 
 
     async def get_all_sub_ledger_accounts(self, account_holder_id: str = None) -> list[SubLedgerAccountSchema]:
@@ -167,15 +187,25 @@ class AccountService:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unable to retrieve accounts")
 
 
-    async def get_account_balance(self, account_id: str) -> AccountBalanceSchema:
+    async def get_account_balance(self, account_id: str) -> dict:
         try:
             account_balance = await self.account_repo.get_account_balance(account_id)
             if not account_balance:
-                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Account not found")
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unable to retrieve account balance")
             
-            return AccountBalanceSchema(**account_balance)
+            return AccountBalanceSchema.dump({
+                **account_balance,
+                # Balances keep epoch seconds, the schema shows datetimes.
+                "created_at": datetime.fromtimestamp(account_balance["created_at"], timezone.utc),
+                "updated_at": datetime.fromtimestamp(account_balance["updated_at"], timezone.utc),
+            })
         
-        except Exception as e:
-            print(e)
+        except HTTPException:
+            raise
+        except Exception:
+            logger.exception("Could not get the balance of account %s", account_id)
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unable to retrieve account balance")
 
+
+async def get_account_service(account_repo: AccountRepository = Depends(get_account_repository)) -> AccountService:
+    return AccountService(CachedAccountRepository(account_repo))
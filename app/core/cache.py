@@ -0,0 +1,82 @@
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Hashable, Optional
+
+
+class TTLCache:
+    """A bounded LRU cache whose entries also expire after `ttl` seconds.
+
+    Not thread safe; it is meant to be used from the event loop only.
+
+    A read-through caller takes generation(key) before reading the source and
+    passes it to set(), which then skips a value invalidated in the meantime.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        # The invalidation count at each key's latest invalidation, for the
+        # maxsize most recent ones; older keys share the newest count dropped.
+        self._invalidated: OrderedDict = OrderedDict()
+        self._invalidations = 0
+        self._dropped = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        expires_at, value = entry
+        if expires_at <= monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def generation(self, key: Hashable) -> int:
+        return self._invalidated.get(key, self._dropped)
+
+    def set(self, key: Hashable, value: Any, generation: Optional[int] = None):
+        if self.maxsize <= 0:
+            return
+        if generation is not None and generation != self.generation(key):
+            return
+        self._data[key] = (monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        self._data.pop(key, None)
+        self._invalidations += 1
+        self._invalidated[key] = self._invalidations
+        self._invalidated.move_to_end(key)
+        while len(self._invalidated) > max(self.maxsize, 1):
+            _, self._dropped = self._invalidated.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+        self._invalidated.clear()
+        self._invalidations += 1
+        self._dropped = self._invalidations
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,79 @@
+from decouple import config
+
+
+# SQLite
+SQLITE_BUSY_TIMEOUT = config("SQLITE_BUSY_TIMEOUT", default=5000, cast=int) # ms
+SQLITE_MMAP_SIZE = config("SQLITE_MMAP_SIZE", default=268435456, cast=int) # bytes
+SQLITE_CACHE_SIZE = config("SQLITE_CACHE_SIZE", default=-64000, cast=int) # pages, or KiB when negative
+SQLITE_READ_POOL_SIZE = config("SQLITE_READ_POOL_SIZE", default=8, cast=int)
+TRANSACTION_SHARDS = config("TRANSACTION_SHARDS", default=1, cast=int) # SQLite files the ledger is split across; fixed once they hold data
+
+# Group commit for transaction inserts
+TRANSACTION_GROUP_COMMIT_SIZE = config("TRANSACTION_GROUP_COMMIT_SIZE", default=256, cast=int) # rows
+TRANSACTION_GROUP_COMMIT_DELAY_MS = config("TRANSACTION_GROUP_COMMIT_DELAY_MS", default=5, cast=int)
+
+# Bulk transaction ingestion
+TRANSACTION_BATCH_CHUNK_SIZE = config("TRANSACTION_BATCH_CHUNK_SIZE", default=5000, cast=int) # rows per executemany
+TRANSACTION_BATCH_MAX_ERRORS = config("TRANSACTION_BATCH_MAX_ERRORS", default=1000, cast=int) # errors reported per upload
+TRANSACTION_STATUS_BATCH_CHUNK_SIZE = config("TRANSACTION_STATUS_BATCH_CHUNK_SIZE", default=500, cast=int) # ids per UPDATE when processing or voiding in bulk
+TRANSACTION_STATUS_BATCH_MAX_IDS = config("TRANSACTION_STATUS_BATCH_MAX_IDS", default=100000, cast=int) # ids per request
+
+# Pagination
+TRANSACTION_PAGE_SIZE = config("TRANSACTION_PAGE_SIZE", default=50, cast=int)
+TRANSACTION_PAGE_SIZE_MAX = config("TRANSACTION_PAGE_SIZE_MAX", default=500, cast=int)
+ACCOUNT_PAGE_SIZE = config("ACCOUNT_PAGE_SIZE", default=50, cast=int)
+ACCOUNT_PAGE_SIZE_MAX = config("ACCOUNT_PAGE_SIZE_MAX", default=500, cast=int)
+
+# Account cache
+ACCOUNT_CACHE_SIZE = config("ACCOUNT_CACHE_SIZE", default=10000, cast=int) # entries per cache, 0 disables
+ACCOUNT_CACHE_TTL = config("ACCOUNT_CACHE_TTL", default=30, cast=float) # seconds
+
+# Idempotency-Key handling for POST /transactions/
+IDEMPOTENCY_KEY_TTL = config("IDEMPOTENCY_KEY_TTL", default=86400, cast=float) # seconds a key and its response are kept
+IDEMPOTENCY_CACHE_SIZE = config("IDEMPOTENCY_CACHE_SIZE", default=10000, cast=int) # responses held in memory per worker, 0 disables
+IDEMPOTENCY_CACHE_TTL = config("IDEMPOTENCY_CACHE_TTL", default=300, cast=float) # seconds
+IDEMPOTENCY_WAIT_TIMEOUT = config("IDEMPOTENCY_WAIT_TIMEOUT", default=10, cast=float) # seconds to wait on another worker's request with the same key
+IDEMPOTENCY_PURGE_INTERVAL = config("IDEMPOTENCY_PURGE_INTERVAL", default=60, cast=float) # seconds between deletes of expired keys
+
+# Balance snapshots, taken at multiples of the interval since the epoch: daily ones at midnight UTC
+BALANCE_SNAPSHOT_INTERVAL = config("BALANCE_SNAPSHOT_INTERVAL", default=86400, cast=float) # seconds, 0 disables the job
+BALANCE_SNAPSHOT_DELAY = config("BALANCE_SNAPSHOT_DELAY", default=60, cast=float) # seconds after a snapshot time before it is taken
+BALANCE_SNAPSHOT_RETRY = config("BALANCE_SNAPSHOT_RETRY", default=60, cast=float) # seconds before trying a failed snapshot again
+
+# Archiving settled transactions to monthly files, for the SQLite backend
+TRANSACTION_ARCHIVE_AFTER_DAYS = config("TRANSACTION_ARCHIVE_AFTER_DAYS", default=0, cast=int) # days after which processed and voided transactions are archived, 0 disables
+TRANSACTION_ARCHIVE_INTERVAL = config("TRANSACTION_ARCHIVE_INTERVAL", default=3600, cast=float) # seconds between archive runs
+TRANSACTION_ARCHIVE_BATCH_SIZE = config("TRANSACTION_ARCHIVE_BATCH_SIZE", default=1000, cast=int) # transactions moved per commit
+TRANSACTION_ARCHIVE_DIR = config("TRANSACTION_ARCHIVE_DIR", default="archive")
+TRANSACTION_ARCHIVE_OPEN_FILES = config("TRANSACTION_ARCHIVE_OPEN_FILES", default=16, cast=int) # archive files kept open between reads, the least recently used idle ones are closed past this
+
+# Settling pending transactions in the background
+SETTLEMENT_INTERVAL = config("SETTLEMENT_INTERVAL", default=0, cast=float) # seconds between settlement runs, 0 disables the job
+SETTLEMENT_AFTER = config("SETTLEMENT_AFTER", default=0, cast=float) # seconds a transaction stays pending before it is settled
+SETTLEMENT_BATCH_SIZE = config("SETTLEMENT_BATCH_SIZE", default=500, cast=int) # transactions per batch
+SETTLEMENT_CONCURRENCY = config("SETTLEMENT_CONCURRENCY", default=2, cast=int) # batches processed at once
+SETTLEMENT_MAX_LATENCY_MS = config("SETTLEMENT_MAX_LATENCY_MS", default=250, cast=float) # mean request time over the last few seconds above which settling pauses
+SETTLEMENT_MAX_QUEUE_DEPTH = config("SETTLEMENT_MAX_QUEUE_DEPTH", default=1000, cast=int) # writes queued for the group commit writer above which settling pauses
+SETTLEMENT_PAUSE = config("SETTLEMENT_PAUSE", default=1, cast=float) # seconds between checks while paused
+
+# Transaction export
+TRANSACTION_EXPORT_CHUNK_SIZE = config("TRANSACTION_EXPORT_CHUNK_SIZE", default=1000, cast=int) # rows read, encoded and sent at a time
+
+# Storage
+STORAGE_BACKEND = config("STORAGE_BACKEND", default="sqlite") # sqlite, memory or journal
+
+# Journal backend
+JOURNAL_PATH = config("JOURNAL_PATH", default="accounts.jsonl")
+JOURNAL_COMPACT_RATIO = config("JOURNAL_COMPACT_RATIO", default=2.0, cast=float) # journal lines per live row before compacting
+JOURNAL_COMPACT_MIN_ENTRIES = config("JOURNAL_COMPACT_MIN_ENTRIES", default=10000, cast=int) # never compact a shorter journal
+JOURNAL_FSYNC = config("JOURNAL_FSYNC", default=False, cast=bool) # fsync the journal before a write returns, not just flush it
+
+# SQL profiling, for staging and debugging only: it runs EXPLAIN QUERY PLAN for each new statement
+SQL_PROFILE = config("SQL_PROFILE", default=False, cast=bool)
+SQL_PROFILE_N_PLUS_ONE = config("SQL_PROFILE_N_PLUS_ONE", default=3, cast=int) # runs of one statement that count as N+1
+
+# Logging
+LOG_LEVEL = config("LOG_LEVEL", default="INFO")
+LOG_LEVELS = config("LOG_LEVELS", default="") # per-logger overrides, e.g. app.db=DEBUG,app.sql_profile=WARNING
+LOG_FORMAT = config("LOG_FORMAT", default="json") # json or text
+LOG_DEBUG_SAMPLE_RATE = config("LOG_DEBUG_SAMPLE_RATE", default=1.0, cast=float) # fraction of DEBUG records kept
@@ -0,0 +1,52 @@
+import asyncio
+import contextvars
+from typing import Optional
+
+
+class BackgroundJob:
+    """Work a worker does on its own schedule, started and stopped by the app's lifespan.
+
+    Subclasses implement _run, which loops until stopping is set, waiting
+    between runs with wait(), and say whether they are switched on by
+    overriding enabled. A long run checks stopping between its steps.
+
+    Stopping lets the run in progress finish rather than cancelling it. A
+    run cancelled in the middle of a query never gets its connection back,
+    and the connection's thread then keeps the process from exiting.
+    """
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._stop: Optional[asyncio.Event] = None
+
+    @property
+    def enabled(self) -> bool:
+        return True
+
+    @property
+    def stopping(self) -> bool:
+        return self._stop is not None and self._stop.is_set()
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._stop = asyncio.Event()
+            # An empty context, so the job doesn't carry the request id of whatever started it.
+            self._task = contextvars.Context().run(asyncio.create_task, self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stop.set()
+        # Shielded, so cancelling the shutdown doesn't cancel the run after all.
+        await asyncio.shield(self._task)
+        self._task = None
+
+    async def wait(self, seconds: float):
+        """Sleep for up to `seconds` between runs, returning early if the job is stopped."""
+        try:
+            await asyncio.wait_for(self._stop.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self):
+        raise NotImplementedError
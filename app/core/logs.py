@@ -0,0 +1,112 @@
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+from . import config
+
+
+# The id of the request being handled by the current task, "-" outside of one.
+request_id: ContextVar[str] = ContextVar("request_id", default="-")
+
+# Attributes every LogRecord has. Anything else on a record came in through extra=.
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamps each record with the id of the request that logged it."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a `rate` fraction of the records below INFO and every record at INFO or above."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.INFO or self.rate >= 1 or random.random() < self.rate
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line, with any extra= fields alongside the standard ones."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _DeferredQueueHandler(QueueHandler):
+    # QueueHandler.prepare() formats the message in the logging thread so the
+    # record can be pickled. This queue never leaves the process, so pass the
+    # record as it is and leave all the formatting to the listener's thread.
+    # The flip side: arguments are formatted later, so log values, not objects
+    # that are about to change.
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+_listener: Optional[QueueListener] = None
+
+
+def setup_logging(
+    level: str = config.LOG_LEVEL,
+    levels: str = config.LOG_LEVELS,
+    format: str = config.LOG_FORMAT,
+    debug_sample_rate: float = config.LOG_DEBUG_SAMPLE_RATE,
+) -> QueueListener:
+    """Route every log record through a queue to a background thread that formats and writes it.
+
+    Logging call sites only check the level, stamp the request id and put the
+    record on the queue, so a slow stdout never stalls the event loop. Safe to
+    call more than once: later calls return the listener already running.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    stream = logging.StreamHandler(sys.stdout)
+    if format == "json":
+        stream.setFormatter(JSONFormatter())
+    else:
+        stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"))
+
+    handler = _DeferredQueueHandler(queue.SimpleQueue())
+    handler.addFilter(RequestIdFilter())
+    handler.addFilter(SamplingFilter(debug_sample_rate))
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    # Python warnings, such as SQLAlchemy's, go through the queue too instead of straight to stderr.
+    logging.captureWarnings(True)
+    root.setLevel(level.upper())
+    for override in filter(None, (override.strip() for override in levels.split(","))):
+        name, _, logger_level = override.partition("=")
+        logging.getLogger(name.strip()).setLevel(logger_level.strip().upper())
+
+    _listener = QueueListener(handler.queue, stream, respect_handler_level=True)
+    _listener.start()
+    # Write out whatever is still queued when the worker exits.
+    atexit.register(_listener.stop)
+    return _listener
@@ -0,0 +1,185 @@
+from bisect import bisect_left
+from contextvars import ContextVar
+from time import monotonic
+from typing import Callable, Iterator, Optional
+
+
+class Metric:
+    """A named metric with a value per combination of label values.
+
+    Pass `function` to read the values at scrape time instead; it returns a
+    dict of label value tuples to values.
+    """
+
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), function: Callable[[], dict] = None):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.function = function
+        self.values: dict[tuple, float] = {}
+
+    def samples(self) -> Iterator[tuple[str, list, float]]:
+        values = self.function() if self.function else self.values
+        for label_values, value in values.items():
+            yield self.name, list(zip(self.labels, label_values)), value
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *label_values, amount: float = 1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def inc(self, *label_values, amount: float = 1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount: float = 1):
+        self.values[label_values] = self.values.get(label_values, 0) - amount
+
+    def set(self, value: float, *label_values):
+        self.values[label_values] = value
+
+
+class Histogram(Metric):
+    """Counts observations into cumulative `le` buckets, Prometheus style."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = ()):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count per bucket..., count above the last bucket, sum]
+        self.values: dict[tuple, list] = {}
+
+    def observe(self, value: float, *label_values):
+        counts = self.values.get(label_values)
+        if counts is None:
+            counts = self.values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def samples(self) -> Iterator[tuple[str, list, float]]:
+        for label_values, counts in self.values.items():
+            labels = list(zip(self.labels, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield f"{self.name}_bucket", labels + [("le", _format(bound))], cumulative
+            cumulative += counts[-2]
+            yield f"{self.name}_bucket", labels + [("le", "+Inf")], cumulative
+            yield f"{self.name}_count", labels, cumulative
+            yield f"{self.name}_sum", labels, counts[-1]
+
+
+class RecentAverage:
+    """The mean of the values observed over roughly the last `window` seconds.
+
+    Values are added up in buckets `window` seconds long; the mean covers the
+    current bucket and the one before, so it follows load as it changes and
+    falls to 0 when nothing has been observed for a while.
+    """
+
+    def __init__(self, window: float):
+        self.window = window
+        self.started = 0.0
+        # [count, sum] for the current bucket and the one before
+        self.current = [0, 0.0]
+        self.previous = [0, 0.0]
+
+    def _roll(self, now: float):
+        if now - self.started >= self.window:
+            self.previous = self.current if now - self.started < 2 * self.window else [0, 0.0]
+            self.current = [0, 0.0]
+            self.started = now
+
+    def observe(self, value: float):
+        self._roll(monotonic())
+        self.current[0] += 1
+        self.current[1] += value
+
+    def value(self) -> float:
+        self._roll(monotonic())
+        count = self.current[0] + self.previous[0]
+        return (self.current[1] + self.previous[1]) / count if count else 0.0
+
+
+def _format(value: float) -> str:
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                if labels:
+                    name += "{" + ",".join(f'{label}="{_escape(label_value)}"' for label, label_value in labels) + "}"
+                lines.append(f"{name} {_format(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+http_requests_in_flight = registry.register(Gauge(
+    "http_requests_in_flight", "Requests being handled right now"))
+http_request_duration_seconds = registry.register(Histogram(
+    "http_request_duration_seconds", "Time to handle a request, until the last body chunk is sent",
+    labels=("method", "route", "status"), buckets=LATENCY_BUCKETS))
+http_request_db_queries = registry.register(Histogram(
+    "http_request_db_queries", "SQL statements executed while handling a request",
+    labels=("method", "route"), buckets=COUNT_BUCKETS))
+http_request_db_seconds = registry.register(Histogram(
+    "http_request_db_seconds", "Time spent executing SQL while handling a request",
+    labels=("method", "route"), buckets=LATENCY_BUCKETS))
+db_query_duration_seconds = registry.register(Histogram(
+    "db_query_duration_seconds", "Time to execute one SQL statement",
+    labels=("database",), buckets=LATENCY_BUCKETS))
+
+
+# Mean request time lately, for work that should back off while requests slow down.
+recent_request_seconds = RecentAverage(window=10)
+
+
+class RequestStats:
+    __slots__ = ("queries", "query_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+
+
+# The stats of the request being handled by the current task, if any.
+request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def record_query(database: str, seconds: float):
+    db_query_duration_seconds.observe(seconds, database)
+    stats = request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.query_seconds += seconds
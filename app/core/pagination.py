@@ -0,0 +1,28 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime, timezone
+
+
+def encode_cursor(*values) -> str:
+    """Pack the sort key of the last row on a page into an opaque cursor."""
+    key = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return urlsafe_b64encode(json.dumps(key, separators=(",", ":")).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> list:
+    """Unpack a cursor made by encode_cursor, a list of strings. Raises ValueError if it is malformed."""
+    try:
+        key = json.loads(urlsafe_b64decode(cursor.encode()))
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+    # Every key encode_cursor packs is an id or an ISO timestamp.
+    if not isinstance(key, list) or not all(isinstance(value, str) for value in key):
+        raise ValueError("Invalid cursor")
+    return key
+
+
+def to_utc_naive(value: datetime) -> datetime:
+    """Timestamps are stored as naive UTC, so compare against them the same way."""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
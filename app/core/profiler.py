@@ -0,0 +1,91 @@
+from collections import Counter
+from contextvars import ContextVar
+from typing import Optional
+
+
+class ProfiledQuery:
+    __slots__ = ("database", "statement", "parameters", "seconds", "plan")
+
+    def __init__(self, database: str, statement: str, parameters, seconds: float, plan: list[str]):
+        self.database = database
+        self.statement = statement
+        self.parameters = parameters
+        self.seconds = seconds
+        self.plan = plan
+
+
+class RequestProfile:
+    """Every SQL statement run while handling one request, and what looks wasteful about them.
+
+    - repeated: the same statement run again with the same parameters, so the
+      later runs could reuse the first result.
+    - n_plus_one: the same statement run at least n_plus_one_threshold times
+      with different parameters, typically once per row of an earlier result.
+    - full_scans: statements whose query plan scans a whole table instead of
+      searching an index.
+    """
+
+    def __init__(self, n_plus_one_threshold: int = 3):
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.queries: list[ProfiledQuery] = []
+
+    def record(self, query: ProfiledQuery):
+        self.queries.append(query)
+
+    @property
+    def seconds(self) -> float:
+        return sum(query.seconds for query in self.queries)
+
+    def repeated(self) -> dict[str, int]:
+        runs = Counter((query.statement, repr(query.parameters)) for query in self.queries)
+        repeated = Counter()
+        for (statement, _), count in runs.items():
+            if count > 1:
+                repeated[statement] += count - 1
+        return dict(repeated)
+
+    def n_plus_one(self) -> dict[str, int]:
+        distinct_runs = Counter(statement for statement, _ in {(query.statement, repr(query.parameters)) for query in self.queries})
+        return {statement: count for statement, count in distinct_runs.items() if count >= self.n_plus_one_threshold}
+
+    def full_scans(self) -> list[str]:
+        scans = {}
+        for query in self.queries:
+            if any(step.startswith("SCAN") and "USING" not in step for step in query.plan):
+                scans[query.statement] = None
+        return list(scans)
+
+    def header(self) -> str:
+        """A one-line summary for the X-SQL-Profile response header."""
+        return (
+            f"queries={len(self.queries)}; time_ms={self.seconds * 1000:.3f}; "
+            f"repeated={sum(self.repeated().values())}; n_plus_one={len(self.n_plus_one())}; "
+            f"full_scans={len(self.full_scans())}"
+        )
+
+    def report(self) -> dict:
+        return {
+            "queries": len(self.queries),
+            "time_ms": round(self.seconds * 1000, 3),
+            "repeated": self.repeated(),
+            "n_plus_one": self.n_plus_one(),
+            "full_scans": self.full_scans(),
+            "statements": [
+                {
+                    "database": query.database,
+                    "statement": query.statement,
+                    "parameters": repr(query.parameters),
+                    "time_ms": round(query.seconds * 1000, 3),
+                    "plan": query.plan,
+                }
+                for query in self.queries
+            ],
+        }
+
+    @property
+    def flagged(self) -> bool:
+        return bool(self.repeated() or self.n_plus_one() or self.full_scans())
+
+
+# The profile of the request being handled by the current task, when profiling is on.
+request_profile: ContextVar[Optional[RequestProfile]] = ContextVar("request_profile", default=None)
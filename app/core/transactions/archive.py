@@ -0,0 +1,67 @@
+import asyncio
+import logging
+from datetime import datetime
+from time import time
+
+from .. import config
+from ..jobs import BackgroundJob
+from ...db.registry import get_backend
+
+
+logger = logging.getLogger(__name__)
+
+DAY = 86400
+
+
+class TransactionArchiveJob(BackgroundJob):
+    """Moves settled transactions older than `after_days` out of the ledger, every `interval` seconds.
+
+    The cutoff is the midnight UTC at or before now - after_days. Before any
+    transaction is moved, every account's balance is snapshotted at the
+    cutoff, so balances after it never need the archives.
+    """
+
+    def __init__(self, after_days: int, interval: float, batch_size: int):
+        super().__init__()
+        self.after_days = after_days
+        self.interval = interval
+        self.batch_size = batch_size
+
+    @property
+    def enabled(self) -> bool:
+        return self.after_days > 0
+
+    def cutoff(self, now: float) -> datetime:
+        return datetime.utcfromtimestamp((now - self.after_days * DAY) // DAY * DAY)
+
+    async def archive(self, before: datetime) -> int:
+        """Archive every settled transaction created and posted before `before`, one batch per commit, until the job is stopped."""
+        archived = 0
+        async with get_backend().transaction_repository() as repo:
+            await repo.create_balance_snapshots(before)
+            while True:
+                moved = await repo.archive_transactions(before, self.batch_size)
+                archived += moved
+                if moved < self.batch_size or self.stopping:
+                    return archived
+                # Let requests in between batches.
+                await asyncio.sleep(0)
+
+    async def _run(self):
+        while not self.stopping:
+            before = self.cutoff(time())
+            try:
+                archived = await self.archive(before)
+            except Exception:
+                logger.exception("Could not archive the transactions from before %s", before)
+            else:
+                if archived:
+                    logger.info("Archived %d transactions from before %s", archived, before)
+            await self.wait(self.interval)
+
+
+transaction_archive = TransactionArchiveJob(
+    after_days=config.TRANSACTION_ARCHIVE_AFTER_DAYS,
+    interval=config.TRANSACTION_ARCHIVE_INTERVAL,
+    batch_size=config.TRANSACTION_ARCHIVE_BATCH_SIZE,
+)
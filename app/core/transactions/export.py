@@ -0,0 +1,122 @@
+import csv
+import io
+from datetime import datetime
+from decimal import Decimal
+from enum import Enum
+from typing import AsyncIterator, Callable
+
+from ...api.responses import dumps
+from ...api.transactions.schema import ExportFormat, PublicTransactionSchema
+
+
+# Chunks of rows shaped by PublicTransactionSchema.dump, in its field order.
+Chunks = AsyncIterator[list[dict]]
+
+COLUMNS = [field.alias for field in PublicTransactionSchema.__fields__.values()]
+
+
+def _csv_value(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, Decimal):
+        # As the JSON responses send it.
+        return str(float(value))
+    return str(value)
+
+
+async def encode_csv(chunks: Chunks) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # The header goes out before the first query runs.
+    writer.writerow(COLUMNS)
+    yield buffer.getvalue().encode()
+    async for rows in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([_csv_value(value) for value in row.values()] for row in rows)
+        yield buffer.getvalue().encode()
+
+
+async def encode_ndjson(chunks: Chunks) -> AsyncIterator[bytes]:
+    async for rows in chunks:
+        yield b"".join(dumps(row) + b"\n" for row in rows)
+
+
+class _Sink(io.RawIOBase):
+    """A write-only file that hands back what was written since it was last drained."""
+
+    def __init__(self):
+        self.written = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.written.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def drain(self) -> bytes:
+        data, self.written = b"".join(self.written), []
+        return data
+
+
+def _parquet_schema(pa):
+    timestamp = pa.timestamp("us", tz="UTC")
+    types = {
+        "amount": pa.float64(),
+        "disputed": pa.bool_(),
+        "createdAt": timestamp,
+        "updatedAt": timestamp,
+        "processedAt": timestamp,
+        "voidedAt": timestamp,
+    }
+    return pa.schema([(column, types.get(column, pa.string())) for column in COLUMNS])
+
+
+def _parquet_value(value):
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+async def encode_parquet(chunks: Chunks) -> AsyncIterator[bytes]:
+    """One row group per chunk, each sent as soon as it is written; the file's footer comes last."""
+    # Optional: only exports in Parquet need pyarrow installed.
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _parquet_schema(pa)
+    sink = _Sink()
+    writer = pq.ParquetWriter(sink, schema)
+    header = sink.drain()
+    if header:
+        yield header
+    try:
+        async for rows in chunks:
+            columns = {column: [_parquet_value(row[column]) for row in rows] for column in COLUMNS}
+            writer.write_table(pa.table(columns, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+# format -> (media type, encoder)
+EXPORT_FORMATS: dict[ExportFormat, tuple[str, Callable[[Chunks], AsyncIterator[bytes]]]] = {
+    ExportFormat.CSV: ("text/csv", encode_csv),
+    ExportFormat.NDJSON: ("application/x-ndjson", encode_ndjson),
+    ExportFormat.PARQUET: ("application/vnd.apache.parquet", encode_parquet),
+}
@@ -0,0 +1,173 @@
+import asyncio
+import hashlib
+import logging
+from contextlib import suppress
+from time import time
+from typing import Awaitable, Callable, Optional
+
+import orjson
+from fastapi import HTTPException, status
+
+from ..cache import TTLCache
+from .. import config
+from ...db.repository import TransactionRepository
+
+
+# A stored response: (status code, JSON body).
+Response = tuple[int, bytes]
+
+logger = logging.getLogger(__name__)
+
+MAX_KEY_LENGTH = 255
+POLL_INTERVAL = 0.05 # seconds between checks on a key another worker holds
+COMPLETE_ATTEMPTS = 3 # tries at storing a response, POLL_INTERVAL apart and doubling
+
+
+def request_hash(body: dict) -> str:
+    return hashlib.sha256(orjson.dumps(body, default=str, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+class IdempotentRequests:
+    """Runs a request at most once per Idempotency-Key and replays its response to retries.
+
+    The first request with a key claims it in the repository, runs, and stores
+    its response there for `ttl` seconds. Retries are answered from an
+    in-memory cache in front of that, or from a single read of the stored
+    key, so they never reach the write path.
+
+    Concurrent requests with the same key share one run: within a worker they
+    wait on the first request's future; across workers the later ones poll
+    the stored key until its response is in, for up to wait_timeout.
+
+    A request that fails releases its key, so a retry runs it afresh. Once
+    it has its key a request runs to the end and stores its response even if
+    it is cancelled, by the client going away say; if the response can't be
+    stored the key is released rather than left blocking retries until it
+    expires. Reusing a key for a different request body is refused.
+    """
+
+    def __init__(self, ttl: float, cache_size: int, cache_ttl: float, wait_timeout: float, purge_interval: float):
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self.purge_interval = purge_interval
+        # key -> (request hash, response, expires at)
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        # key -> (request hash, future of the response), for the runs in this worker
+        self.in_flight: dict[str, tuple[str, asyncio.Future]] = {}
+        self.last_purge = 0.0
+
+    async def run(self, repo: TransactionRepository, key: str, hash: str, execute: Callable[[], Awaitable[Response]]) -> tuple[Response, bool]:
+        """The response for the request with this key, and whether it is a replay."""
+        if len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Idempotency-Key can be at most {MAX_KEY_LENGTH} characters")
+
+        cached = self.cache.get(key)
+        if cached is not None and cached[2] > time():
+            self._check_hash(cached[0], hash)
+            return cached[1], True
+
+        while key in self.in_flight:
+            shared_hash, shared = self.in_flight[key]
+            self._check_hash(shared_hash, hash)
+            try:
+                # Shielded, so this request being cancelled doesn't cancel the shared run.
+                return await asyncio.shield(shared), True
+            except asyncio.CancelledError:
+                if not shared.cancelled():
+                    raise
+                # The request running it went away before finishing, so take over.
+
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight[key] = (hash, future)
+        try:
+            response, replayed = await self._run_once(repo, key, hash, execute)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark it retrieved: with nobody waiting, asyncio would warn about it.
+            future.exception()
+            raise
+        else:
+            future.set_result(response)
+            return response, replayed
+        finally:
+            del self.in_flight[key]
+
+    async def _run_once(self, repo: TransactionRepository, key: str, hash: str, execute: Callable[[], Awaitable[Response]]) -> tuple[Response, bool]:
+        deadline = time() + self.wait_timeout
+        while True:
+            now = time()
+            stored = await repo.get_idempotency_key(key, now)
+            if stored is None:
+                await self._purge_if_due(repo, now)
+                if await repo.reserve_idempotency_key(key, hash, now, now + self.ttl):
+                    return await self._execute(repo, key, hash, now + self.ttl, execute), False
+                # Another worker claimed it in between; read what it stored.
+                continue
+
+            self._check_hash(stored.request_hash, hash)
+            if stored.status_code is not None:
+                response = (stored.status_code, stored.response.encode())
+                self.cache.set(key, (hash, response, stored.expires_at))
+                return response, True
+
+            if now >= deadline:
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="A request with this Idempotency-Key is still being processed")
+            await asyncio.sleep(POLL_INTERVAL)
+
+    async def _execute(self, repo: TransactionRepository, key: str, hash: str, expires_at: float, execute: Callable[[], Awaitable[Response]]) -> Response:
+        run = asyncio.ensure_future(self._execute_and_store(repo, key, hash, expires_at, execute))
+        try:
+            return await asyncio.shield(run)
+        except asyncio.CancelledError:
+            # Let the run finish and store its response, then pass the cancellation on.
+            with suppress(Exception):
+                await asyncio.shield(run)
+            raise
+
+    async def _execute_and_store(self, repo: TransactionRepository, key: str, hash: str, expires_at: float, execute: Callable[[], Awaitable[Response]]) -> Response:
+        try:
+            response = await execute()
+        except BaseException:
+            await repo.release_idempotency_key(key)
+            raise
+
+        # Cached first, so this worker replays it whatever happens to the stored copy.
+        self.cache.set(key, (hash, response, expires_at))
+        for attempt in range(COMPLETE_ATTEMPTS):
+            try:
+                await repo.complete_idempotency_key(key, response[0], response[1].decode())
+                return response
+            except Exception:
+                logger.warning("Could not store the response for Idempotency-Key %s, attempt %d", key, attempt + 1, exc_info=True)
+                await asyncio.sleep(POLL_INTERVAL * 2 ** attempt)
+
+        # Left reserved, retries in other workers would wait on it and get a
+        # 409 until it expired; released, they run the request again.
+        logger.error("Releasing Idempotency-Key %s, its response could not be stored", key)
+        try:
+            await repo.release_idempotency_key(key)
+        except Exception:
+            logger.exception("Could not release Idempotency-Key %s", key)
+        return response
+
+    async def _purge_if_due(self, repo: TransactionRepository, now: float):
+        if now - self.last_purge >= self.purge_interval:
+            self.last_purge = now
+            await repo.purge_idempotency_keys(now)
+
+    @staticmethod
+    def _check_hash(stored_hash: Optional[str], hash: str):
+        if stored_hash != hash:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Idempotency-Key was already used for a different request")
+
+
+idempotent_requests = IdempotentRequests(
+    ttl=config.IDEMPOTENCY_KEY_TTL,
+    cache_size=config.IDEMPOTENCY_CACHE_SIZE,
+    cache_ttl=config.IDEMPOTENCY_CACHE_TTL,
+    wait_timeout=config.IDEMPOTENCY_WAIT_TIMEOUT,
+    purge_interval=config.IDEMPOTENCY_PURGE_INTERVAL,
+)
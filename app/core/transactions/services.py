@@ -1,67 +1,240 @@
+import logging
+from importlib.util import find_spec
+
 from fastapi import HTTPException, status, Depends
-from typing import Optional
+from pydantic import ValidationError
+from typing import AsyncIterator, Awaitable, Callable, Optional, Union
 from time import time
-from uuid import uuid4
+from datetime import date, datetime
 
 # Import Models and Schemas 
 from ...db.sqlite.transactions.db import TransactionInDBModel, TransactionMethod, TransactionStatus, TransactionType
-from ...api.transactions.schema import UpdateTransactionRequestSchema, ProcessTransactionRequestSchema, VoidTransactionRequestSchema, NewTransactionRequestSchema, PublicTransactionSchema
+from ...api.accounts.schema import AccountBalanceAsOfSchema
+from ...api.transactions.schema import UpdateTransactionRequestSchema, ProcessTransactionRequestSchema, VoidTransactionRequestSchema, NewTransactionRequestSchema, PublicTransactionSchema, BatchTransactionResultSchema, BatchTransactionErrorSchema, TransactionPageSchema, AccountSummarySchema, TransactionTotalsSchema, ExportFormat, BatchStatusRequestSchema, BatchProcessTransactionsRequestSchema, BatchVoidTransactionsRequestSchema, BatchStatusResultSchema
+from ...core import config
+from ...core.pagination import encode_cursor, decode_cursor, to_utc_naive
+from ...core.accounts.cache import balance_cache
+from ...api.responses import dumps
+from ...api.stream import RowTooLong
+from .export import EXPORT_FORMATS
+from .idempotency import Response, idempotent_requests, request_hash
+
+from ...db.repository import PartialCommitError, TransactionRepository
+from ...db.sqlite.shards import new_transaction_id
+from ...db.registry import get_transaction_repository
+
 
-from ...db.sqlite.transactions.db import TransactionsDB
+logger = logging.getLogger(__name__)
 
 
 class TransactionsService:
-    def __init__(self):
-        self.db = TransactionsDB()
+    def __init__(self, db: TransactionRepository):
+        self.db = db
+
+    async def get_transactions(self,
+        account_id: str,
+        transaction_status: TransactionStatus = None,
+        transaction_type: TransactionType = None,
+        transaction_method: TransactionMethod = None,
+        disputed: bool = None,
+        created_from: datetime = None,
+        created_to: datetime = None,
+        cursor: str = None,
+        limit: int = config.TRANSACTION_PAGE_SIZE,
+    ) -> dict:
+        try:
+            before = None
+            if cursor:
+                created_at, transaction_id = decode_cursor(cursor)
+                before = (to_utc_naive(datetime.fromisoformat(created_at)), transaction_id)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
 
-    async def get_transactions(self, account_id: str) -> Optional[list[TransactionInDBModel]]:
         try: 
-            return await self.db.get_transactions(account_id)
+            transactions = await self.db.get_transactions(account_id,
+                transaction_status=transaction_status,
+                transaction_type=transaction_type,
+                transaction_method=transaction_method,
+                disputed=disputed,
+                created_from=to_utc_naive(created_from),
+                created_to=to_utc_naive(created_to),
+                before=before,
+                limit=limit + 1,
+            )
 
-        except Exception as e:
-            print(e)
+        except Exception:
+            logger.exception("Could not get the transactions of account %s", account_id)
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Could not get transactions")
 
+        next_cursor = None
+        if len(transactions) > limit:
+            transactions = transactions[:limit]
+            next_cursor = encode_cursor(transactions[-1].created_at, transactions[-1].id)
+
+        return TransactionPageSchema.dump({
+            "items": [PublicTransactionSchema.dump(transaction) for transaction in transactions],
+            "next_cursor": next_cursor,
+        })
+
+
+    def export_transactions(self, account_id: str, export_format: ExportFormat, chunk_size: int = config.TRANSACTION_EXPORT_CHUNK_SIZE) -> tuple[str, AsyncIterator[bytes]]:
+        """The media type of an export of all the account's transactions, oldest first, and its body as it is read."""
+        if export_format == ExportFormat.PARQUET and find_spec("pyarrow") is None:
+            raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="Parquet export needs pyarrow installed")
+
+        media_type, encode = EXPORT_FORMATS[export_format]
+        return media_type, encode(self._export_rows(account_id, chunk_size))
+
+
+    async def _export_rows(self, account_id: str, chunk_size: int) -> AsyncIterator[list[dict]]:
+        try:
+            async for transactions in self.db.stream_transactions(account_id, chunk_size):
+                yield [PublicTransactionSchema.dump(transaction) for transaction in transactions]
+        except Exception:
+            # The status is long sent; cutting the body short is all that's left to tell the client.
+            logger.exception("Could not export the transactions of account %s", account_id)
+            raise
+
+
+    async def get_balance_as_of(self, account_id: str, as_of: datetime) -> dict:
+        """An account's balance at a point in time, from its latest balance snapshot before then and the postings since."""
+        as_of = to_utc_naive(as_of)
+        try:
+            balance = await self.db.get_balance_as_of(account_id, as_of)
+        except Exception:
+            logger.exception("Could not get the balance of account %s as of %s", account_id, as_of)
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unable to retrieve account balance")
+
+        if balance is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unable to retrieve account balance")
+
+        return AccountBalanceAsOfSchema.dump({"id": account_id, "balance": balance, "as_of": as_of})
+
+
+    async def get_summary(self, account_id: str, from_day: date = None, to_day: date = None) -> dict:
+        """An account's totals per transaction type and status for the days from from_day up to to_day."""
+        if from_day and to_day and from_day > to_day:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="from must not be after to")
+
+        try:
+            totals = await self.db.get_transaction_totals(account_id, from_day=from_day, to_day=to_day)
+        except Exception:
+            logger.exception("Could not get the summary of account %s", account_id)
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Could not get summary")
+
+        return AccountSummarySchema.dump({
+            "account_id": account_id,
+            "from_day": from_day,
+            "to_day": to_day,
+            "totals": [TransactionTotalsSchema.dump(type_totals) for type_totals in totals],
+        })
+
     
-    async def get_transaction(self, transaction_id: str) -> Optional[TransactionInDBModel]:
+    async def get_transaction(self, transaction_id: str) -> dict:
         try: 
-            return await self.db.get_transaction(transaction_id)
+            transaction = await self.db.get_transaction(transaction_id)
 
-        except Exception as e:
-            print(e)
+        except Exception:
+            logger.exception("Could not get transaction %s", transaction_id)
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Could not get transaction")
 
+        if not transaction:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Transaction not found")
+        return PublicTransactionSchema.dump(transaction)
+
     
-    async def create_transaction(self, transaction: NewTransactionRequestSchema) -> Optional[TransactionInDBModel]:
-        try: 
-            new_transaction = TransactionInDBModel(
-                id= str(uuid4().hex),
-                account_id=transaction.account_id,
-                destination_account_id=transaction.destination_account_id,
-                amount=transaction.amount,
-                description=transaction.description,
-                reference=transaction.reference,
-                transaction_type=transaction.transaction_type,
-                transaction_method=transaction.transaction_method,
-                transaction_method_id=transaction.transaction_method_id,
-                transaction_status=TransactionStatus.PENDING,
-                created_at=time().__trunc__(),
-                updated_at=time().__trunc__(),
-                processed_at=None,
-                voided_at=None,
-                disputed=False
+    @staticmethod
+    def _new_transaction(transaction: NewTransactionRequestSchema) -> TransactionInDBModel:
+        return TransactionInDBModel(
+            id=new_transaction_id(transaction.account_id),
+            account_id=transaction.account_id,
+            destination_account_id=transaction.destination_account_id,
+            amount=transaction.amount,
+            description=transaction.description,
+            reference=transaction.reference,
+            transaction_type=transaction.transaction_type,
+            transaction_method=transaction.transaction_method,
+            transaction_method_id=transaction.transaction_method_id,
+            transaction_status=TransactionStatus.PENDING,
+            created_at=time().__trunc__(),
+            updated_at=time().__trunc__(),
+            processed_at=None,
+            voided_at=None,
+            disputed=False
 
-            )
+        )
+
+
+    async def create_transaction(self, transaction: NewTransactionRequestSchema) -> Optional[dict]:
+        try: 
+            new_transaction = self._new_transaction(transaction)
             created = await self.db.create_transaction(new_transaction)
             if created:
-                return PublicTransactionSchema(**created.dict())
+                return PublicTransactionSchema.dump(created)
 
-        except Exception as e:
-            print(e)
+        except Exception:
+            logger.exception("Could not create a transaction for account %s", transaction.account_id)
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Could not create transaction")
 
     
-    async def update_transaction(self, transaction_id, transaction: UpdateTransactionRequestSchema) -> Optional[TransactionInDBModel]:
+    async def create_transaction_once(self, transaction: NewTransactionRequestSchema, idempotency_key: str) -> tuple[Response, bool]:
+        """Create a transaction unless this Idempotency-Key already did, returning the response and whether it is a replay."""
+        async def execute() -> Response:
+            return status.HTTP_201_CREATED, dumps(await self.create_transaction(transaction))
+
+        return await idempotent_requests.run(self.db, idempotency_key, request_hash(transaction.dict()), execute)
+
+    
+    async def create_transactions_batch(self, rows: AsyncIterator[Union[object, ValueError]]) -> BatchTransactionResultSchema:
+        received, created, failed = 0, 0, 0
+        errors = []
+        chunk = []
+
+        def reject(row: int, detail: str):
+            nonlocal failed
+            failed += 1
+            if len(errors) < config.TRANSACTION_BATCH_MAX_ERRORS:
+                errors.append(BatchTransactionErrorSchema(row=row, detail=detail))
+
+        async def flush():
+            nonlocal created
+            try:
+                created += await self.db.create_transactions([transaction for _, transaction in chunk])
+            except Exception as e:
+                logger.exception("Could not create a chunk of %d batch transactions", len(chunk))
+                applied = e.applied if isinstance(e, PartialCommitError) else {}
+                created += len(applied)
+                for row, transaction in chunk:
+                    if transaction["id"] not in applied:
+                        reject(row, "Could not create transaction")
+            chunk.clear()
+
+        async for row in rows:
+            received += 1
+            if isinstance(row, RowTooLong):
+                reject(received - 1, str(row))
+                continue
+            if isinstance(row, ValueError):
+                reject(received - 1, f"Invalid JSON: {row}")
+                continue
+
+            try:
+                transaction = NewTransactionRequestSchema.parse_obj(row)
+            except ValidationError as e:
+                reject(received - 1, str(e))
+                continue
+
+            chunk.append((received - 1, self._new_transaction(transaction).dict()))
+            if len(chunk) >= config.TRANSACTION_BATCH_CHUNK_SIZE:
+                await flush()
+
+        if chunk:
+            await flush()
+
+        return BatchTransactionResultSchema(received=received, created=created, failed=failed, errors=errors)
+
+
+    async def update_transaction(self, transaction_id, transaction: UpdateTransactionRequestSchema) -> Optional[dict]:
         try: 
             to_update = transaction.dict()
             updated_transaction = TransactionInDBModel(
@@ -70,64 +243,129 @@ class TransactionsService:
                 updated_at=time().__trunc__()
 
             )
-            print(updated_transaction)
 
             updated = await self.db.update_transaction(transaction_id, updated_transaction)
             if updated:
-                return PublicTransactionSchema(**updated.dict())
+                return PublicTransactionSchema.dump(updated)
 
-        except Exception as e:
-            print(e)
+        except Exception:
+            logger.exception("Could not update transaction %s", transaction_id)
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Could not update transaction")
 
         
-    async def process_transaction(self, transaction: ProcessTransactionRequestSchema) -> Optional[TransactionInDBModel]:
+    async def process_transaction(self, transaction_id: str, transaction: ProcessTransactionRequestSchema) -> dict:
+        """Mark a pending transaction processed and post it to the account balance."""
         try:
-            current_transaction = await self.get_transaction(transaction.transaction_id) 
-
-            processed_transaction = TransactionInDBModel(
-                **current_transaction.dict(),
-                processed_at=time().__trunc__,
-                transaction_status=TransactionStatus.PROCESSED,
+            processed = await self.db.process_transaction(
+                transaction_id,
+                processed_at=to_utc_naive(transaction.processed_at) or datetime.utcnow().replace(microsecond=0),
+                account_id=transaction.account_id,
             )
-        
-            return await self.db.update_transaction(processed_transaction)
 
-        except Exception as e:
-            print(e)
+        except Exception:
+            logger.exception("Could not process transaction %s", transaction_id)
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Could not process transaction")
 
+        if not processed:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Could not process transaction")
+
+        balance_cache.invalidate(processed.account_id)
+        return PublicTransactionSchema.dump(processed)
+
 
-    async def void_transaction(self, transaction: VoidTransactionRequestSchema) -> Optional[TransactionInDBModel]:
+    async def void_transaction(self, transaction_id: str, transaction: VoidTransactionRequestSchema) -> dict:
+        """Void a transaction, reversing its balance posting if it was already processed."""
         try:
-            current_transaction = await self.get_transaction(transaction.transaction_id)
-        
-            void_transaction = TransactionInDBModel(
-                **current_transaction.dict(),
-                voided_at=time().__trunc__,
-                updated_at=time().__trunc__,
-                transaction_status=TransactionStatus.VOID,
+            voided = await self.db.void_transaction(
+                transaction_id,
+                voided_at=to_utc_naive(transaction.voided_at) or datetime.utcnow().replace(microsecond=0),
+                account_id=transaction.account_id,
             )
 
-            return await self.db.update_transaction(void_transaction)
-        
-        except Exception as e: 
-            print(e)
+        except Exception:
+            logger.exception("Could not void transaction %s", transaction_id)
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Could not void transaction")
+
+        if not voided:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Could not void transaction")
+
+        balance_cache.invalidate(voided.account_id)
+        return PublicTransactionSchema.dump(voided)
         
     
-    async def dispute_transaction(self, transaction: VoidTransactionRequestSchema) -> Optional[TransactionInDBModel]:
+    async def process_transactions(self, request: BatchProcessTransactionsRequestSchema) -> BatchStatusResultSchema:
+        """Process many pending transactions, TRANSACTION_STATUS_BATCH_CHUNK_SIZE to an UPDATE."""
+        processed_at = to_utc_naive(request.processed_at) or datetime.utcnow().replace(microsecond=0)
+        return await self._set_statuses(request, "process",
+            lambda transaction_ids: self.db.process_transactions(transaction_ids, processed_at, account_id=request.account_id))
+
+
+    async def void_transactions(self, request: BatchVoidTransactionsRequestSchema) -> BatchStatusResultSchema:
+        """Void many transactions, TRANSACTION_STATUS_BATCH_CHUNK_SIZE to an UPDATE, reversing the postings of the processed ones."""
+        voided_at = to_utc_naive(request.voided_at) or datetime.utcnow().replace(microsecond=0)
+        return await self._set_statuses(request, "void",
+            lambda transaction_ids: self.db.void_transactions(transaction_ids, voided_at, account_id=request.account_id))
+
+
+    async def _set_statuses(self, request: BatchStatusRequestSchema, action: str, apply: Callable[[list[str]], Awaitable[dict[str, str]]]) -> BatchStatusResultSchema:
+        if request.transaction_ids is None and not request.account_id:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Give transactionIds, or an accountId to change its pending transactions")
+        if request.transaction_ids is not None and len(request.transaction_ids) > config.TRANSACTION_STATUS_BATCH_MAX_IDS:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"At most {config.TRANSACTION_STATUS_BATCH_MAX_IDS} transactionIds can be sent at once")
+
+        matched, updated, failed = 0, 0, 0
+        failed_ids = []
+        accounts = set()
+        chunk_size = config.TRANSACTION_STATUS_BATCH_CHUNK_SIZE
+
+        async def apply_chunk(transaction_ids: list[str]):
+            nonlocal matched, updated, failed
+            try:
+                changed = await apply(transaction_ids)
+            except Exception as e:
+                logger.exception("Could not %s a chunk of %d transactions", action, len(transaction_ids))
+                changed = e.applied if isinstance(e, PartialCommitError) else {}
+
+            matched += len(transaction_ids)
+            updated += len(changed)
+            accounts.update(changed.values())
+            for transaction_id in transaction_ids:
+                if transaction_id not in changed:
+                    failed += 1
+                    if len(failed_ids) < config.TRANSACTION_BATCH_MAX_ERRORS:
+                        failed_ids.append(transaction_id)
+
         try:
-            current_transaction = await self.get_transaction(transaction.transaction_id)
-        
-            disputed_transaction = TransactionInDBModel(
-                **current_transaction.dict(),
-                disputed=True,
-                updated_at=time().__trunc__
-            )
+            if request.transaction_ids is not None:
+                transaction_ids = list(dict.fromkeys(request.transaction_ids))
+                for start in range(0, len(transaction_ids), chunk_size):
+                    await apply_chunk(transaction_ids[start:start + chunk_size])
+            else:
+                # The account's pending transactions, a page at a time; each page is done before the next is read.
+                before = None
+                while True:
+                    page = await self.db.get_transactions(request.account_id,
+                        transaction_status=TransactionStatus.PENDING,
+                        created_to=to_utc_naive(request.created_before),
+                        before=before,
+                        limit=chunk_size,
+                    )
+                    if page:
+                        await apply_chunk([transaction.id for transaction in page])
+                    if len(page) < chunk_size:
+                        break
+                    before = (page[-1].created_at, page[-1].id)
 
-            return await self.db.update_transaction(disputed_transaction)
-        
-        except Exception as e:
-            print(e)
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Could not dispute transaction")
+        except Exception:
+            logger.exception("Could not find the pending transactions of account %s to %s", request.account_id, action)
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Could not {action} transactions")
+
+        finally:
+            for account_id in accounts:
+                balance_cache.invalidate(account_id)
+
+        return BatchStatusResultSchema(matched=matched, updated=updated, failed=failed, failed_ids=failed_ids)
+
+
+async def get_transactions_service(db: TransactionRepository = Depends(get_transaction_repository)) -> TransactionsService:
+    return TransactionsService(db)
@@ -0,0 +1,162 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from time import perf_counter
+from typing import Callable
+
+from .. import config
+from ..jobs import BackgroundJob
+from ..metrics import Counter, Gauge, Histogram, LATENCY_BUCKETS, recent_request_seconds, registry
+from .services import TransactionsService
+from ...api.transactions.schema import BatchProcessTransactionsRequestSchema
+from ...db.registry import get_backend
+from ...db.sqlite.transactions.db import database as ledger_database
+
+
+logger = logging.getLogger(__name__)
+
+settlement_queue_depth = registry.register(Gauge(
+    "settlement_queue_depth", "Pending transactions found by the settlement job and waiting for a worker"))
+settlement_transactions_total = registry.register(Counter(
+    "settlement_transactions_total", "Transactions the settlement job processed, or skipped as no longer pending",
+    labels=("outcome",)))
+settlement_batch_seconds = registry.register(Histogram(
+    "settlement_batch_seconds", "Time to process one batch of pending transactions", buckets=LATENCY_BUCKETS))
+settlement_paused = registry.register(Gauge(
+    "settlement_paused", "1 while the settlement job waits for requests or the writer to catch up"))
+settlement_paused_seconds_total = registry.register(Counter(
+    "settlement_paused_seconds_total", "Time the settlement job has spent waiting for requests or the writer to catch up"))
+
+
+class SettlementJob(BackgroundJob):
+    """Processes pending transactions once they are `after` seconds old, every `interval` seconds.
+
+    Each run scans the pending transactions oldest first, a batch at a time,
+    and hands the batches to `concurrency` workers through a queue that holds
+    as many batches as there are workers, so the scan never runs far ahead.
+    Before each batch a worker waits, `pause` seconds at a time, while the
+    mean request time lately is over `max_latency` or more than
+    `max_queue_depth` writes are queued for the group commit writer, so
+    settling never crowds out requests.
+
+    Every worker runs the job. A batch only processes the transactions still
+    pending, so ones another worker settled first are skipped. Stopping the
+    job ends the scan and lets the batches already being processed finish.
+    """
+
+    def __init__(self,
+        interval: float,
+        after: float,
+        batch_size: int,
+        concurrency: int,
+        max_latency: float,
+        max_queue_depth: int,
+        pause: float,
+        latency: Callable[[], float],
+        queue_depth: Callable[[], int],
+    ):
+        super().__init__()
+        self.interval = interval
+        self.after = after
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_latency = max_latency
+        self.max_queue_depth = max_queue_depth
+        self.pause = pause
+        self.latency = latency
+        self.queue_depth = queue_depth
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def busy(self) -> bool:
+        return self.latency() > self.max_latency or self.queue_depth() > self.max_queue_depth
+
+    async def wait_until_idle(self):
+        if not self.busy():
+            return
+        settlement_paused.set(1)
+        started = perf_counter()
+        try:
+            while self.busy() and not self.stopping:
+                await asyncio.sleep(self.pause)
+        finally:
+            settlement_paused.set(0)
+            settlement_paused_seconds_total.inc(amount=perf_counter() - started)
+
+    async def settle(self, before: datetime) -> int:
+        """Process every pending transaction created before `before`, until the job is stopped, returning how many were."""
+        batches: asyncio.Queue[list[str]] = asyncio.Queue(maxsize=self.concurrency)
+        settled = 0
+
+        async def work():
+            nonlocal settled
+            while True:
+                transaction_ids = await batches.get()
+                try:
+                    await self.wait_until_idle()
+                    if not self.stopping:
+                        processed = await self.process(transaction_ids)
+                        settled += processed
+                except Exception:
+                    logger.exception("Could not settle a batch of %d transactions", len(transaction_ids))
+                finally:
+                    settlement_queue_depth.dec(amount=len(transaction_ids))
+                    batches.task_done()
+
+        workers = [asyncio.create_task(work()) for _ in range(self.concurrency)]
+        try:
+            after = None
+            while not self.stopping:
+                # A repository per page, so the scan doesn't hold a read open for the whole run.
+                async with get_backend().transaction_repository() as repo:
+                    keys = await repo.get_pending_transaction_keys(before, after=after, limit=self.batch_size)
+                if keys:
+                    settlement_queue_depth.inc(amount=len(keys))
+                    await batches.put([transaction_id for _, transaction_id in keys])
+                if len(keys) < self.batch_size:
+                    break
+                after = keys[-1]
+            await batches.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            while not batches.empty():
+                settlement_queue_depth.dec(amount=len(batches.get_nowait()))
+        return settled
+
+    async def process(self, transaction_ids: list[str]) -> int:
+        started = perf_counter()
+        async with get_backend().transaction_repository() as repo:
+            result = await TransactionsService(repo).process_transactions(BatchProcessTransactionsRequestSchema(transaction_ids=transaction_ids))
+        settlement_batch_seconds.observe(perf_counter() - started)
+        settlement_transactions_total.inc("processed", amount=result.updated)
+        settlement_transactions_total.inc("skipped", amount=result.failed)
+        return result.updated
+
+    async def _run(self):
+        while not self.stopping:
+            before = datetime.utcnow() - timedelta(seconds=self.after)
+            try:
+                settled = await self.settle(before)
+            except Exception:
+                logger.exception("Could not settle the pending transactions created before %s", before)
+            else:
+                if settled:
+                    logger.info("Settled %d transactions created before %s", settled, before)
+            await self.wait(self.interval)
+
+
+settlement = SettlementJob(
+    interval=config.SETTLEMENT_INTERVAL,
+    after=config.SETTLEMENT_AFTER,
+    batch_size=config.SETTLEMENT_BATCH_SIZE,
+    concurrency=config.SETTLEMENT_CONCURRENCY,
+    max_latency=config.SETTLEMENT_MAX_LATENCY_MS / 1000,
+    max_queue_depth=config.SETTLEMENT_MAX_QUEUE_DEPTH,
+    pause=config.SETTLEMENT_PAUSE,
+    latency=recent_request_seconds.value,
+    queue_depth=lambda: ledger_database.queue_depth,
+)
@@ -0,0 +1,65 @@
+import logging
+from datetime import datetime
+from time import time
+
+from .. import config
+from ..jobs import BackgroundJob
+from ...db.registry import get_backend
+
+
+logger = logging.getLogger(__name__)
+
+
+class BalanceSnapshotJob(BackgroundJob):
+    """Snapshots every account's balance at the end of each interval, in the background.
+
+    Snapshot times are multiples of `interval` since the epoch, so a day long
+    interval gives end of day balances at midnight UTC. Each one is taken
+    `delay` seconds after its time, once the postings stamped just before it
+    have been written. On start the job takes the latest snapshot time that
+    has passed, so a restarted worker catches up.
+
+    Every worker runs the job. Snapshots are keyed by account and time, so
+    the workers that come second find them already taken.
+    """
+
+    def __init__(self, interval: float, delay: float, retry: float):
+        super().__init__()
+        self.interval = interval
+        self.delay = delay
+        self.retry = retry
+        self.last_taken_at = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def due(self, now: float) -> float:
+        """The latest snapshot time, in epoch seconds, that is due by `now`."""
+        return (now - self.delay) // self.interval * self.interval
+
+    async def take(self, taken_at: float) -> int:
+        async with get_backend().transaction_repository() as repo:
+            return await repo.create_balance_snapshots(datetime.utcfromtimestamp(taken_at))
+
+    async def _run(self):
+        while not self.stopping:
+            taken_at = self.due(time())
+            if taken_at > self.last_taken_at:
+                try:
+                    created = await self.take(taken_at)
+                except Exception:
+                    logger.exception("Could not take the balance snapshots for %s", datetime.utcfromtimestamp(taken_at))
+                    await self.wait(self.retry)
+                    continue
+                self.last_taken_at = taken_at
+                logger.info("Took %d balance snapshots for %s", created, datetime.utcfromtimestamp(taken_at))
+
+            await self.wait(max(self.last_taken_at + self.interval + self.delay - time(), 0))
+
+
+balance_snapshots = BalanceSnapshotJob(
+    interval=config.BALANCE_SNAPSHOT_INTERVAL,
+    delay=config.BALANCE_SNAPSHOT_DELAY,
+    retry=config.BALANCE_SNAPSHOT_RETRY,
+)
@@ -0,0 +1,26 @@
+from contextlib import asynccontextmanager
+
+from ..registry import StorageBackend, register_backend
+from ..memory.db import MemoryTransactionRepository
+from .db import AccountDBService, account_db
+
+
+@asynccontextmanager
+async def account_repository():
+    yield AccountDBService(account_db)
+
+
+@asynccontextmanager
+async def transaction_repository():
+    yield MemoryTransactionRepository(account_db)
+
+
+async def startup():
+    account_db.load()
+
+
+async def shutdown():
+    await account_db.close()
+
+
+backend = register_backend(StorageBackend("journal", account_repository, transaction_repository, startup, shutdown))
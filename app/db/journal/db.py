@@ -0,0 +1,249 @@
+import asyncio
+import contextvars
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from time import time
+from decimal import Decimal
+from enum import Enum
+from typing import BinaryIO, Optional
+
+from ..memory.db import MemoryStore, MemoryAccountRepository
+from ..sqlite.accounts.db import Account, AccountBalance, SubLedgerAccount
+from ..sqlite.transactions.db import IdempotencyKey, TransactionInDBModel
+from ...core import config
+
+
+logger = logging.getLogger(__name__)
+
+
+def _document(row) -> dict:
+    document = {}
+    for key, value in row.dict().items():
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif isinstance(value, Decimal):
+            value = str(value)
+        elif isinstance(value, Enum):
+            value = value.value
+        document[key] = value
+    return document
+
+
+def _row(table: str, document: dict):
+    if table == "accounts":
+        return (SubLedgerAccount if document.get("parent_account_id") else Account)(**document)
+    if table == "account_balances":
+        return AccountBalance(**document)
+    if table == "transactions":
+        return TransactionInDBModel(**document)
+    if table == "idempotency_keys":
+        return IdempotencyKey(**document)
+    raise ValueError(f"Unknown journal table {table!r}")
+
+
+class JournalStore(MemoryStore):
+    """A MemoryStore that appends every write to a JSON-lines journal.
+
+    Each line holds one row as it stood after a write. Replaying the file in
+    order rebuilds the store, since a later line for an id replaces the
+    earlier ones. So a write is a single append however large the file is.
+
+    Writes queue their lines and flush() appends them. With fsync on it does
+    so on the journal's own thread, so the event loop never waits on the
+    disk, and the lines that queue while one flush is being synced go out
+    together in the next, so a single fsync covers every write that came in
+    meanwhile.
+
+    The superseded lines are dropped by compaction, which rewrites the
+    journal with only the live rows. It starts on its own once the journal
+    holds more than compact_ratio lines per live row, which keeps the file
+    within a constant factor of the data and the cost of compacting
+    amortized O(1) per write. The live rows are copied as they stand and
+    written out on a worker thread while appends carry on to the old file.
+    The lines appended meanwhile are added to the new file as it is swapped
+    in, the only part of a compaction that holds up flushes.
+    """
+
+    def __init__(self, path: str, compact_ratio: float = 2.0, compact_min_entries: int = 10000, fsync: bool = False):
+        self.path = path
+        self.compact_ratio = compact_ratio
+        self.compact_min_entries = compact_min_entries
+        self.fsync = fsync
+        self.journal: Optional[BinaryIO] = None
+        self.entries = 0
+        self.pending: list[bytes] = []
+        # The lines appended since a running compaction copied the rows.
+        self.carried: Optional[list[bytes]] = None
+        self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="journal")
+        self._appending: Optional[asyncio.Lock] = None
+        self._compaction: Optional[asyncio.Task] = None
+        super().__init__()
+
+    @property
+    def rows(self) -> int:
+        return len(self.accounts) + len(self.account_balances) + len(self.transactions) + len(self.idempotency_keys)
+
+    def load(self):
+        """Rebuild the store from the journal and open it for appending."""
+        self.clear()
+        self.entries = 0
+        self.pending = []
+        self._appending = asyncio.Lock()
+        end = self._replay() if os.path.exists(self.path) else 0
+
+        self.journal = open(self.path, "ab")
+        if self.journal.tell() > end:
+            # A crash mid-append leaves a torn last line. Drop it so the next
+            # append starts on a line of its own.
+            self.journal.truncate(end)
+        if self._compaction_due():
+            # Nothing else is running yet, so compact in place.
+            self._write_compacted(self._live_rows())
+            self._swap([])
+            self.entries = self.rows
+
+    def _replay(self) -> int:
+        """Apply every complete line, returning the offset just past the last one."""
+        end = 0
+        with open(self.path, "rb") as journal:
+            for line in journal:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    entry = json.loads(line)
+                    row = _row(entry["table"], entry["row"])
+                except (ValueError, KeyError, TypeError):
+                    break
+
+                self._put(entry["table"], row)
+                self.entries += 1
+                end += len(line)
+        return end
+
+    def _put(self, table: str, row):
+        if table == "accounts":
+            self.put_account(row)
+        elif table == "account_balances":
+            self.put_account_balance(row)
+        elif table == "idempotency_keys":
+            # A key that has expired since, or was dropped, is left out.
+            if row.expires_at > time():
+                self.put_idempotency_key(row)
+            else:
+                self.idempotency_keys.pop(row.key, None)
+        else:
+            self.put_transaction(row)
+
+    def _persist(self, table: str, row):
+        # Replay puts rows back before the journal is open, and they are already in it.
+        if self.journal is None:
+            return
+
+        self.pending.append(self._line(table, row))
+        self.entries += 1
+
+    async def flush(self):
+        """Append the queued lines to the journal, returning once they, and every line queued before them, are written."""
+        # Taken even with nothing queued, since an earlier flush may still be writing this caller's lines.
+        async with self._appending:
+            if self.pending:
+                lines, self.pending = self.pending, []
+                if self.carried is not None:
+                    self.carried.extend(lines)
+                if self.fsync:
+                    await asyncio.get_running_loop().run_in_executor(self._io, self._append, lines)
+                else:
+                    # Unsynced, an append only reaches the page cache, which is
+                    # quicker than handing it to the thread.
+                    self._append(lines)
+
+        if self._compaction is None and self._compaction_due():
+            # An empty context, so the compaction doesn't carry the request id of the write that started it.
+            self._compaction = contextvars.Context().run(asyncio.create_task, self._compact())
+
+    def _append(self, lines: list[bytes]):
+        self.journal.writelines(lines)
+        self.journal.flush()
+        if self.fsync:
+            os.fsync(self.journal.fileno())
+
+    @staticmethod
+    def _line(table: str, row) -> bytes:
+        return json.dumps({"table": table, "row": _document(row)}, separators=(",", ":")).encode() + b"\n"
+
+    def _compaction_due(self) -> bool:
+        return self.entries >= self.compact_min_entries and self.entries > self.compact_ratio * self.rows
+
+    def _live_rows(self) -> list[tuple[str, list]]:
+        # Rows are replaced rather than changed in place, so copying the dicts' values holds them as they stand now.
+        return [
+            ("accounts", list(self.accounts.values())),
+            ("account_balances", list(self.account_balances.values())),
+            ("transactions", list(self.transactions.values())),
+            ("idempotency_keys", list(self.idempotency_keys.values())),
+        ]
+
+    async def _compact(self):
+        """Rewrite the journal with one line per live row, then swap it in."""
+        loop = asyncio.get_running_loop()
+        self.carried = []
+        try:
+            live_rows = self._live_rows()
+            await loop.run_in_executor(None, self._write_compacted, live_rows)
+            async with self._appending:
+                await loop.run_in_executor(self._io, self._swap, self.carried)
+                # A line carried over may be for a row the copy already had
+                # as it stands, which replaying it again leaves as it is.
+                self.entries = sum(len(rows) for _, rows in live_rows) + len(self.carried) + len(self.pending)
+        except Exception:
+            logger.exception("Could not compact the journal %s", self.path)
+        finally:
+            self.carried = None
+            self._compaction = None
+
+    def _write_compacted(self, live_rows: list[tuple[str, list]]):
+        with open(self.path + ".compact", "wb") as journal:
+            for table, rows in live_rows:
+                for row in rows:
+                    journal.write(self._line(table, row))
+            journal.flush()
+            os.fsync(journal.fileno())
+
+    def _swap(self, carried: list[bytes]):
+        compacted = self.path + ".compact"
+        with open(compacted, "ab") as journal:
+            journal.writelines(carried)
+            journal.flush()
+            os.fsync(journal.fileno())
+
+        self.journal.close()
+        os.replace(compacted, self.path)
+        self.journal = open(self.path, "ab")
+
+    async def close(self):
+        await self.flush()
+        if self._compaction is not None:
+            await self._compaction
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        self.clear()
+
+
+class AccountDBService(MemoryAccountRepository):
+    async def get_account_by_parent_id(self, parent_id: str) -> Optional[list[dict]]:
+        account_ids = self.store.parent_account_ids.get(parent_id)
+        if not account_ids:
+            return None
+        return [self.store.accounts[account_id].dict() for account_id in sorted(account_ids)]
+
+
+## Set up the account journal
+account_db = JournalStore(config.JOURNAL_PATH,
+    compact_ratio=config.JOURNAL_COMPACT_RATIO,
+    compact_min_entries=config.JOURNAL_COMPACT_MIN_ENTRIES,
+    fsync=config.JOURNAL_FSYNC,
+)
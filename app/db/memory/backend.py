@@ -0,0 +1,18 @@
+from contextlib import asynccontextmanager
+
+from ..registry import StorageBackend, register_backend
+from .db import MemoryAccountRepository, MemoryTransactionRepository, store
+
+
+@asynccontextmanager
+async def account_repository():
+    yield MemoryAccountRepository(store)
+
+
+@asynccontextmanager
+async def transaction_repository():
+    yield MemoryTransactionRepository(store)
+
+
+# Nothing to open or close: the data lives and dies with the process.
+backend = register_backend(StorageBackend("memory", account_repository, transaction_repository))
@@ -0,0 +1,556 @@
+from bisect import bisect_left, bisect_right, insort
+from datetime import date, datetime, timezone
+from functools import wraps
+from heapq import merge
+from operator import itemgetter
+from typing import AsyncIterator, Optional
+
+from ..repository import AccountRepository, TransactionRepository
+from ..sqlite.accounts.db import Account, AccountBalance, AccountBase, SubLedgerAccount
+from ..sqlite.transactions.db import ROLLUP_TOTALS, DailyRollup, IdempotencyKey, TransactionInDBModel, TransactionMethod, TransactionStatus, TransactionType, signed_amount
+from ...core.pagination import to_utc_naive
+
+
+def _row(model, values: dict):
+    # SQLite hands datetimes back naive in UTC, so store them the same way.
+    return model(**{key: to_utc_naive(value) if isinstance(value, datetime) else value for key, value in values.items()})
+
+
+def _flushed(method):
+    """Have a repository write wait for the store to persist what it changed before returning."""
+    @wraps(method)
+    async def write(self, *args, **kwargs):
+        result = await method(self, *args, **kwargs)
+        await self.store.flush()
+        return result
+    return write
+
+
+class MemoryStore:
+    """Accounts, balances and transactions held in dicts keyed by id.
+
+    Sorted id lists stand in for the SQLite indexes: all account ids, account
+    ids per account holder, (created_at, id) keys per account for paging
+    transactions and of every pending transaction for settling them, plus a
+    set of sub-ledger account ids per parent account.
+
+    Stored rows are never modified in place; an update replaces the row, so a
+    row handed to a caller doesn't change under it.
+
+    Daily rollups and each account's postings by time are derived from the
+    transactions by put_transaction, the way the SQLite triggers and indexes
+    derive them. They aren't persisted, and neither are balance snapshots:
+    the snapshot job takes the latest one again after a restart.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.accounts: dict[str, Account] = {}
+        self.account_balances: dict[str, AccountBalance] = {}
+        self.transactions: dict[str, TransactionInDBModel] = {}
+        self.account_ids: list[str] = []
+        self.holder_account_ids: dict[str, list[str]] = {}
+        self.parent_account_ids: dict[str, set[str]] = {}
+        self.account_transaction_keys: dict[str, list[tuple[datetime, str]]] = {}
+        self.pending_transaction_keys: list[tuple[datetime, str]] = []
+        self.idempotency_keys: dict[str, IdempotencyKey] = {}
+        # account id -> {(day, transaction type): rollup}, and its keys in order
+        self.daily_rollups: dict[str, dict[tuple[date, str], DailyRollup]] = {}
+        self.account_rollup_keys: dict[str, list[tuple[date, str]]] = {}
+        # account id -> [(posted at, transaction id, signed amount)] and [(taken at, balance)], in order
+        self.account_postings: dict[str, list[tuple[datetime, str, float]]] = {}
+        self.balance_snapshots: dict[str, list[tuple[datetime, float]]] = {}
+
+    def put_account(self, account: Account):
+        previous = self.accounts.get(account.id)
+        if previous is None:
+            insort(self.account_ids, account.id)
+        if previous is None or previous.account_holder_id != account.account_holder_id:
+            if previous is not None:
+                self._unindex(self.holder_account_ids, previous.account_holder_id, previous.id)
+            insort(self.holder_account_ids.setdefault(account.account_holder_id, []), account.id)
+
+        parent_id = getattr(account, "parent_account_id", None)
+        previous_parent_id = getattr(previous, "parent_account_id", None)
+        if parent_id != previous_parent_id:
+            if previous_parent_id:
+                self.parent_account_ids[previous_parent_id].discard(account.id)
+            if parent_id:
+                self.parent_account_ids.setdefault(parent_id, set()).add(account.id)
+
+        self.accounts[account.id] = account
+        self._persist("accounts", account)
+
+    def put_account_balance(self, account_balance: AccountBalance):
+        self.account_balances[account_balance.id] = account_balance
+        self._persist("account_balances", account_balance)
+
+    def put_transaction(self, transaction: TransactionInDBModel):
+        key = (transaction.created_at, transaction.id)
+        previous = self.transactions.get(transaction.id)
+        if previous is None or (previous.account_id, previous.created_at) != (transaction.account_id, transaction.created_at):
+            if previous is not None:
+                self._unindex(self.account_transaction_keys, previous.account_id, (previous.created_at, previous.id))
+            insort(self.account_transaction_keys.setdefault(transaction.account_id, []), key)
+
+        was_pending = previous is not None and previous.transaction_status == TransactionStatus.PENDING
+        if was_pending and (transaction.transaction_status != TransactionStatus.PENDING or previous.created_at != transaction.created_at):
+            del self.pending_transaction_keys[bisect_left(self.pending_transaction_keys, (previous.created_at, previous.id))]
+            was_pending = False
+        if transaction.transaction_status == TransactionStatus.PENDING and not was_pending:
+            insort(self.pending_transaction_keys, key)
+
+        if previous is not None:
+            self._roll_up(previous, -1)
+        self._roll_up(transaction, 1)
+
+        previous_postings, postings = self._postings(previous), self._postings(transaction)
+        for account_id, posting in previous_postings - postings:
+            self._unindex(self.account_postings, account_id, posting)
+            self._drop_snapshots(account_id, posting[0])
+        for account_id, posting in postings - previous_postings:
+            insort(self.account_postings.setdefault(account_id, []), posting)
+            self._drop_snapshots(account_id, posting[0])
+
+        self.transactions[transaction.id] = transaction
+        self._persist("transactions", transaction)
+
+    def _roll_up(self, transaction: TransactionInDBModel, sign: int):
+        key = (transaction.created_at.date(), str(TransactionType(transaction.transaction_type).value))
+        rollups = self.daily_rollups.setdefault(transaction.account_id, {})
+        rollup = rollups.get(key)
+        if rollup is None:
+            rollup = rollups[key] = DailyRollup(account_id=transaction.account_id, day=key[0], transaction_type=key[1])
+            insort(self.account_rollup_keys.setdefault(transaction.account_id, []), key)
+
+        # Rollups are internal, so unlike the stored rows they are updated in place.
+        status = TransactionStatus(transaction.transaction_status).value
+        setattr(rollup, f"{status}_count", getattr(rollup, f"{status}_count") + sign)
+        setattr(rollup, f"{status}_amount", getattr(rollup, f"{status}_amount") + sign * float(transaction.amount))
+
+    @staticmethod
+    def _postings(transaction: Optional[TransactionInDBModel]) -> set[tuple[str, tuple[datetime, str, float]]]:
+        # Processing posts a transaction, voiding it after reverses that.
+        if transaction is None or transaction.processed_at is None:
+            return set()
+        amount = signed_amount(transaction)
+        postings = {(transaction.account_id, (transaction.processed_at, transaction.id, amount))}
+        if transaction.voided_at is not None:
+            postings.add((transaction.account_id, (transaction.voided_at, transaction.id, -amount)))
+        return postings
+
+    def _drop_snapshots(self, account_id: str, since: datetime):
+        """Drop the account's snapshots from `since` on, which a posting at that time makes wrong."""
+        snapshots = self.balance_snapshots.get(account_id)
+        if snapshots:
+            del snapshots[bisect_left(snapshots, since, key=itemgetter(0)):]
+
+    def postings(self, account_id: str, after: Optional[datetime], until: datetime) -> list[tuple[datetime, str, float]]:
+        """The account's postings in (after, until], from the start if after is None."""
+        postings = self.account_postings.get(account_id, [])
+        start = bisect_right(postings, after, key=itemgetter(0)) if after else 0
+        return postings[start:bisect_right(postings, until, key=itemgetter(0))]
+
+    def put_idempotency_key(self, idempotency_key: IdempotencyKey):
+        self.idempotency_keys[idempotency_key.key] = idempotency_key
+        self._persist("idempotency_keys", idempotency_key)
+
+    def drop_idempotency_key(self, key: str):
+        idempotency_key = self.idempotency_keys.pop(key, None)
+        if idempotency_key is not None:
+            # Written as already expired, which is as good as deleted to a reader.
+            self._persist("idempotency_keys", IdempotencyKey(**{**idempotency_key.dict(), "expires_at": 0}))
+
+    def _persist(self, table: str, row):
+        """Called after every write. The memory store keeps nothing beyond the process."""
+
+    async def flush(self):
+        """Called before a repository write returns, to persist what _persist was given since the last call."""
+
+    @staticmethod
+    def _unindex(index: dict, name: str, key):
+        keys = index[name]
+        del keys[bisect_left(keys, key)]
+        if not keys:
+            del index[name]
+
+
+class MemoryAccountRepository(AccountRepository):
+    def __init__(self, store: MemoryStore):
+        self.store = store
+
+    async def get_account_by_id(self, account_id: str) -> Optional[dict]:
+        account = self.store.accounts.get(account_id)
+        return account.dict() if account else None
+
+    @_flushed
+    async def create_account(self, account: dict) -> Optional[dict]:
+        if account["id"] in self.store.accounts:
+            return None
+        new_account = _row(Account, account)
+        self.store.put_account(new_account)
+        return new_account.dict()
+
+    async def get_all_accounts(self, account_holder_id: str = None, active: bool = None, after: str = None, limit: int = 50) -> AsyncIterator[Account]:
+        """Stream up to `limit` accounts ordered by id, starting after the id `after`."""
+        account_ids = self.store.holder_account_ids.get(account_holder_id, []) if account_holder_id else self.store.account_ids
+
+        # Take the page in one go, so accounts created while it is being sent can't shift it.
+        page = []
+        for index in range(bisect_right(account_ids, after) if after else 0, len(account_ids)):
+            if len(page) == limit:
+                break
+            account = self.store.accounts[account_ids[index]]
+            if active is None or account.active == active:
+                page.append(account)
+
+        for account in page:
+            yield account
+
+    async def get_general_ledger_account(self, account_id: str) -> Optional[dict]:
+        return await self.get_account_by_id(account_id)
+
+    async def get_sub_ledger_account(self, account_id: str) -> Optional[dict]:
+        return await self.get_account_by_id(account_id)
+
+    @_flushed
+    async def update_account(self, account: AccountBase) -> AccountBase:
+        current = self.store.accounts.get(account.id)
+        if current:
+            self.store.put_account(_row(type(current), {**current.dict(), **account.dict()}))
+        return account
+
+    @_flushed
+    async def create_sub_ledger_account(self, sub_ledger_account: dict) -> Optional[dict]:
+        if sub_ledger_account["id"] in self.store.accounts:
+            return None
+        new_sub_ledger_account = _row(SubLedgerAccount, sub_ledger_account)
+        self.store.put_account(new_sub_ledger_account)
+        return new_sub_ledger_account.dict()
+
+    async def update_sub_ledger_account(self, sub_ledger_account: SubLedgerAccount) -> Optional[dict]:
+        await self.update_account(sub_ledger_account)
+        return sub_ledger_account.dict()
+
+    @staticmethod
+    def balance_constructor(account_id, balance, available_balance):
+        return {
+            "account_id": account_id,
+            "balance": balance,
+            "available_balance": available_balance,
+        }
+
+    async def get_account_balance(self, account_id: str) -> Optional[dict]:
+        account_balance = self.store.account_balances.get(account_id)
+        return account_balance.dict() if account_balance else None
+
+    @_flushed
+    async def update_account_balance(self, account_id: str, balance: float = None, available_balance: float = None) -> Optional[dict]:
+        account_balance = self.store.account_balances.get(account_id)
+        if not account_balance:
+            return None
+
+        values = account_balance.dict()
+        if balance:
+            values["balance"] = balance
+        if available_balance:
+            values["available_balance"] = available_balance
+
+        account_balance = AccountBalance(**values)
+        self.store.put_account_balance(account_balance)
+        return self.balance_constructor(account_id, account_balance.balance, account_balance.available_balance)
+
+    @_flushed
+    async def create_account_balance(self, account_balance: dict) -> Optional[dict]:
+        new_account_balance = AccountBalance(**{
+            # AccountBalance keeps epoch seconds rather than datetimes.
+            key: value.timestamp() if isinstance(value, datetime) else value
+            for key, value in account_balance.items()
+        })
+        if new_account_balance.id in self.store.account_balances:
+            return None
+
+        self.store.put_account_balance(new_account_balance)
+        return self.balance_constructor(new_account_balance.id, new_account_balance.balance, new_account_balance.available_balance)
+
+
+class MemoryTransactionRepository(TransactionRepository):
+    """Transactions kept in a MemoryStore.
+
+    Nothing here awaits between reading a row and replacing it, so on one
+    event loop every operation is atomic, like a SQLite transaction. Writes
+    then wait for the store's flush, which is where a persisting store
+    writes them out.
+    """
+
+    def __init__(self, store: MemoryStore):
+        self.store = store
+
+    @_flushed
+    async def create_transaction(self, transaction: TransactionInDBModel) -> Optional[TransactionInDBModel]:
+        if transaction.id in self.store.transactions:
+            raise ValueError(f"Transaction {transaction.id} already exists")
+        new_transaction = _row(TransactionInDBModel, transaction.dict())
+        self.store.put_transaction(new_transaction)
+        return new_transaction
+
+    @_flushed
+    async def create_transactions(self, transactions: list[dict]) -> int:
+        new_transactions = [_row(TransactionInDBModel, transaction) for transaction in transactions]
+        ids = {transaction.id for transaction in new_transactions}
+        if len(ids) != len(new_transactions) or not ids.isdisjoint(self.store.transactions):
+            raise ValueError("Duplicate transaction id in batch")
+
+        for transaction in new_transactions:
+            self.store.put_transaction(transaction)
+        return len(new_transactions)
+
+    async def get_transaction(self, transaction_id: str) -> Optional[TransactionInDBModel]:
+        return self.store.transactions.get(transaction_id)
+
+    async def get_transactions(self,
+        account_id: str = None,
+        transaction_status: TransactionStatus = None,
+        transaction_type: TransactionType = None,
+        transaction_method: TransactionMethod = None,
+        disputed: bool = None,
+        created_from: datetime = None,
+        created_to: datetime = None,
+        before: tuple[datetime, str] = None,
+        limit: int = 50,
+    ) -> list[TransactionInDBModel]:
+        """Page through transactions newest first, starting after the (created_at, id) key `before`."""
+        if account_id:
+            keys = self._newest_first(self.store.account_transaction_keys.get(account_id, []), created_to, before)
+        else:
+            keys = merge(*(
+                self._newest_first(account_keys, created_to, before)
+                for account_keys in self.store.account_transaction_keys.values()
+            ), reverse=True)
+
+        transactions = []
+        for created_at, transaction_id in keys:
+            if created_from and created_at < created_from:
+                break
+            transaction = self.store.transactions[transaction_id]
+            if transaction_status and transaction.transaction_status != transaction_status:
+                continue
+            if transaction_type and transaction.transaction_type != transaction_type:
+                continue
+            if transaction_method and transaction.transaction_method != transaction_method:
+                continue
+            if disputed is not None and transaction.disputed != disputed:
+                continue
+
+            transactions.append(transaction)
+            if limit and len(transactions) == limit:
+                break
+
+        return transactions
+
+    async def stream_transactions(self, account_id: str, chunk_size: int) -> AsyncIterator[list[TransactionInDBModel]]:
+        last = None
+        while True:
+            # Found again by key for every chunk, as writes between chunks can shift the list.
+            keys = self.store.account_transaction_keys.get(account_id, [])
+            start = bisect_right(keys, last) if last else 0
+            chunk_keys = keys[start:start + chunk_size]
+            if not chunk_keys:
+                return
+            last = chunk_keys[-1]
+            yield [self.store.transactions[transaction_id] for _, transaction_id in chunk_keys]
+
+    @staticmethod
+    def _newest_first(keys: list, created_to: datetime = None, before: tuple[datetime, str] = None):
+        """Walk sorted (created_at, id) keys backwards from below created_to and before."""
+        end = len(keys)
+        if created_to:
+            end = min(end, bisect_left(keys, (created_to, "")))
+        if before:
+            end = min(end, bisect_left(keys, tuple(before)))
+        for index in range(end - 1, -1, -1):
+            yield keys[index]
+
+    @_flushed
+    async def update_transaction(self, transaction_id: str, transaction: TransactionInDBModel) -> TransactionInDBModel:
+        current_transaction = self.store.transactions[transaction_id]
+        updated_transaction = _row(TransactionInDBModel, {
+            **current_transaction.dict(),
+            "reference": transaction.reference,
+            "description": transaction.description,
+            "transaction_method": transaction.transaction_method,
+            "transaction_method_id": transaction.transaction_method_id,
+            "updated_at": transaction.updated_at,
+        })
+        self.store.put_transaction(updated_transaction)
+        return updated_transaction
+
+    def _post_to_balance(self, account_id: str, amount: float, posted_at: datetime):
+        now = posted_at.replace(tzinfo=timezone.utc).timestamp()
+        account_balance = self.store.account_balances.get(account_id)
+        if account_balance is None:
+            account_balance = AccountBalance(id=account_id, balance=amount, available_balance=amount, created_at=now, updated_at=now)
+        else:
+            account_balance = AccountBalance(**{
+                **account_balance.dict(),
+                "balance": account_balance.balance + amount,
+                "available_balance": account_balance.available_balance + amount,
+                "updated_at": now,
+            })
+        self.store.put_account_balance(account_balance)
+
+    def _set_status(self, transaction: TransactionInDBModel, values: dict, posting: float) -> TransactionInDBModel:
+        updated_transaction = _row(TransactionInDBModel, {**transaction.dict(), **values})
+        self.store.put_transaction(updated_transaction)
+        if posting:
+            self._post_to_balance(transaction.account_id, posting, values["updated_at"])
+        return updated_transaction
+
+    @_flushed
+    async def process_transaction(self, transaction_id: str, processed_at: datetime, account_id: str = None) -> Optional[TransactionInDBModel]:
+        return self._process(transaction_id, processed_at, account_id)
+
+    @_flushed
+    async def void_transaction(self, transaction_id: str, voided_at: datetime, account_id: str = None) -> Optional[TransactionInDBModel]:
+        return self._void(transaction_id, voided_at, account_id)
+
+    def _process(self, transaction_id: str, processed_at: datetime, account_id: Optional[str]) -> Optional[TransactionInDBModel]:
+        transaction = self.store.transactions.get(transaction_id)
+        if not transaction or transaction.transaction_status != TransactionStatus.PENDING:
+            return None
+        if account_id and transaction.account_id != account_id:
+            return None
+
+        return self._set_status(transaction, {
+            "transaction_status": TransactionStatus.PROCESSED,
+            "processed_at": processed_at,
+            "updated_at": processed_at,
+        }, posting=signed_amount(transaction))
+
+    def _void(self, transaction_id: str, voided_at: datetime, account_id: Optional[str]) -> Optional[TransactionInDBModel]:
+        transaction = self.store.transactions.get(transaction_id)
+        if not transaction or transaction.transaction_status == TransactionStatus.VOID:
+            return None
+        if account_id and transaction.account_id != account_id:
+            return None
+
+        posting = -signed_amount(transaction) if transaction.transaction_status == TransactionStatus.PROCESSED else 0
+        return self._set_status(transaction, {
+            "transaction_status": TransactionStatus.VOID,
+            "voided_at": voided_at,
+            "updated_at": voided_at,
+        }, posting=posting)
+
+    async def get_pending_transaction_keys(self, created_before: datetime, after: tuple[datetime, str] = None, limit: int = 1000) -> list[tuple[datetime, str]]:
+        keys = self.store.pending_transaction_keys
+        start = bisect_right(keys, tuple(after)) if after else 0
+        end = bisect_left(keys, (created_before, ""))
+        return keys[start:min(end, start + limit)]
+
+    @_flushed
+    async def process_transactions(self, transaction_ids: list[str], processed_at: datetime, account_id: str = None) -> dict[str, str]:
+        changed = {}
+        for transaction_id in transaction_ids:
+            processed = self._process(transaction_id, processed_at, account_id)
+            if processed:
+                changed[processed.id] = processed.account_id
+        return changed
+
+    @_flushed
+    async def void_transactions(self, transaction_ids: list[str], voided_at: datetime, account_id: str = None) -> dict[str, str]:
+        changed = {}
+        for transaction_id in transaction_ids:
+            voided = self._void(transaction_id, voided_at, account_id)
+            if voided:
+                changed[voided.id] = voided.account_id
+        return changed
+
+    async def get_transaction_by_processed(self, account_id: str) -> list[TransactionInDBModel]:
+        return await self.get_transactions(account_id, transaction_status=TransactionStatus.PROCESSED, limit=None)
+
+    async def get_transaction_by_pending(self, account_id: str) -> list[TransactionInDBModel]:
+        return await self.get_transactions(account_id, transaction_status=TransactionStatus.PENDING, limit=None)
+
+    async def get_transaction_by_voided(self, account_id: str) -> list[TransactionInDBModel]:
+        return await self.get_transactions(account_id, transaction_status=TransactionStatus.VOID, limit=None)
+
+    async def get_transaction_by_disputed(self, account_id: str) -> list[TransactionInDBModel]:
+        return await self.get_transactions(account_id, disputed=True, limit=None)
+
+    async def get_transaction_totals(self, account_id: str, from_day: date = None, to_day: date = None) -> list[dict]:
+        keys = self.store.account_rollup_keys.get(account_id, [])
+        start = bisect_left(keys, (from_day, "")) if from_day else 0
+        end = bisect_left(keys, (to_day, "")) if to_day else len(keys)
+
+        totals: dict[str, dict] = {}
+        rollups = self.store.daily_rollups[account_id] if keys else {}
+        for key in keys[start:end]:
+            rollup = rollups[key]
+            type_totals = totals.setdefault(rollup.transaction_type, {"transaction_type": rollup.transaction_type, **{total: DailyRollup.__fields__[total].default for total in ROLLUP_TOTALS}})
+            for total in ROLLUP_TOTALS:
+                type_totals[total] += getattr(rollup, total)
+        return [totals[transaction_type] for transaction_type in sorted(totals)]
+
+    async def create_balance_snapshots(self, taken_at: datetime) -> int:
+        created = 0
+        for account_id in self.store.account_balances:
+            snapshots = self.store.balance_snapshots.get(account_id, [])
+            index = bisect_left(snapshots, taken_at, key=itemgetter(0))
+            if index < len(snapshots) and snapshots[index][0] == taken_at:
+                continue
+            previous_at, balance = snapshots[index - 1] if index else (None, 0.0)
+            postings = self.store.postings(account_id, previous_at, taken_at)
+            if not postings:
+                continue
+            insort(self.store.balance_snapshots.setdefault(account_id, []), (taken_at, balance + sum(amount for _, _, amount in postings)))
+            created += 1
+        return created
+
+    async def get_balance_as_of(self, account_id: str, as_of: datetime) -> Optional[float]:
+        if account_id not in self.store.account_balances:
+            return None
+        snapshots = self.store.balance_snapshots.get(account_id, [])
+        index = bisect_right(snapshots, as_of, key=itemgetter(0))
+        taken_at, balance = snapshots[index - 1] if index else (None, 0.0)
+        return balance + sum(amount for _, _, amount in self.store.postings(account_id, taken_at, as_of))
+
+    async def archive_transactions(self, before: datetime, limit: int) -> int:
+        # Held in memory, there's no page cache for old rows to crowd out, so everything stays live.
+        return 0
+
+    async def get_idempotency_key(self, key: str, now: float) -> Optional[IdempotencyKey]:
+        idempotency_key = self.store.idempotency_keys.get(key)
+        if idempotency_key is None or idempotency_key.expires_at <= now:
+            return None
+        return idempotency_key
+
+    @_flushed
+    async def reserve_idempotency_key(self, key: str, request_hash: str, now: float, expires_at: float) -> bool:
+        if await self.get_idempotency_key(key, now) is not None:
+            return False
+        self.store.put_idempotency_key(IdempotencyKey(key=key, request_hash=request_hash, created_at=now, expires_at=expires_at))
+        return True
+
+    @_flushed
+    async def complete_idempotency_key(self, key: str, status_code: int, response: str):
+        idempotency_key = self.store.idempotency_keys[key]
+        self.store.put_idempotency_key(IdempotencyKey(**{**idempotency_key.dict(), "status_code": status_code, "response": response}))
+
+    @_flushed
+    async def release_idempotency_key(self, key: str):
+        idempotency_key = self.store.idempotency_keys.get(key)
+        if idempotency_key is not None and idempotency_key.status_code is None:
+            self.store.drop_idempotency_key(key)
+
+    @_flushed
+    async def purge_idempotency_keys(self, now: float) -> int:
+        # A full scan, but purges are spaced out and keys are few next to transactions.
+        expired = [key for key, idempotency_key in self.store.idempotency_keys.items() if idempotency_key.expires_at <= now]
+        for key in expired:
+            self.store.drop_idempotency_key(key)
+        return len(expired)
+
+
+store = MemoryStore()
@@ -0,0 +1,71 @@
+from contextlib import AbstractAsyncContextManager
+from importlib import import_module
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from ..core import config
+from .repository import AccountRepository, TransactionRepository
+
+
+class StorageBackend:
+    """A storage engine the API can run on.
+
+    account_repository and transaction_repository are called once per request
+    and return an async context manager that yields the repository to use for
+    it. on_startup and on_shutdown run with the app.
+    """
+
+    def __init__(self,
+        name: str,
+        account_repository: Callable[[], AbstractAsyncContextManager[AccountRepository]],
+        transaction_repository: Callable[[], AbstractAsyncContextManager[TransactionRepository]],
+        on_startup: Optional[Callable[[], Awaitable[None]]] = None,
+        on_shutdown: Optional[Callable[[], Awaitable[None]]] = None,
+    ):
+        self.name = name
+        self.account_repository = account_repository
+        self.transaction_repository = transaction_repository
+        self.on_startup = on_startup
+        self.on_shutdown = on_shutdown
+
+    async def startup(self):
+        if self.on_startup:
+            await self.on_startup()
+
+    async def shutdown(self):
+        if self.on_shutdown:
+            await self.on_shutdown()
+
+
+# Imported on first use, so selecting one backend never opens another's files.
+BACKEND_MODULES = {
+    "sqlite": ".sqlite.backend",
+    "memory": ".memory.backend",
+    "journal": ".journal.backend",
+}
+
+_backends: dict[str, StorageBackend] = {}
+
+
+def register_backend(backend: StorageBackend) -> StorageBackend:
+    _backends[backend.name] = backend
+    return backend
+
+
+def get_backend(name: str = None) -> StorageBackend:
+    """The backend called `name`, or the one configured by STORAGE_BACKEND."""
+    name = name or config.STORAGE_BACKEND
+    if name not in _backends:
+        if name not in BACKEND_MODULES:
+            raise ValueError(f"Unknown storage backend {name!r}, expected one of: {', '.join(BACKEND_MODULES)}")
+        import_module(BACKEND_MODULES[name], __package__)
+    return _backends[name]
+
+
+async def get_account_repository() -> AsyncIterator[AccountRepository]:
+    async with get_backend().account_repository() as account_repo:
+        yield account_repo
+
+
+async def get_transaction_repository() -> AsyncIterator[TransactionRepository]:
+    async with get_backend().transaction_repository() as transaction_repo:
+        yield transaction_repo
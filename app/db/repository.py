@@ -0,0 +1,208 @@
+from abc import ABC, abstractmethod
+from datetime import date, datetime
+from typing import TYPE_CHECKING, AsyncIterator, Optional
+
+if TYPE_CHECKING:
+    # The SQLite backend's models are shared by every backend, and its
+    # repositories implement these interfaces, so only import them for typing.
+    from .sqlite.accounts.db import Account, AccountBase, SubLedgerAccount
+    from .sqlite.transactions.db import IdempotencyKey, TransactionInDBModel, TransactionMethod, TransactionStatus, TransactionType
+
+
+class PartialCommitError(Exception):
+    """A write spread over several files failed to commit in one after committing in another.
+
+    `applied` holds what did commit: the ids of the transactions written,
+    mapped to their accounts. The rest was rolled back.
+    """
+
+    def __init__(self, applied: dict[str, str]):
+        super().__init__(f"Only {len(applied)} of the rows were committed")
+        self.applied = applied
+
+
+class AccountRepository(ABC):
+    """What the account service needs from a storage backend.
+
+    Accounts and balances are returned as dicts, except by get_all_accounts
+    which streams model instances. Lookups of a missing id return None.
+    """
+
+    @abstractmethod
+    async def get_account_by_id(self, account_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def create_account(self, account: dict) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    def get_all_accounts(self, account_holder_id: str = None, active: bool = None, after: str = None, limit: int = 50) -> AsyncIterator["Account"]:
+        """Stream up to `limit` accounts ordered by id, starting after the id `after`."""
+
+    @abstractmethod
+    async def get_general_ledger_account(self, account_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def get_sub_ledger_account(self, account_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def update_account(self, account: "AccountBase") -> "AccountBase":
+        ...
+
+    @abstractmethod
+    async def create_sub_ledger_account(self, sub_ledger_account: dict) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def update_sub_ledger_account(self, sub_ledger_account: "SubLedgerAccount") -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def get_account_balance(self, account_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def update_account_balance(self, account_id: str, balance: float = None, available_balance: float = None) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def create_account_balance(self, account_balance: dict) -> Optional[dict]:
+        ...
+
+
+class TransactionRepository(ABC):
+    """What the transactions service needs from a storage backend.
+
+    Processing or voiding a transaction posts it to its account's balance in
+    the same step, so both change together or not at all.
+    """
+
+    @abstractmethod
+    async def create_transaction(self, transaction: "TransactionInDBModel") -> Optional["TransactionInDBModel"]:
+        ...
+
+    @abstractmethod
+    async def create_transactions(self, transactions: list[dict]) -> int:
+        """Insert every row or none of them, returning how many were inserted.
+
+        A backend that spreads the rows over several files is only all or
+        none per file, and raises PartialCommitError if some files committed.
+        """
+
+    @abstractmethod
+    async def get_transaction(self, transaction_id: str) -> Optional["TransactionInDBModel"]:
+        ...
+
+    @abstractmethod
+    async def get_transactions(self,
+        account_id: str = None,
+        transaction_status: "TransactionStatus" = None,
+        transaction_type: "TransactionType" = None,
+        transaction_method: "TransactionMethod" = None,
+        disputed: bool = None,
+        created_from: datetime = None,
+        created_to: datetime = None,
+        before: tuple[datetime, str] = None,
+        limit: int = 50,
+    ) -> list["TransactionInDBModel"]:
+        """Page through transactions newest first, starting after the (created_at, id) key `before`.
+
+        A limit of None returns every matching transaction.
+        """
+
+    @abstractmethod
+    def stream_transactions(self, account_id: str, chunk_size: int) -> AsyncIterator[list["TransactionInDBModel"]]:
+        """Every transaction of the account, archived ones included, oldest first in chunks of up to chunk_size.
+
+        Rows are read as the chunks are taken, so only one chunk is held at a time.
+        """
+
+    @abstractmethod
+    async def update_transaction(self, transaction_id: str, transaction: "TransactionInDBModel") -> "TransactionInDBModel":
+        ...
+
+    @abstractmethod
+    async def process_transaction(self, transaction_id: str, processed_at: datetime, account_id: str = None) -> Optional["TransactionInDBModel"]:
+        """Mark a pending transaction processed and post it, or return None if it isn't pending."""
+
+    @abstractmethod
+    async def void_transaction(self, transaction_id: str, voided_at: datetime, account_id: str = None) -> Optional["TransactionInDBModel"]:
+        """Void a transaction, reversing its posting if it was processed, or return None if it is already void."""
+
+    @abstractmethod
+    async def get_pending_transaction_keys(self, created_before: datetime, after: tuple[datetime, str] = None, limit: int = 1000) -> list[tuple[datetime, str]]:
+        """The (created_at, id) keys of up to `limit` pending transactions created before created_before, oldest first, starting after the key `after`."""
+
+    @abstractmethod
+    async def process_transactions(self, transaction_ids: list[str], processed_at: datetime, account_id: str = None) -> dict[str, str]:
+        """process_transaction for many ids at once, all or none, returning the ids processed mapped to their accounts.
+
+        Ids that aren't pending, or not of account_id when it is given, are
+        left out. All or none is per file, as in create_transactions.
+        """
+
+    @abstractmethod
+    async def void_transactions(self, transaction_ids: list[str], voided_at: datetime, account_id: str = None) -> dict[str, str]:
+        """void_transaction for many ids at once, all or none, returning the ids voided mapped to their accounts.
+
+        Ids that are already void, or not of account_id when it is given, are
+        left out. All or none is per file, as in create_transactions.
+        """
+
+    @abstractmethod
+    async def get_transaction_totals(self, account_id: str, from_day: date = None, to_day: date = None) -> list[dict]:
+        """Totals of an account's transactions created from from_day up to, not including, to_day, from the daily rollups.
+
+        One dict per transaction type, ordered by type, with the count and
+        amount for each status: pending_count, pending_amount, processed_count
+        and so on.
+        """
+
+    @abstractmethod
+    async def create_balance_snapshots(self, taken_at: datetime) -> int:
+        """Snapshot the balance as of taken_at of every account with postings since its last snapshot.
+
+        Accounts already snapshotted at taken_at are left alone. Returns how
+        many snapshots were written.
+        """
+
+    @abstractmethod
+    async def get_balance_as_of(self, account_id: str, as_of: datetime) -> Optional[float]:
+        """The account's balance with everything posted up to and including as_of, or None for an unknown account.
+
+        Worked out from the latest snapshot at or before as_of plus the
+        postings since, so it costs at most a snapshot interval's postings.
+        """
+
+    @abstractmethod
+    async def archive_transactions(self, before: datetime, limit: int) -> int:
+        """Move up to `limit` processed or voided transactions created and posted before `before` out of the live store.
+
+        Archived transactions are still returned by get_transaction,
+        get_transactions and get_balance_as_of, but can no longer change.
+        Returns how many were moved; a backend that keeps every transaction
+        live returns 0.
+        """
+
+    @abstractmethod
+    async def get_idempotency_key(self, key: str, now: float) -> Optional["IdempotencyKey"]:
+        """The stored Idempotency-Key, or None if it was never used or has expired by `now`."""
+
+    @abstractmethod
+    async def reserve_idempotency_key(self, key: str, request_hash: str, now: float, expires_at: float) -> bool:
+        """Claim a key for a new request, returning False if it is already held by a live one."""
+
+    @abstractmethod
+    async def complete_idempotency_key(self, key: str, status_code: int, response: str):
+        """Store the response of the request holding the key."""
+
+    @abstractmethod
+    async def release_idempotency_key(self, key: str):
+        """Give up a claimed key whose request failed, so a retry runs it again."""
+
+    @abstractmethod
+    async def purge_idempotency_keys(self, now: float) -> int:
+        """Delete the keys that have expired by `now`, returning how many."""
@@ -1,9 +1,21 @@
-from sqlmodel import SQLModel, Relationship, Field, create_engine, Session, select, JSON
+import logging
+
+from sqlmodel import SQLModel, Relationship, Field, select, update, JSON
+from sqlalchemy import Index
+from sqlmodel.ext.asyncio.session import AsyncSession
 from decimal import Decimal
-from typing import Optional, Dict, List
+from typing import AsyncIterator, Optional, Dict, List
 from datetime import datetime
 from uuid import uuid4
 
+from ..engine import SQLiteDatabase
+from ..migrations import ACCOUNTS_MIGRATIONS
+from ..shards import ShardSessions
+from ...repository import AccountRepository
+
+
+logger = logging.getLogger(__name__)
+
 
 class AccountBase(SQLModel):
     id: str = Field(primary_key=True, index=True, description="Account ID")
@@ -37,7 +49,10 @@ class AccountBalance(SQLModel, table=True):
 
 
 class Account(AccountBase, table=True):
-    pass
+    __table_args__ = (
+        # Lets an account holder's listing be an index range scan, paged by id.
+        Index("ix_account_holder_active_id", "account_holder_id", "active", "id"),
+    )
 
 
 class SubLedgerAccount(Account, table=True):
@@ -59,106 +74,104 @@ class LinkedAccount(Account, table=True):
 
 
 sqlite_file_name = "accounts.db"
-sqlite_url = f"sqlite:///{sqlite_file_name}"
-
-engine = create_engine(sqlite_url
-# , echo=True
-)
 
+database = SQLiteDatabase(sqlite_file_name, ACCOUNTS_MIGRATIONS)
+async_session = database.session
 
-def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
 
-
-def drop_db_and_tables():
-    SQLModel.metadata.drop_all(engine)
+async def get_session() -> AsyncIterator[AsyncSession]:
+    async with async_session() as session:
+        yield session
 
 
 class AccountDB:
-    def __init__(self):
-        self.session = Session(engine)
-        create_db_and_tables()
+    def __init__(self, session: AsyncSession):
+        self.session = session
 
 
     async def get_account_by_id(self, account_id: str) -> AccountBase:
-        base_account = self.session.get(Account, account_id)
+        base_account = await self.session.get(Account, account_id)
         if not base_account:
-            sub_ledger_account = self.session.get(SubLedgerAccount,account_id)
-            print(sub_ledger_account)
-            return sub_ledger_account.dict()
-        print(base_account)
+            sub_ledger_account = await self.session.get(SubLedgerAccount,account_id)
+            return sub_ledger_account.dict() if sub_ledger_account else None
         return base_account.dict()
 
 
     async def create_account(self, account: dict) -> Account:
         try:
             new_account = Account(**account)
-            print(f"Creating account {new_account.id}")
+            logger.debug("Creating account %s", new_account.id)
             self.session.add(new_account)
-            self.session.commit()
-            self.session.refresh(new_account)
+            await self.session.commit()
+            await self.session.refresh(new_account)
             return new_account.dict()
-        except Exception as e:
-            print(e)
+        except Exception:
+            logger.exception("Could not create account %s", account.get("id"))
 
 
-    async def get_all_accounts(self) -> List[dict]:
-        base_accounts = [account.dict() for account in self.session.query(AccountBase).all()]
-        sub_ledger_accounts = [account.dict() for account in self.session.query(SubLedgerAccount).all()]
-        general_ledger_accounts = [account.dict() for account in self.session.query(GeneralLedgerAccount).all()]
-    
-        return base_accounts + sub_ledger_accounts + general_ledger_accounts
+    async def get_all_accounts(self, account_holder_id: str = None, active: bool = None, after: str = None, limit: int = 50) -> AsyncIterator[Account]:
+        """Stream up to `limit` accounts ordered by id, starting after the id `after`."""
+        query = select(Account)
+        if account_holder_id:
+            query = query.where(Account.account_holder_id == account_holder_id)
+        if active is not None:
+            query = query.where(Account.active == active)
+        if after:
+            query = query.where(Account.id > after)
+
+        result = await self.session.stream(query.order_by(Account.id).limit(limit))
+        async for account in result.scalars():
+            yield account
 
     
     async def get_general_ledger_account(self, account_id: str) -> dict:
         try: 
-            general_ledger_account = self.session.query(GeneralLedgerAccount).get(account_id)
+            general_ledger_account = await self.session.get(GeneralLedgerAccount, account_id)
             return general_ledger_account.dict()
-        except Exception as e:
-            print(e)
+        except Exception:
+            logger.exception("Could not get general ledger account %s", account_id)
             return None
 
 
     async def get_sub_ledger_account(self, account_id: str) -> dict:
         try: 
-            sub_ledger_account = SubLedgerAccount(**self.session.get(SubLedgerAccount, account_id))
-            return sub_ledger_account
-        except Exception as e:
-            print(e)
+            sub_ledger_account = await self.session.get(SubLedgerAccount, account_id)
+            return sub_ledger_account.dict()
+        except Exception:
+            logger.exception("Could not get sub ledger account %s", account_id)
             return None
 
 
     async def update_account(self, account: AccountBase) -> AccountBase:
         try:
-            self.session.query(AccountBase).filter(AccountBase.id == account.id).update(account.dict())
-            self.session.commit()
-            self.session.refresh(account)
+            await self.session.execute(update(Account).where(Account.id == account.id).values(**account.dict()))
+            await self.session.commit()
             return account
-        except Exception as e:
-            print(e)
+        except Exception:
+            logger.exception("Could not update account %s", account.id)
 
 
     async def create_sub_ledger_account(self, sub_ledger_account: SubLedgerAccount) -> SubLedgerAccount:
         try:
             new_sub_ledger_account = SubLedgerAccount(**sub_ledger_account)
             self.session.add(new_sub_ledger_account)
-            self.session.commit()
-            self.session.refresh(new_sub_ledger_account)
+            await self.session.commit()
+            await self.session.refresh(new_sub_ledger_account)
             return new_sub_ledger_account.dict()
-        except Exception as e:
-            print(e)
+        except Exception:
+            logger.exception("Could not create sub ledger account")
 
     
     async def update_sub_ledger_account(self, sub_ledger_account: SubLedgerAccount) -> SubLedgerAccount:
         try:
-            self.session.query(SubLedgerAccount).filter(SubLedgerAccount.id == sub_ledger_account.id).update(sub_ledger_account.dict())
-            self.session.commit()
-            self.session.refresh(sub_ledger_account)
+            await self.session.execute(update(SubLedgerAccount).where(SubLedgerAccount.id == sub_ledger_account.id).values(**sub_ledger_account.dict()))
+            await self.session.commit()
             return sub_ledger_account.dict()
-        except Exception as e:
-            print(e)
+        except Exception:
+            logger.exception("Could not update sub ledger account %s", sub_ledger_account.id)
     
     
+    @staticmethod
     def balance_constructor(account_id, balance, available_balance):
         return {
             "account_id": account_id,
@@ -169,34 +182,33 @@ class AccountDB:
 
     async def get_account_balance(self, account_id: str) -> dict:
         try:
-            account = self.session.get(Account, account_id)
+            account = await self.session.get(Account, account_id)
             
             if not account:
-                sub_ledger_account = self.session.get(SubLedgerAccount, account_id)
+                sub_ledger_account = await self.session.get(SubLedgerAccount, account_id)
                 
                 if not sub_ledger_account:
                     return None
     
                 return self.balance_constructor(account_id, sub_ledger_account.balance, sub_ledger_account.available_balance)
 
-            print(account)
             return {
             "account_id": account_id,
             "balance": account.balance,
             "available_balance": account.available_balance,
         }
 
-        except Exception as e:
-            print(e)
+        except Exception:
+            logger.exception("Could not get the balance of account %s", account_id)
             return None
 
 
     async def update_account_balance(self, account_id: str, balance: float = None, available_balance: float = None) -> dict: 
         try:
-            account = self.session.get(Account, account_id)
+            account = await self.session.get(Account, account_id)
             
             if not account:
-                sub_ledger_account = self.session.get(SubLedgerAccount, account_id)
+                sub_ledger_account = await self.session.get(SubLedgerAccount, account_id)
                 
                 if not sub_ledger_account:
                     return None
@@ -209,20 +221,21 @@ class AccountDB:
             if available_balance:
                 account.available_balance = available_balance
 
-            self.session.commit()
-            self.session.refresh(account)
-            return self.balance_constructor(account.balance, account.available_balance)
+            await self.session.commit()
+            await self.session.refresh(account)
+            return self.balance_constructor(account_id, account.balance, account.available_balance)
         
-        except Exception as e:
-            print(e)
+        except Exception:
+            logger.exception("Could not update the balance of account %s", account_id)
             return None
 
 
 class AccountBalanceDB:
-    def __init__(self):
-        self.session = Session(engine)
-        create_db_and_tables()
+    def __init__(self, sessions: ShardSessions):
+        # The ledger is sharded by account, so each balance is in its account's shard.
+        self.sessions = sessions
 
+    @staticmethod
     def __balance_constructor(account_id, balance, available_balance):
         return {
             "account_id": account_id,
@@ -233,22 +246,22 @@ class AccountBalanceDB:
 
     async def get_account_balance(self, account_id: str) -> dict:
         try:
-            account_balance = self.session.get(AccountBalance, account_id)
+            account_balance = await self.sessions.for_account(account_id).get(AccountBalance, account_id)
             
             if not account_balance:
                 return None
 
-            print(account_balance)
-            return self.__balance_constructor(account_id, account_balance.balance, account_balance.available_balance)
+            return account_balance.dict()
         
-        except Exception as e:
-            print(e)
+        except Exception:
+            logger.exception("Could not get the balance of account %s", account_id)
             return None
         
     
     async def update_account_balance(self, account_id: str, balance: float = None, available_balance: float = None) -> dict:
+        session = self.sessions.for_account(account_id)
         try:
-            account_balance = self.session.get(AccountBalance, account_id)
+            account_balance = await session.get(AccountBalance, account_id)
             
             if not account_balance:
                 return None
@@ -259,39 +272,46 @@ class AccountBalanceDB:
             if available_balance:
                 account_balance.available_balance = available_balance
             
-            self.session.commit()
-            self.session.refresh(account_balance)
+            await session.commit()
+            await session.refresh(account_balance)
             return self.__balance_constructor(account_id, account_balance.balance, account_balance.available_balance)
 
-        except Exception as e:
-            print(e)
+        except Exception:
+            logger.exception("Could not update the balance of account %s", account_id)
             return None
 
     
     async def create_account_balance(self, account_balance: dict) -> dict:
+        session = self.sessions.for_account(account_balance["id"])
         try:
-            new_account_balance = AccountBalance(**account_balance)
-            self.session.add(new_account_balance)
-            self.session.commit()
-            self.session.refresh(new_account_balance)
+            new_account_balance = AccountBalance(**{
+                # AccountBalance keeps epoch seconds rather than datetimes.
+                key: value.timestamp() if isinstance(value, datetime) else value
+                for key, value in account_balance.items()
+            })
+            session.add(new_account_balance)
+            await session.commit()
+            await session.refresh(new_account_balance)
             return {
                 "account_id": new_account_balance.id,
                 "balance": new_account_balance.balance,
                 "available_balance": new_account_balance.available_balance,
             }
         
-        except Exception as e:
-            print(e)
+        except Exception:
+            logger.exception("Could not create the balance of account %s", account_balance.get("id"))
             return None
 
 
-class AccountsDBController:
-    def __init__(self):
-        self.accounts_db = AccountDB()
-        self.account_balance_db = AccountBalanceDB()
+class AccountsDBController(AccountRepository):
+    def __init__(self, session: AsyncSession, ledger_sessions: ShardSessions):
+        # Balances are kept in the transactions (ledger) database so they can be
+        # posted in the same commit as the transaction that moves them.
+        self.accounts_db = AccountDB(session)
+        self.account_balance_db = AccountBalanceDB(ledger_sessions)
 
-    async def get_all_accounts(self) -> List[dict]:
-        return await self.accounts_db.get_all_accounts()
+    def get_all_accounts(self, account_holder_id: str = None, active: bool = None, after: str = None, limit: int = 50) -> AsyncIterator[Account]:
+        return self.accounts_db.get_all_accounts(account_holder_id, active, after, limit)
     
     async def get_account_balance(self, account_id: str) -> dict:
         return await self.account_balance_db.get_account_balance(account_id)
@@ -309,7 +329,7 @@ class AccountsDBController:
         return await self.accounts_db.get_sub_ledger_account(account_id)
     
     async def get_account_by_id(self, account_id: str) -> dict:
-        return await self.accounts_db.get_account(account_id)
+        return await self.accounts_db.get_account_by_id(account_id)
 
     async def update_account(self, account: Account) -> AccountBase:
         return await self.accounts_db.update_account(account)
@@ -0,0 +1,35 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+from ..registry import StorageBackend, register_backend
+from .accounts import db as accounts_db
+from .transactions import db as transactions_db
+
+
+@asynccontextmanager
+async def account_repository():
+    # Balances are kept in the transactions (ledger) database.
+    async with accounts_db.async_session() as session, transactions_db.database.sessions() as ledger_sessions:
+        yield accounts_db.AccountsDBController(session, ledger_sessions)
+
+
+@asynccontextmanager
+async def transaction_repository():
+    async with transactions_db.database.sessions() as sessions:
+        yield transactions_db.TransactionsDB(sessions)
+
+
+async def startup():
+    await asyncio.gather(accounts_db.database.open(), transactions_db.database.open())
+
+
+async def shutdown():
+    # Archive files are opened as months are read, so there can be many; close them whatever else fails.
+    try:
+        await accounts_db.database.close()
+        await transactions_db.database.close()
+    finally:
+        await transactions_db.archives.close()
+
+
+backend = register_backend(StorageBackend("sqlite", account_repository, transaction_repository, startup, shutdown))
@@ -0,0 +1,174 @@
+import asyncio
+from os.path import basename, splitext
+from time import perf_counter
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.sql.dml import UpdateBase
+from sqlmodel.orm.session import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from ...core import config
+from ...core.metrics import record_query
+from ...core.profiler import ProfiledQuery, request_profile
+from .migrations import migrate
+
+
+def _set_sqlite_pragmas(query_only: bool):
+    def on_connect(dbapi_connection, connection_record):
+        try:
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute(f"PRAGMA busy_timeout={config.SQLITE_BUSY_TIMEOUT}")
+            cursor.execute(f"PRAGMA mmap_size={config.SQLITE_MMAP_SIZE}")
+            cursor.execute(f"PRAGMA cache_size={config.SQLITE_CACHE_SIZE}")
+            if query_only:
+                cursor.execute("PRAGMA query_only=ON")
+            cursor.close()
+        except BaseException:
+            # The pool drops a connection that fails here, cancelled included,
+            # without closing it, and its thread would keep the process up.
+            dbapi_connection.close()
+            raise
+
+    return on_connect
+
+
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+
+def _explain(conn, statement: str, parameters) -> list[str]:
+    """The EXPLAIN QUERY PLAN steps for a statement, run on the raw connection so it isn't timed itself."""
+    if not statement.lstrip().upper().startswith(EXPLAINABLE):
+        return []
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)
+        return [row[3] for row in cursor.fetchall()]
+    except Exception:
+        return []
+    finally:
+        cursor.close()
+
+
+def _time_queries(engine: AsyncEngine, database: str):
+    # The plan of a statement doesn't depend on its parameter values, so one EXPLAIN per statement will do.
+    plans = {}
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(perf_counter())
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = perf_counter() - conn.info["query_started"].pop()
+        record_query(database, elapsed)
+
+        profile = request_profile.get()
+        if profile is not None:
+            plan = plans.get(statement)
+            if plan is None and not executemany:
+                plan = plans[statement] = _explain(conn, statement, parameters)
+            profile.record(ProfiledQuery(database, statement, parameters, elapsed, plan or []))
+
+    def handle_error(exception_context):
+        # A failed statement never reaches after_cursor_execute.
+        if exception_context.connection is not None and exception_context.connection.info.get("query_started"):
+            exception_context.connection.info["query_started"].pop()
+
+    event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine.sync_engine, "handle_error", handle_error)
+
+
+def create_sqlite_engine(sqlite_file_name: str, query_only: bool = False) -> AsyncEngine:
+    """Create a WAL-mode engine for a SQLite file.
+
+    The writer engine (the default) holds exactly one connection so writes from
+    this worker queue up in the pool instead of fighting over the file lock.
+    Pass query_only=True for the read pool.
+    """
+    sqlite_url = f"sqlite+aiosqlite:///{sqlite_file_name}"
+    engine = create_async_engine(sqlite_url,
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=config.SQLITE_READ_POOL_SIZE if query_only else 1,
+        max_overflow=0,
+        # echo=True
+    )
+    event.listen(engine.sync_engine, "connect", _set_sqlite_pragmas(query_only))
+    _time_queries(engine, splitext(basename(sqlite_file_name))[0])
+    return engine
+
+
+class RoutingSession(Session):
+    """Sends flushes and INSERT/UPDATE/DELETE statements to the writer, everything else to the readers.
+
+    A read that must see the writer's uncommitted changes, or hold still
+    under its lock, can name it: bind_arguments={"bind": session.writer}.
+    """
+
+    def __init__(self, writer: AsyncEngine, reader: AsyncEngine, **kw):
+        super().__init__(**kw)
+        self.writer = writer.sync_engine
+        self.reader = reader.sync_engine
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kw):
+        if bind is not None:
+            return bind
+        if self._flushing or isinstance(clause, UpdateBase):
+            return self.writer
+        return self.reader
+
+
+class RoutingAsyncSession(AsyncSession):
+    def __init__(self, writer: AsyncEngine, reader: AsyncEngine, **kw):
+        kw["future"] = True
+        self.bind = writer
+        self.sync_session = self._proxied = self._assign_proxied(
+            RoutingSession(writer, reader, **kw)
+        )
+
+    @property
+    def writer(self):
+        return self.sync_session.writer
+
+
+def create_session_factory(writer: AsyncEngine, reader: AsyncEngine) -> sessionmaker:
+    return sessionmaker(class_=RoutingAsyncSession, writer=writer, reader=reader, expire_on_commit=False)
+
+
+class SQLiteDatabase:
+    """One SQLite file: its writer and reader engines and the session factory between them.
+
+    Nothing is created until open(), which the app's lifespan calls once per
+    worker. It migrates the file to the latest schema, then builds the engines.
+    """
+
+    def __init__(self, sqlite_file_name: str, migrations: list[list[str]]):
+        self.sqlite_file_name = sqlite_file_name
+        self.migrations = migrations
+        self.engine: Optional[AsyncEngine] = None
+        self.read_engine: Optional[AsyncEngine] = None
+        self.session_factory: Optional[sessionmaker] = None
+
+    async def open(self):
+        if self.session_factory is not None:
+            return
+        await asyncio.to_thread(migrate, self.sqlite_file_name, self.migrations)
+        self.engine = create_sqlite_engine(self.sqlite_file_name)
+        self.read_engine = create_sqlite_engine(self.sqlite_file_name, query_only=True)
+        self.session_factory = create_session_factory(self.engine, self.read_engine)
+
+    def session(self) -> RoutingAsyncSession:
+        if self.session_factory is None:
+            raise RuntimeError(f"{self.sqlite_file_name} is not open, start the app's lifespan first")
+        return self.session_factory()
+
+    async def close(self):
+        if self.session_factory is None:
+            return
+        await self.engine.dispose()
+        await self.read_engine.dispose()
+        self.engine = self.read_engine = self.session_factory = None
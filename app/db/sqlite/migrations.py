@@ -0,0 +1,297 @@
+import sqlite3
+
+from ...core import config
+
+
+# Each database's schema history, oldest first. A migration is the list of
+# statements that moves the schema up one version, and PRAGMA user_version
+# records how many have run. Never edit a migration that has shipped, append
+# a new one instead.
+#
+# Files created by the old create_all() startup have tables but user_version
+# 0, so the statements are written to be no-ops where they already apply.
+
+ACCOUNTS_MIGRATIONS = [
+    # 1: the account table as create_all() made it.
+    [
+        """CREATE TABLE IF NOT EXISTS account (
+            id VARCHAR NOT NULL,
+            account_name VARCHAR NOT NULL,
+            account_type VARCHAR NOT NULL,
+            balance FLOAT NOT NULL,
+            available_balance FLOAT NOT NULL,
+            currency VARCHAR NOT NULL,
+            account_holder_id VARCHAR NOT NULL,
+            active BOOLEAN NOT NULL,
+            created_at DATETIME NOT NULL,
+            updated_at DATETIME NOT NULL,
+            PRIMARY KEY (id)
+        )""",
+        "CREATE INDEX IF NOT EXISTS ix_account_id ON account (id)",
+        "CREATE INDEX IF NOT EXISTS ix_account_account_holder_id ON account (account_holder_id)",
+        "CREATE INDEX IF NOT EXISTS ix_account_active ON account (active)",
+    ],
+    # 2: an account holder's listing as an index range scan, paged by id.
+    [
+        "CREATE INDEX IF NOT EXISTS ix_account_holder_active_id ON account (account_holder_id, active, id)",
+    ],
+]
+
+TRANSACTIONS_MIGRATIONS = [
+    # 1: the ledger tables as create_all() made them.
+    [
+        """CREATE TABLE IF NOT EXISTS accountbalance (
+            id VARCHAR NOT NULL,
+            balance FLOAT NOT NULL,
+            available_balance FLOAT NOT NULL,
+            created_at FLOAT NOT NULL,
+            updated_at FLOAT NOT NULL,
+            PRIMARY KEY (id)
+        )""",
+        "CREATE INDEX IF NOT EXISTS ix_accountbalance_id ON accountbalance (id)",
+        """CREATE TABLE IF NOT EXISTS transactionindbmodel (
+            id VARCHAR NOT NULL,
+            account_id VARCHAR NOT NULL,
+            destination_account_id VARCHAR NOT NULL,
+            amount NUMERIC NOT NULL,
+            reference VARCHAR(32) NOT NULL,
+            description VARCHAR(255) NOT NULL,
+            transaction_type VARCHAR NOT NULL,
+            transaction_method VARCHAR NOT NULL,
+            transaction_method_id VARCHAR,
+            disputed BOOLEAN NOT NULL,
+            created_at DATETIME NOT NULL,
+            updated_at DATETIME NOT NULL,
+            transaction_status VARCHAR NOT NULL,
+            processed_at DATETIME,
+            voided_at DATETIME,
+            PRIMARY KEY (id)
+        )""",
+        "CREATE INDEX IF NOT EXISTS ix_transactionindbmodel_id ON transactionindbmodel (id)",
+        "CREATE INDEX IF NOT EXISTS ix_transactionindbmodel_account_id ON transactionindbmodel (account_id)",
+        "CREATE INDEX IF NOT EXISTS ix_transactionindbmodel_destination_account_id ON transactionindbmodel (destination_account_id)",
+        "CREATE INDEX IF NOT EXISTS ix_transactionindbmodel_transaction_type ON transactionindbmodel (transaction_type)",
+        "CREATE INDEX IF NOT EXISTS ix_transactionindbmodel_transaction_method ON transactionindbmodel (transaction_method)",
+        "CREATE INDEX IF NOT EXISTS ix_transactionindbmodel_disputed ON transactionindbmodel (disputed)",
+        "CREATE INDEX IF NOT EXISTS ix_transactionindbmodel_created_at ON transactionindbmodel (created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_transactionindbmodel_transaction_status ON transactionindbmodel (transaction_status)",
+    ],
+    # 2: keyset pagination of an account's history and its filtered views.
+    [
+        "CREATE INDEX IF NOT EXISTS ix_transaction_account_created_at_id ON transactionindbmodel (account_id, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS ix_transaction_account_status_created_at ON transactionindbmodel (account_id, transaction_status, created_at)",
+    ],
+    # 3: stored responses for Idempotency-Key retries.
+    [
+        """CREATE TABLE IF NOT EXISTS idempotencykey (
+            key VARCHAR NOT NULL,
+            request_hash VARCHAR NOT NULL,
+            status_code INTEGER,
+            response VARCHAR,
+            created_at FLOAT NOT NULL,
+            expires_at FLOAT NOT NULL,
+            PRIMARY KEY (key)
+        )""",
+        "CREATE INDEX IF NOT EXISTS ix_idempotencykey_expires_at ON idempotencykey (expires_at)",
+    ],
+    # 4: per account, day and type totals for each status, kept up to date by
+    # triggers on every insert and update of a transaction, then backfilled.
+    [
+        """CREATE TABLE IF NOT EXISTS dailyrollup (
+            account_id VARCHAR NOT NULL,
+            day DATE NOT NULL,
+            transaction_type VARCHAR NOT NULL,
+            pending_count INTEGER NOT NULL DEFAULT 0,
+            pending_amount FLOAT NOT NULL DEFAULT 0,
+            processed_count INTEGER NOT NULL DEFAULT 0,
+            processed_amount FLOAT NOT NULL DEFAULT 0,
+            void_count INTEGER NOT NULL DEFAULT 0,
+            void_amount FLOAT NOT NULL DEFAULT 0,
+            PRIMARY KEY (account_id, day, transaction_type)
+        )""",
+        """CREATE TRIGGER IF NOT EXISTS tr_dailyrollup_insert AFTER INSERT ON transactionindbmodel
+        BEGIN
+            INSERT INTO dailyrollup (account_id, day, transaction_type, pending_count, pending_amount, processed_count, processed_amount, void_count, void_amount)
+            VALUES (
+                NEW.account_id, date(NEW.created_at), NEW.transaction_type,
+                NEW.transaction_status = 'pending', CASE WHEN NEW.transaction_status = 'pending' THEN NEW.amount ELSE 0 END,
+                NEW.transaction_status = 'processed', CASE WHEN NEW.transaction_status = 'processed' THEN NEW.amount ELSE 0 END,
+                NEW.transaction_status = 'void', CASE WHEN NEW.transaction_status = 'void' THEN NEW.amount ELSE 0 END
+            )
+            ON CONFLICT (account_id, day, transaction_type) DO UPDATE SET
+                pending_count = pending_count + excluded.pending_count,
+                pending_amount = pending_amount + excluded.pending_amount,
+                processed_count = processed_count + excluded.processed_count,
+                processed_amount = processed_amount + excluded.processed_amount,
+                void_count = void_count + excluded.void_count,
+                void_amount = void_amount + excluded.void_amount;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS tr_dailyrollup_update AFTER UPDATE ON transactionindbmodel
+        WHEN OLD.transaction_status IS NOT NEW.transaction_status
+            OR OLD.amount IS NOT NEW.amount
+            OR OLD.transaction_type IS NOT NEW.transaction_type
+            OR OLD.account_id IS NOT NEW.account_id
+            OR date(OLD.created_at) IS NOT date(NEW.created_at)
+        BEGIN
+            UPDATE dailyrollup SET
+                pending_count = pending_count - (OLD.transaction_status = 'pending'),
+                pending_amount = pending_amount - CASE WHEN OLD.transaction_status = 'pending' THEN OLD.amount ELSE 0 END,
+                processed_count = processed_count - (OLD.transaction_status = 'processed'),
+                processed_amount = processed_amount - CASE WHEN OLD.transaction_status = 'processed' THEN OLD.amount ELSE 0 END,
+                void_count = void_count - (OLD.transaction_status = 'void'),
+                void_amount = void_amount - CASE WHEN OLD.transaction_status = 'void' THEN OLD.amount ELSE 0 END
+            WHERE account_id = OLD.account_id AND day = date(OLD.created_at) AND transaction_type = OLD.transaction_type;
+            INSERT INTO dailyrollup (account_id, day, transaction_type, pending_count, pending_amount, processed_count, processed_amount, void_count, void_amount)
+            VALUES (
+                NEW.account_id, date(NEW.created_at), NEW.transaction_type,
+                NEW.transaction_status = 'pending', CASE WHEN NEW.transaction_status = 'pending' THEN NEW.amount ELSE 0 END,
+                NEW.transaction_status = 'processed', CASE WHEN NEW.transaction_status = 'processed' THEN NEW.amount ELSE 0 END,
+                NEW.transaction_status = 'void', CASE WHEN NEW.transaction_status = 'void' THEN NEW.amount ELSE 0 END
+            )
+            ON CONFLICT (account_id, day, transaction_type) DO UPDATE SET
+                pending_count = pending_count + excluded.pending_count,
+                pending_amount = pending_amount + excluded.pending_amount,
+                processed_count = processed_count + excluded.processed_count,
+                processed_amount = processed_amount + excluded.processed_amount,
+                void_count = void_count + excluded.void_count,
+                void_amount = void_amount + excluded.void_amount;
+        END""",
+        # Rebuilt from scratch, so running this again over a partial table can't double count.
+        "DELETE FROM dailyrollup",
+        """INSERT INTO dailyrollup (account_id, day, transaction_type, pending_count, pending_amount, processed_count, processed_amount, void_count, void_amount)
+        SELECT
+            account_id, date(created_at), transaction_type,
+            sum(transaction_status = 'pending'), total(CASE WHEN transaction_status = 'pending' THEN amount END),
+            sum(transaction_status = 'processed'), total(CASE WHEN transaction_status = 'processed' THEN amount END),
+            sum(transaction_status = 'void'), total(CASE WHEN transaction_status = 'void' THEN amount END)
+        FROM transactionindbmodel
+        GROUP BY account_id, date(created_at), transaction_type""",
+    ],
+    # 5: balance snapshots, and an account's postings by time: processing a
+    # transaction posts it at processed_at, voiding it after reverses that at
+    # voided_at. A write that moves a posting to before a snapshot drops that
+    # snapshot and the later ones, which no longer hold.
+    [
+        """CREATE TABLE IF NOT EXISTS balancesnapshot (
+            account_id VARCHAR NOT NULL,
+            taken_at DATETIME NOT NULL,
+            balance FLOAT NOT NULL,
+            PRIMARY KEY (account_id, taken_at)
+        )""",
+        "CREATE INDEX IF NOT EXISTS ix_transaction_account_processed_at ON transactionindbmodel (account_id, processed_at)",
+        "CREATE INDEX IF NOT EXISTS ix_transaction_account_voided_at ON transactionindbmodel (account_id, voided_at)",
+        """CREATE TRIGGER IF NOT EXISTS tr_balancesnapshot_insert AFTER INSERT ON transactionindbmodel
+        WHEN NEW.processed_at IS NOT NULL
+        BEGIN
+            DELETE FROM balancesnapshot WHERE account_id = NEW.account_id AND taken_at >= NEW.processed_at;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS tr_balancesnapshot_update AFTER UPDATE ON transactionindbmodel
+        WHEN OLD.processed_at IS NOT NEW.processed_at
+            OR OLD.voided_at IS NOT NEW.voided_at
+            OR OLD.amount IS NOT NEW.amount
+            OR OLD.transaction_type IS NOT NEW.transaction_type
+            OR OLD.account_id IS NOT NEW.account_id
+        BEGIN
+            -- The earliest of the old and new posting times; '9999' stands in for a missing one.
+            DELETE FROM balancesnapshot
+            WHERE account_id IN (OLD.account_id, NEW.account_id)
+                AND taken_at >= min(
+                    coalesce(OLD.processed_at, '9999'), coalesce(OLD.voided_at, '9999'),
+                    coalesce(NEW.processed_at, '9999'), coalesce(NEW.voided_at, '9999')
+                );
+        END""",
+    ],
+    # 6: where archived transactions went, see ARCHIVE_MIGRATIONS.
+    [
+        """CREATE TABLE IF NOT EXISTS transactionarchive (
+            month VARCHAR NOT NULL,
+            archived_before DATETIME NOT NULL,
+            PRIMARY KEY (month)
+        )""",
+        """CREATE TABLE IF NOT EXISTS archivedtransaction (
+            id VARCHAR NOT NULL,
+            month VARCHAR NOT NULL,
+            PRIMARY KEY (id)
+        )""",
+    ],
+    # 7: pending transactions across accounts, oldest first, for the settlement job.
+    [
+        "CREATE INDEX IF NOT EXISTS ix_transaction_status_created_at_id ON transactionindbmodel (transaction_status, created_at, id)",
+    ],
+    # 8: which accounts each archived month holds. Months archived before this
+    # have accounts_tracked 0 and are read for every account.
+    [
+        "ALTER TABLE transactionarchive ADD COLUMN accounts_tracked BOOLEAN NOT NULL DEFAULT 0",
+        """CREATE TABLE IF NOT EXISTS accountarchivemonth (
+            account_id VARCHAR NOT NULL,
+            month VARCHAR NOT NULL,
+            PRIMARY KEY (account_id, month)
+        )""",
+    ],
+]
+
+# A month of archived transactions, one file per shard and month. Archived
+# rows are only read, by id or by account and time, so only those are indexed.
+ARCHIVE_MIGRATIONS = [
+    # 1: the transaction table as the ledger has it, with fewer indexes.
+    [
+        """CREATE TABLE IF NOT EXISTS transactionindbmodel (
+            id VARCHAR NOT NULL,
+            account_id VARCHAR NOT NULL,
+            destination_account_id VARCHAR NOT NULL,
+            amount NUMERIC NOT NULL,
+            reference VARCHAR(32) NOT NULL,
+            description VARCHAR(255) NOT NULL,
+            transaction_type VARCHAR NOT NULL,
+            transaction_method VARCHAR NOT NULL,
+            transaction_method_id VARCHAR,
+            disputed BOOLEAN NOT NULL,
+            created_at DATETIME NOT NULL,
+            updated_at DATETIME NOT NULL,
+            transaction_status VARCHAR NOT NULL,
+            processed_at DATETIME,
+            voided_at DATETIME,
+            PRIMARY KEY (id)
+        )""",
+        "CREATE INDEX IF NOT EXISTS ix_transaction_account_created_at_id ON transactionindbmodel (account_id, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS ix_transaction_created_at_id ON transactionindbmodel (created_at, id)",
+        "CREATE INDEX IF NOT EXISTS ix_transaction_account_processed_at ON transactionindbmodel (account_id, processed_at)",
+        "CREATE INDEX IF NOT EXISTS ix_transaction_account_voided_at ON transactionindbmodel (account_id, voided_at)",
+    ],
+]
+
+
+def schema_version(connection: sqlite3.Connection) -> int:
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(sqlite_file_name: str, migrations: list[list[str]]) -> int:
+    """Bring a SQLite file up to the latest version, returning the version it was at.
+
+    An up to date file costs a single PRAGMA read. Otherwise the migrations
+    run in one write transaction taken before the version is read again, so
+    when several workers start at once one of them migrates and the rest find
+    nothing left to do.
+    """
+    connection = sqlite3.connect(sqlite_file_name, isolation_level=None, timeout=config.SQLITE_BUSY_TIMEOUT / 1000)
+    try:
+        version = schema_version(connection)
+        if version >= len(migrations):
+            return version
+
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            version = schema_version(connection)
+            for statements in migrations[version:]:
+                for statement in statements:
+                    connection.execute(statement)
+            # PRAGMA doesn't take parameters, but this is our own integer.
+            connection.execute(f"PRAGMA user_version = {max(version, len(migrations))}")
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return version
+    finally:
+        connection.close()
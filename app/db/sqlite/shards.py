@@ -0,0 +1,230 @@
+import asyncio
+import os
+import zlib
+from contextlib import asynccontextmanager, suppress
+from os.path import basename, splitext
+from typing import AsyncIterator, Optional
+from uuid import uuid4
+
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from .engine import RoutingAsyncSession, SQLiteDatabase
+from .writer import GroupCommitWriter
+from ..repository import PartialCommitError
+
+
+# Accounts hash to one of SLOTS slots, and a shard holds every slot equal to
+# its index modulo the shard count. Transaction ids start with their account's
+# slot, so a transaction is found in its account's shard from the id alone.
+SLOTS = 1 << 16
+SLOT_DIGITS = 4
+
+
+def slot(key: str) -> int:
+    return zlib.crc32(key.encode()) % SLOTS
+
+
+def new_transaction_id(account_id: str) -> str:
+    """A random id, like uuid4().hex, that starts with the account's slot."""
+    return f"{slot(account_id):0{SLOT_DIGITS}x}{uuid4().hex[SLOT_DIGITS:]}"
+
+
+def transaction_slot(transaction_id: str) -> int:
+    try:
+        return int(transaction_id[:SLOT_DIGITS], 16)
+    except ValueError:
+        # Not one of ours, so it isn't stored anywhere; any shard can say so.
+        return 0
+
+
+def shard_file_name(sqlite_file_name: str, shard: int, shards: int) -> str:
+    """transactions.db for a single shard, transactions-0.db, transactions-1.db and so on for more."""
+    if shards == 1:
+        return sqlite_file_name
+    name, extension = splitext(sqlite_file_name)
+    return f"{name}-{shard}{extension}"
+
+
+class ShardedDatabase:
+    """A database split across SQLite files by a hash of the account id.
+
+    Each shard is a SQLiteDatabase with its own writer engine and its own
+    group commit writer, so writes to different shards don't wait on each
+    other's file lock. Everything in a shard is keyed by account, so a
+    transaction, its account's balance and the balance postings between them
+    always share a file and commit together.
+
+    The shard count can't change once the files hold data: rows would be
+    looked for in shards they were never written to.
+    """
+
+    def __init__(self, sqlite_file_name: str, migrations: list[list[str]], shards: int, max_batch_size: int, max_delay_ms: int):
+        self.shards = [SQLiteDatabase(shard_file_name(sqlite_file_name, shard, shards), migrations) for shard in range(shards)]
+        self.writers = [GroupCommitWriter(shard.session, max_batch_size=max_batch_size, max_delay_ms=max_delay_ms) for shard in self.shards]
+
+    def for_account(self, account_id: str) -> int:
+        return slot(account_id) % len(self.shards)
+
+    def for_transaction(self, transaction_id: str) -> int:
+        return transaction_slot(transaction_id) % len(self.shards)
+
+    def for_key(self, key: str) -> int:
+        """The shard for a row that belongs to no account, such as an Idempotency-Key."""
+        return slot(key) % len(self.shards)
+
+    def sessions(self) -> "ShardSessions":
+        return ShardSessions(self)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(writer.queue_depth for writer in self.writers)
+
+    async def open(self):
+        await asyncio.gather(*(shard.open() for shard in self.shards))
+
+    async def close(self):
+        for writer in self.writers:
+            await writer.stop()
+        for shard in self.shards:
+            await shard.close()
+
+
+class ShardSessions:
+    """The sessions a request uses on a ShardedDatabase, opened on first use of each shard."""
+
+    def __init__(self, database: ShardedDatabase):
+        self.database = database
+        self.opened: dict[int, AsyncSession] = {}
+
+    def __getitem__(self, shard: int) -> AsyncSession:
+        session = self.opened.get(shard)
+        if session is None:
+            session = self.opened[shard] = self.database.shards[shard].session()
+        return session
+
+    def for_account(self, account_id: str) -> AsyncSession:
+        return self[self.database.for_account(account_id)]
+
+    def for_transaction(self, transaction_id: str) -> AsyncSession:
+        return self[self.database.for_transaction(transaction_id)]
+
+    def for_key(self, key: str) -> AsyncSession:
+        return self[self.database.for_key(key)]
+
+    def all(self) -> list[AsyncSession]:
+        return [self[shard] for shard in range(len(self.database.shards))]
+
+    async def commit(self, applied: dict[int, dict[str, str]]) -> dict[str, str]:
+        """Commit the shards in `applied`, in order, returning the transaction ids they applied mapped to their accounts.
+
+        SQLite commits each file on its own, so this is all or none per shard
+        only. Every shard has been written by now and holds its file's lock,
+        so a commit fails only on an I/O error. If one does after an earlier
+        shard committed, the rest are rolled back and PartialCommitError
+        carries what the committed shards applied. The commits run to the end
+        even if the caller is cancelled, so cancelling can't split them.
+        """
+        commits = asyncio.ensure_future(self._commit(applied))
+        try:
+            return await asyncio.shield(commits)
+        except asyncio.CancelledError:
+            # Let the commits finish, then pass the cancellation on.
+            with suppress(Exception):
+                await asyncio.shield(commits)
+            raise
+
+    async def _commit(self, applied: dict[int, dict[str, str]]) -> dict[str, str]:
+        committed: dict[str, str] = {}
+        shards = sorted(applied)
+        for index, shard in enumerate(shards):
+            try:
+                await self[shard].commit()
+            except Exception as e:
+                for rest in shards[index:]:
+                    await self[rest].rollback()
+                if not committed:
+                    raise
+                raise PartialCommitError(committed) from e
+            committed.update(applied[shard])
+        return committed
+
+    async def __aenter__(self) -> "ShardSessions":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        sessions, self.opened = list(self.opened.values()), {}
+        # Shielded, so a request or job cancelled on its way out still gives
+        # back every connection rather than leaving one checked out for good.
+        await asyncio.shield(self._close(sessions))
+
+    @staticmethod
+    async def _close(sessions: list[AsyncSession]):
+        for session in sessions:
+            await session.close()
+
+
+class ArchiveDatabases:
+    """A ShardedDatabase's archive: one SQLite file per shard and month, opened on first use.
+
+    Files are named after their shard's file and the month, such as
+    archive/transactions-2024-01.db, or archive/transactions-3-2024-01.db
+    with several shards. At most max_open stay open between reads; past
+    that the least recently used ones nobody is reading are closed.
+    """
+
+    def __init__(self, database: ShardedDatabase, directory: str, migrations: list[list[str]], max_open: int = 16):
+        self.database = database
+        self.directory = directory
+        self.migrations = migrations
+        self.max_open = max_open
+        # Least recently used first.
+        self.opened: dict[tuple[int, str], SQLiteDatabase] = {}
+        self.readers: dict[tuple[int, str], int] = {}
+        self._lock: Optional[asyncio.Lock] = None
+
+    def file_name(self, shard: int, month: str) -> str:
+        name, extension = splitext(basename(self.database.shards[shard].sqlite_file_name))
+        return os.path.join(self.directory, f"{name}-{month}{extension}")
+
+    @asynccontextmanager
+    async def session(self, shard: int, month: str) -> AsyncIterator[RoutingAsyncSession]:
+        key = (shard, month)
+        archive = await self._open(shard, month)
+        # Counted from here on, with no await since it was opened, so it can't be closed under us.
+        self.readers[key] = self.readers.get(key, 0) + 1
+        try:
+            async with archive.session() as session:
+                yield session
+        finally:
+            self.readers[key] -= 1
+            if not self.readers[key]:
+                del self.readers[key]
+            await asyncio.shield(self._close_idle())
+
+    async def _open(self, shard: int, month: str) -> SQLiteDatabase:
+        archive = self.opened.pop((shard, month), None)
+        if archive is not None:
+            self.opened[(shard, month)] = archive
+        else:
+            if self._lock is None:
+                self._lock = asyncio.Lock()
+            # Held while opening, so two requests for a new month don't both build its engines.
+            async with self._lock:
+                archive = self.opened.get((shard, month))
+                if archive is None:
+                    await asyncio.to_thread(os.makedirs, self.directory, exist_ok=True)
+                    archive = SQLiteDatabase(self.file_name(shard, month), self.migrations)
+                    await archive.open()
+                    self.opened[(shard, month)] = archive
+        return archive
+
+    async def _close_idle(self):
+        idle = [key for key in self.opened if key not in self.readers]
+        closing = [self.opened.pop(key) for key in idle[:len(self.opened) - self.max_open]]
+        for archive in closing:
+            await archive.close()
+
+    async def close(self):
+        archives, self.opened = list(self.opened.values()), {}
+        for archive in archives:
+            await archive.close()
@@ -1,9 +1,23 @@
-from sqlmodel import SQLModel, Relationship, Field, create_engine, Session, select, JSON
+import asyncio
+
+from sqlmodel import SQLModel, Relationship, Field, select, JSON
+from sqlalchemy import Index, and_, case, delete, exists, func, insert, literal, or_, tuple_, update
+from sqlalchemy.sql import Select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel.ext.asyncio.session import AsyncSession
+from collections import deque
+from heapq import merge
 from decimal import Decimal
-from typing import Optional
+from typing import AsyncIterator, Optional
 from pydantic import BaseModel
 from enum import Enum
-from datetime import datetime
+from datetime import date, datetime, timedelta, timezone
+
+from ..migrations import ARCHIVE_MIGRATIONS, TRANSACTIONS_MIGRATIONS
+from ..shards import ArchiveDatabases, ShardedDatabase, ShardSessions
+from ..accounts.db import AccountBalance
+from ...repository import TransactionRepository
+from ....core import config
 
 
 class TransactionType(str, Enum):
@@ -32,6 +46,14 @@ class TransactionMethod(str, Enum):
     OTHER = 'other'
 
 
+CREDIT_TRANSACTION_TYPES = {
+    TransactionType.CREDIT,
+    TransactionType.REFUND_CREDIT,
+    TransactionType.TRANSFER_CREDIT,
+    TransactionType.REVERSAL_CREDIT,
+}
+
+
 class BaseTransactionInDBModel(SQLModel):
     id: str = Field(description="The ID of this transaction", primary_key=True, index=True)
     account_id: str = Field(description="The ID of the account this transaction belongs to", index=True)
@@ -51,158 +73,775 @@ class BaseTransactionInDBModel(SQLModel):
 
 
 class TransactionInDBModel(BaseTransactionInDBModel, table=True):
+    __table_args__ = (
+        # Keyset pagination of an account's history, newest first.
+        Index("ix_transaction_account_created_at_id", "account_id", "created_at", "id"),
+        # Filtered views of one account, e.g. its pending transactions in a date range.
+        Index("ix_transaction_account_status_created_at", "account_id", "transaction_status", "created_at"),
+        # An account's postings in a time range, for balances as of a time.
+        Index("ix_transaction_account_processed_at", "account_id", "processed_at"),
+        Index("ix_transaction_account_voided_at", "account_id", "voided_at"),
+        # Pending transactions across accounts, oldest first, for settlement.
+        Index("ix_transaction_status_created_at_id", "transaction_status", "created_at", "id"),
+    )
+
     class Config:
         orm_mode = True
         allow_population_by_field_name = True
         arbitrary_types_allowed = True
 
 
-sqlite_file_name = "transactions.db"
-sqlite_url = f"sqlite:///{sqlite_file_name}"
+class DailyRollup(SQLModel, table=True):
+    """Count and total amount per status of an account's transactions of one type created on one day (UTC).
+
+    Maintained by triggers on the transaction table, see migration 4.
+    """
+    account_id: str = Field(primary_key=True)
+    day: date = Field(primary_key=True)
+    transaction_type: str = Field(primary_key=True)
+    pending_count: int = 0
+    pending_amount: float = 0.0
+    processed_count: int = 0
+    processed_amount: float = 0.0
+    void_count: int = 0
+    void_amount: float = 0.0
+
+
+ROLLUP_TOTALS = ("pending_count", "pending_amount", "processed_count", "processed_amount", "void_count", "void_amount")
+
+
+class IdempotencyKey(SQLModel, table=True):
+    """The outcome of the first request sent with an Idempotency-Key, replayed to its retries."""
+    key: str = Field(primary_key=True, description="The Idempotency-Key header value")
+    request_hash: str = Field(description="Hash of the request body, to catch a key reused for a different request")
+    status_code: Optional[int] = Field(None, description="The response status, null while the first request is still running")
+    response: Optional[str] = Field(None, description="The JSON response body")
+    created_at: float = Field(description="When the key was first used, in epoch seconds")
+    expires_at: float = Field(index=True, description="When the key can be used again, in epoch seconds")
+
+
+class TransactionArchive(SQLModel, table=True):
+    """A month with transactions moved out of the ledger into its archive files."""
+    month: str = Field(primary_key=True, description="The month the transactions were created in, as YYYY-MM")
+    archived_before: datetime = Field(description="Every transaction archived to this month was created and posted before this time, in UTC")
+    accounts_tracked: bool = Field(True, description="Whether AccountArchiveMonth lists every account with transactions in this month")
 
 
-engine = create_engine(sqlite_url
-# , echo=True
+class AccountArchiveMonth(SQLModel, table=True):
+    """An account with transactions in a month's archive, so listings only open the months that can hold its rows."""
+    account_id: str = Field(primary_key=True, description="The ID of the account")
+    month: str = Field(primary_key=True, description="The archived month, as YYYY-MM")
+
+
+class ArchivedTransaction(SQLModel, table=True):
+    """Which month's archive an archived transaction went to, so it can still be found by id."""
+    id: str = Field(primary_key=True, description="The ID of the transaction")
+    month: str = Field(description="The month it was archived to, as YYYY-MM")
+
+
+class BalanceSnapshot(SQLModel, table=True):
+    """An account's balance as of a point in time, written by the balance snapshot job."""
+    account_id: str = Field(primary_key=True, description="The ID of the account")
+    taken_at: datetime = Field(primary_key=True, description="The balance includes everything posted up to and including this time, in UTC")
+    balance: float = Field(description="The balance of the account at taken_at")
+
+
+def signed_amount(transaction: "TransactionInDBModel") -> float:
+    """The amount a transaction adds to its account's balance: positive for credits, negative for debits."""
+    amount = float(transaction.amount)
+    return amount if transaction.transaction_type in CREDIT_TRANSACTION_TYPES else -amount
+
+
+# signed_amount() as SQL.
+signed_amount_column = case(
+    (TransactionInDBModel.transaction_type.in_([transaction_type.value for transaction_type in CREDIT_TRANSACTION_TYPES]), TransactionInDBModel.amount),
+    else_=-TransactionInDBModel.amount,
 )
 
 
-def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+def archive_month(created_at: datetime) -> str:
+    return created_at.strftime("%Y-%m")
+
+
+def month_start(month: str) -> datetime:
+    return datetime.strptime(month, "%Y-%m")
+
+
+def month_end(month: str) -> datetime:
+    """The start of the month after `month`."""
+    return (datetime.strptime(month, "%Y-%m") + timedelta(days=31)).replace(day=1)
+
+
+def newest_first(pages: list[list[TransactionInDBModel]], limit: Optional[int]) -> list[TransactionInDBModel]:
+    """The first `limit` transactions of pages sorted newest first, merged.
+
+    A transaction caught between being copied to its archive and leaving
+    the ledger is in two pages; it is only listed once.
+    """
+    rows, last_id = [], None
+    for transaction in merge(*pages, key=lambda transaction: (transaction.created_at, transaction.id), reverse=True):
+        if limit and len(rows) == limit:
+            break
+        if transaction.id != last_id:
+            rows.append(transaction)
+            last_id = transaction.id
+    return rows
+
+
+async def oldest_first(streams: list[AsyncIterator[list[TransactionInDBModel]]], chunk_size: int) -> AsyncIterator[list[TransactionInDBModel]]:
+    """Chunked streams each sorted oldest first, merged into one and chunked again.
+
+    Only the current chunk of each stream is held. As in newest_first, a
+    transaction found in two streams is only listed once.
+    """
+    if len(streams) == 1:
+        async for chunk in streams[0]:
+            yield chunk
+        return
+
+    heads: dict[AsyncIterator, deque] = {}
+    for stream in streams:
+        chunk = await anext(stream, None)
+        if chunk:
+            heads[stream] = deque(chunk)
+
+    rows, last_id = [], None
+    while heads:
+        stream, head = min(heads.items(), key=lambda item: (item[1][0].created_at, item[1][0].id))
+        transaction = head.popleft()
+        if transaction.id != last_id:
+            rows.append(transaction)
+            last_id = transaction.id
+            if len(rows) == chunk_size:
+                yield rows
+                rows = []
+        if not head:
+            chunk = await anext(stream, None)
+            if chunk:
+                heads[stream] = deque(chunk)
+            else:
+                del heads[stream]
+
+    if rows:
+        yield rows
+
+
+def posting_conditions(account_id, after, until) -> tuple:
+    """Conditions for an account's transactions processed, and those voided after processing, in (after, until].
+
+    Arguments can be values or SQL expressions; `after` None means from the start.
+    """
+    processed = [TransactionInDBModel.account_id == account_id, TransactionInDBModel.processed_at <= until]
+    voided = [TransactionInDBModel.account_id == account_id, TransactionInDBModel.voided_at <= until, TransactionInDBModel.processed_at != None]
+    if after is not None:
+        processed.append(TransactionInDBModel.processed_at > after)
+        voided.append(TransactionInDBModel.voided_at > after)
+    return and_(*processed), and_(*voided)
+
+
+def postings_total(account_id, after, until):
+    """The sum of an account's postings in (after, until], as a scalar subquery."""
+    processed, voided = posting_conditions(account_id, after, until)
+    return (
+        select(func.total(signed_amount_column)).where(processed).scalar_subquery()
+        - select(func.total(signed_amount_column)).where(voided).scalar_subquery()
+    )
+
+
+def transaction_query(
+    account_id: str = None,
+    transaction_status: TransactionStatus = None,
+    transaction_type: TransactionType = None,
+    transaction_method: TransactionMethod = None,
+    disputed: bool = None,
+    created_from: datetime = None,
+    created_to: datetime = None,
+    before: tuple[datetime, str] = None,
+) -> Select:
+    """Select transactions matching every filter given; filters left as None are not applied.
+
+    Account and status lead the conditions so SQLite can seek on the
+    (account_id, transaction_status, created_at) index and range over time.
+    """
+    conditions = []
+    if account_id:
+        conditions.append(TransactionInDBModel.account_id == account_id)
+    if transaction_status:
+        conditions.append(TransactionInDBModel.transaction_status == transaction_status)
+    if transaction_type:
+        conditions.append(TransactionInDBModel.transaction_type == transaction_type)
+    if transaction_method:
+        conditions.append(TransactionInDBModel.transaction_method == transaction_method)
+    if disputed is not None:
+        conditions.append(TransactionInDBModel.disputed == disputed)
+    if created_from:
+        conditions.append(TransactionInDBModel.created_at >= created_from)
+    if created_to:
+        conditions.append(TransactionInDBModel.created_at < created_to)
+    if before:
+        conditions.append(tuple_(TransactionInDBModel.created_at, TransactionInDBModel.id) < tuple_(*before))
+
+    query = select(TransactionInDBModel)
+    if conditions:
+        query = query.where(and_(*conditions))
+    return query
 
 
-def drop_db_and_tables():
-    SQLModel.metadata.drop_all(engine)
+sqlite_file_name = "transactions.db"
 
+database = ShardedDatabase(sqlite_file_name, TRANSACTIONS_MIGRATIONS,
+    shards=config.TRANSACTION_SHARDS,
+    max_batch_size=config.TRANSACTION_GROUP_COMMIT_SIZE,
+    max_delay_ms=config.TRANSACTION_GROUP_COMMIT_DELAY_MS,
+)
+archives = ArchiveDatabases(database, config.TRANSACTION_ARCHIVE_DIR, ARCHIVE_MIGRATIONS, config.TRANSACTION_ARCHIVE_OPEN_FILES)
 
-class TransactionsDB:
-    def __init__(self):
-        self.session = Session(engine)
-        create_db_and_tables()
 
-    async def create_transaction(self, transaction: TransactionInDBModel) -> Optional[TransactionInDBModel]:
-        try: 
-            self.session.add(transaction)
-            self.session.commit()
-            self.session.refresh(transaction)
-            return transaction
+class TransactionsDB(TransactionRepository):
+    """Transactions and the balances they post to, spread over the shards of `database`.
 
-        except Exception as e:
-            print(e)
-            self.session.rollback()
-            raise e
+    Anything about one account or one transaction goes to that account's
+    shard. Listing across accounts queries every shard and merges the results.
 
+    Settled transactions past a configured age are moved out to monthly
+    archive files by archive_transactions. Reads for an archived id, or
+    that reach back into an archived month, fall back to those files;
+    everything else only touches the ledger.
+    """
+
+    def __init__(self, sessions: ShardSessions):
+        self.sessions = sessions
+
+    async def create_transaction(self, transaction: TransactionInDBModel) -> Optional[TransactionInDBModel]:
+        return await database.writers[database.for_account(transaction.account_id)].submit(transaction)
 
-    async def get_transaction(self, transaction_id: str) -> Optional[TransactionInDBModel]:
-        try: 
-            return self.session.get(TransactionInDBModel, transaction_id)
-        
-        except Exception as e:
-            print(e)
-            raise e
 
+    async def create_transactions(self, transactions: list[dict]) -> int:
+        by_shard: dict[int, list[dict]] = {}
+        for transaction in transactions:
+            by_shard.setdefault(database.for_account(transaction["account_id"]), []).append(transaction)
 
-    async def get_transactions(self, account_id: str) -> Optional[list[TransactionInDBModel]]:
+        # Every shard's rows are written before any shard commits, so a bad
+        # row anywhere leaves all of them out. Shards are taken in order, so
+        # two batches holding each other's writer can't wait on each other.
+        # The commits are all or none per shard only, see ShardSessions.commit.
+        sessions = [self.sessions[shard] for shard in sorted(by_shard)]
         try:
-            return self.session.exec(select(TransactionInDBModel).where(TransactionInDBModel.account_id == account_id)).all()
-        
-        except Exception as e:
-            print(e)
-            raise e
+            for shard, rows in sorted(by_shard.items()):
+                await self.sessions[shard].execute(insert(TransactionInDBModel), rows)
+        except Exception:
+            for session in sessions:
+                await session.rollback()
+            raise
+
+        await self.sessions.commit({shard: {row["id"]: row["account_id"] for row in rows} for shard, rows in by_shard.items()})
+        return len(transactions)
+
+
+    async def get_transaction(self, transaction_id: str) -> Optional[TransactionInDBModel]:
+        shard = database.for_transaction(transaction_id)
+        session = self.sessions[shard]
+        transaction = await session.get(TransactionInDBModel, transaction_id)
+        if transaction is None:
+            archived = await session.get(ArchivedTransaction, transaction_id)
+            if archived is not None:
+                async with archives.session(shard, archived.month) as archive:
+                    transaction = await archive.get(TransactionInDBModel, transaction_id)
+        return transaction
+
+
+    async def get_transactions(self,
+        account_id: str = None,
+        transaction_status: TransactionStatus = None,
+        transaction_type: TransactionType = None,
+        transaction_method: TransactionMethod = None,
+        disputed: bool = None,
+        created_from: datetime = None,
+        created_to: datetime = None,
+        before: tuple[datetime, str] = None,
+        limit: int = 50,
+    ) -> Optional[list[TransactionInDBModel]]:
+        """Page through transactions newest first, starting after the (created_at, id) key `before`."""
+        query = transaction_query(
+            account_id=account_id,
+            transaction_status=transaction_status,
+            transaction_type=transaction_type,
+            transaction_method=transaction_method,
+            disputed=disputed,
+            created_from=created_from,
+            created_to=created_to,
+            before=before,
+        ).order_by(TransactionInDBModel.created_at.desc(), TransactionInDBModel.id.desc())
+        if limit:
+            query = query.limit(limit)
+        # Archived months that can't hold a row of the page: after created_to or
+        # the cursor, before created_from, or without any of the account's rows.
+        months = select(TransactionArchive.month).order_by(TransactionArchive.month.desc())
+        if created_from:
+            months = months.where(TransactionArchive.month >= archive_month(created_from))
+        newest = min((key for key in (created_to and created_to - timedelta(microseconds=1), before and before[0]) if key), default=None)
+        if newest:
+            months = months.where(TransactionArchive.month <= archive_month(newest))
+        if account_id:
+            months = months.where(or_(
+                TransactionArchive.accounts_tracked == False,
+                TransactionArchive.month.in_(select(AccountArchiveMonth.month).where(AccountArchiveMonth.account_id == account_id)),
+            ))
+            return await self._get_page(database.for_account(account_id), query, months, limit)
+
+        # Each shard's first `limit` rows, merged into the overall first `limit`.
+        pages = await asyncio.gather(*(self._get_page(shard, query, months, limit) for shard in range(len(database.shards))))
+        return newest_first(pages, limit)
+
+
+    async def _get_page(self, shard: int, query: Select, months: Select, limit: Optional[int]) -> list[TransactionInDBModel]:
+        session = self.sessions[shard]
+        rows = (await session.exec(query)).all()
+
+        # Newest month first, adding each archive that could still make the page.
+        for month in (await session.exec(months)).all():
+            if limit and len(rows) >= limit and rows[limit - 1].created_at >= month_end(month):
+                break
+            async with archives.session(shard, month) as archive:
+                archived = (await archive.exec(query)).all()
+            rows = newest_first([rows, archived], limit)
+        return rows
+
+
+    async def stream_transactions(self, account_id: str, chunk_size: int) -> AsyncIterator[list[TransactionInDBModel]]:
+        shard = database.for_account(account_id)
+        session = self.sessions[shard]
+        query = transaction_query(account_id=account_id).order_by(TransactionInDBModel.created_at, TransactionInDBModel.id)
+
+        # Archived months hold older transactions than the ledger, bar the odd
+        # one that was still pending when its month was archived.
+        streams = [self._stream(session, query, chunk_size)]
+        months = (await session.exec(select(TransactionArchive.month).order_by(TransactionArchive.month))).all()
+        if months:
+            streams.insert(0, self._stream_archives(shard, months, query, chunk_size))
+
+        async for chunk in oldest_first(streams, chunk_size):
+            yield chunk
+
+
+    @staticmethod
+    async def _stream(session: AsyncSession, query: Select, chunk_size: int) -> AsyncIterator[list[TransactionInDBModel]]:
+        # A server-side cursor, fetched from chunk_size rows at a time.
+        result = await session.stream(query.execution_options(yield_per=chunk_size))
+        async for chunk in result.scalars().partitions(chunk_size):
+            yield chunk
+
+
+    async def _stream_archives(self, shard: int, months: list[str], query: Select, chunk_size: int) -> AsyncIterator[list[TransactionInDBModel]]:
+        # Each month's file only holds transactions created in it, so reading them in order keeps the rows in order.
+        for month in months:
+            async with archives.session(shard, month) as archive:
+                async for chunk in self._stream(archive, query, chunk_size):
+                    yield chunk
 
 
     async def update_transaction(self, transaction_id: str, transaction: TransactionInDBModel):
+        session = self.sessions.for_transaction(transaction_id)
         try:
-            print("updated: ", transaction)
-            # current_transaction = self.session.exec(select(TransactionInDBModel).where(TransactionInDBModel.id == transaction_id)).first()
-            current_transaction = self.session.get(TransactionInDBModel, transaction_id)
-            print("existing:", current_transaction)
+            current_transaction = await session.get(TransactionInDBModel, transaction_id)
             current_transaction.reference = transaction.reference
             current_transaction.description = transaction.description
-            # current_transaction.transaction_type = transaction.transaction_type
             current_transaction.transaction_method = transaction.transaction_method
             current_transaction.transaction_method_id = transaction.transaction_method_id
-            # current_transaction.disputed = transaction.disputed
-            # current_transaction.created_at = transaction.created_at
             current_transaction.updated_at = transaction.updated_at
-            current_transaction.transaction_status = transaction.transaction_status
-            current_transaction.processed_at = transaction.processed_at
-            current_transaction.voided_at = transaction.voided_at
 
-            self.session.add(current_transaction)
-            self.session.commit()
-            self.session.refresh(current_transaction)
+            session.add(current_transaction)
+            await session.commit()
+            await session.refresh(current_transaction)
 
             return current_transaction
 
-        except Exception as e:
-            print(e)
-            self.session.rollback()
-            raise e
-
-
-    async def process_transaction(self, transaction_id: str, processed_at: float):
+        except Exception:
+            await session.rollback()
+            raise
+
+
+    @staticmethod
+    async def _post_to_balance(session: AsyncSession, account_id: str, amount: float, posted_at: datetime):
+        now = posted_at.replace(tzinfo=timezone.utc).timestamp()
+        await session.execute(
+            sqlite_insert(AccountBalance)
+            .values(id=account_id, balance=amount, available_balance=amount, created_at=now, updated_at=now)
+            .on_conflict_do_update(
+                index_elements=[AccountBalance.id],
+                set_={
+                    "balance": AccountBalance.balance + amount,
+                    "available_balance": AccountBalance.available_balance + amount,
+                    "updated_at": now,
+                },
+            )
+        )
+
+
+    async def _set_status(self, transaction: TransactionInDBModel, values: dict, posting: float) -> Optional[TransactionInDBModel]:
+        """Move a transaction out of its current status and post `posting` to its account's balance, in one commit.
+
+        The UPDATE only matches while the row still has the status we read, so
+        a concurrent process/void of the same transaction can't post twice.
+        """
+        session = self.sessions.for_account(transaction.account_id)
         try:
-            transaction = self.get_transaction(transaction_id)
-            transaction.processed_at = processed_at
-            transaction.transaction_status = TransactionStatus.PROCESSED
-            self.session.add(transaction)
-            self.session.commit()
-
-            return transaction.dict()
-
-        except Exception as e:
-            print(e)
-            self.session.rollback()
-            raise e
-
+            result = await session.execute(
+                update(TransactionInDBModel)
+                .where(TransactionInDBModel.id == transaction.id)
+                .where(TransactionInDBModel.transaction_status == transaction.transaction_status)
+                .values(**values)
+            )
+            if result.rowcount != 1:
+                await session.rollback()
+                return None
+
+            if posting:
+                await self._post_to_balance(session, transaction.account_id, posting, values["updated_at"])
+
+            await session.commit()
+            await session.refresh(transaction)
+            return transaction
 
-    async def void_transaction(self, transaction_id: str, voided_at: float):
+        except Exception:
+            await session.rollback()
+            raise
+
+
+    async def process_transaction(self, transaction_id: str, processed_at: datetime, account_id: str = None) -> Optional[TransactionInDBModel]:
+        transaction = await self.get_transaction(transaction_id)
+        if not transaction or transaction.transaction_status != TransactionStatus.PENDING:
+            return None
+        if account_id and transaction.account_id != account_id:
+            return None
+
+        return await self._set_status(transaction, {
+            "transaction_status": TransactionStatus.PROCESSED,
+            "processed_at": processed_at,
+            "updated_at": processed_at,
+        }, posting=signed_amount(transaction))
+
+
+    async def void_transaction(self, transaction_id: str, voided_at: datetime, account_id: str = None) -> Optional[TransactionInDBModel]:
+        transaction = await self.get_transaction(transaction_id)
+        if not transaction or transaction.transaction_status == TransactionStatus.VOID:
+            return None
+        if account_id and transaction.account_id != account_id:
+            return None
+
+        # Only a processed transaction has been posted, so only that needs reversing.
+        posting = -signed_amount(transaction) if transaction.transaction_status == TransactionStatus.PROCESSED else 0
+        return await self._set_status(transaction, {
+            "transaction_status": TransactionStatus.VOID,
+            "voided_at": voided_at,
+            "updated_at": voided_at,
+        }, posting=posting)
+
+
+    async def get_pending_transaction_keys(self, created_before: datetime, after: tuple[datetime, str] = None, limit: int = 1000) -> list[tuple[datetime, str]]:
+        query = (
+            select(TransactionInDBModel.created_at, TransactionInDBModel.id)
+            .where(TransactionInDBModel.transaction_status == TransactionStatus.PENDING)
+            .where(TransactionInDBModel.created_at < created_before)
+            .order_by(TransactionInDBModel.created_at, TransactionInDBModel.id)
+            .limit(limit)
+        )
+        if after:
+            query = query.where(tuple_(TransactionInDBModel.created_at, TransactionInDBModel.id) > tuple_(*after))
+
+        # Pending transactions are never archived, so the ledger has them all.
+        async def page(session: AsyncSession) -> list[tuple[datetime, str]]:
+            return [tuple(row) for row in (await session.execute(query)).all()]
+
+        pages = await asyncio.gather(*(page(session) for session in self.sessions.all()))
+        return list(merge(*pages))[:limit]
+
+
+    async def process_transactions(self, transaction_ids: list[str], processed_at: datetime, account_id: str = None) -> dict[str, str]:
+        pending = TransactionInDBModel.transaction_status == TransactionStatus.PENDING
+        return await self._set_statuses(transaction_ids, account_id, pending, {
+            "transaction_status": TransactionStatus.PROCESSED,
+            "processed_at": processed_at,
+            "updated_at": processed_at,
+        }, posted=pending, posting=signed_amount_column)
+
+
+    async def void_transactions(self, transaction_ids: list[str], voided_at: datetime, account_id: str = None) -> dict[str, str]:
+        return await self._set_statuses(transaction_ids, account_id, TransactionInDBModel.transaction_status != TransactionStatus.VOID, {
+            "transaction_status": TransactionStatus.VOID,
+            "voided_at": voided_at,
+            "updated_at": voided_at,
+        }, posted=TransactionInDBModel.transaction_status == TransactionStatus.PROCESSED, posting=-signed_amount_column)
+
+
+    async def _set_statuses(self, transaction_ids: list[str], account_id: Optional[str], matches, values: dict, posted, posting) -> dict[str, str]:
+        """Set-based _set_status: one UPDATE per shard for the transactions in transaction_ids that `matches`.
+
+        The rows that are also `posted` add up their `posting` per account, and
+        each account's total goes to its balance in the same commit. Every
+        shard is written, in order, before any commits, as in create_transactions,
+        and all or none holds per shard only. Returns the ids changed, mapped
+        to their accounts.
+        """
+        by_shard: dict[int, list[str]] = {}
+        for transaction_id in transaction_ids:
+            by_shard.setdefault(database.for_transaction(transaction_id), []).append(transaction_id)
+
+        now = values["updated_at"].replace(tzinfo=timezone.utc).timestamp()
+        changed: dict[int, dict[str, str]] = {}
+        sessions = [self.sessions[shard] for shard in sorted(by_shard)]
         try:
-            transaction = self.get_transaction(transaction_id)
-            transaction.voided_at = voided_at
-            transaction.transaction_status = TransactionStatus.VOID
-            self.session.add(transaction)
-            self.session.commit()
-
-            return transaction.dict()
-
-        except Exception as e:
-            print(e)
-            self.session.rollback()
-            raise e
+            for shard, ids in sorted(by_shard.items()):
+                session = self.sessions[shard]
+                conditions = [TransactionInDBModel.id.in_(ids), matches]
+                if account_id:
+                    conditions.append(TransactionInDBModel.account_id == account_id)
+
+                # The balances are written first: the first write takes the
+                # file's lock, so the rows can't change between here and the UPDATE.
+                totals = (
+                    select(TransactionInDBModel.account_id, func.total(posting), func.total(posting), literal(now), literal(now))
+                    .where(*conditions, posted)
+                    .group_by(TransactionInDBModel.account_id)
+                )
+                balances = sqlite_insert(AccountBalance).from_select(["id", "balance", "available_balance", "created_at", "updated_at"], totals)
+                await session.execute(balances.on_conflict_do_update(
+                    index_elements=[AccountBalance.id],
+                    set_={
+                        "balance": AccountBalance.balance + balances.excluded.balance,
+                        "available_balance": AccountBalance.available_balance + balances.excluded.available_balance,
+                        "updated_at": now,
+                    },
+                ))
+
+                # Read through the writer, under that lock.
+                rows = await session.execute(select(TransactionInDBModel.id, TransactionInDBModel.account_id).where(*conditions), bind_arguments={"bind": session.writer})
+                changed[shard] = dict(rows.all())
+                await session.execute(update(TransactionInDBModel).where(*conditions).values(**values))
+        except Exception:
+            for session in sessions:
+                await session.rollback()
+            raise
+
+        return await self.sessions.commit(changed)
 
     
     async def get_transaction_by_processed(self, account_id: str) -> Optional[list[TransactionInDBModel]]:
-        try:
-
-            return self.session.exec(select(TransactionInDBModel).where(TransactionInDBModel.account_id == account_id and TransactionInDBModel.transaction_status == TransactionStatus.PROCESSED)).all()
-                    
-        except Exception as e:
-            print(e)
-            raise e
+        return await self.get_transactions(account_id, transaction_status=TransactionStatus.PROCESSED, limit=None)
 
 
     async def get_transaction_by_pending(self, account_id: str) -> Optional[list[TransactionInDBModel]]:
-        try:
-            return self.session.exec(select(TransactionInDBModel).where(TransactionInDBModel.account_id == account_id and TransactionInDBModel.transaction_status == TransactionStatus.PENDING)).all()
+        return await self.get_transactions(account_id, transaction_status=TransactionStatus.PENDING, limit=None)
 
-        except Exception as e:
-            print(e)
-            raise e
     
     async def get_transaction_by_voided(self, account_id: str) -> Optional[list[TransactionInDBModel]]:
-        try:
-            return self.session.exec(select(TransactionInDBModel).where(TransactionInDBModel.account_id == account_id and TransactionInDBModel.transaction_status == TransactionStatus.VOID)).all()
+        return await self.get_transactions(account_id, transaction_status=TransactionStatus.VOID, limit=None)
 
-        except Exception as e:
-            print(e)
-            raise e
         
     async def get_transaction_by_disputed(self, account_id: str) -> Optional[list[TransactionInDBModel]]:
+        return await self.get_transactions(account_id, disputed=True, limit=None)
+
+
+    async def get_transaction_totals(self, account_id: str, from_day: date = None, to_day: date = None) -> list[dict]:
+        columns = [func.sum(getattr(DailyRollup, total)).label(total) for total in ROLLUP_TOTALS]
+        query = select(DailyRollup.transaction_type, *columns).where(DailyRollup.account_id == account_id)
+        if from_day:
+            query = query.where(DailyRollup.day >= from_day)
+        if to_day:
+            query = query.where(DailyRollup.day < to_day)
+        result = await self.sessions.for_account(account_id).execute(query.group_by(DailyRollup.transaction_type).order_by(DailyRollup.transaction_type))
+        return [
+            {"transaction_type": row.transaction_type, **{total: row[total] for total in ROLLUP_TOTALS}}
+            for row in result.mappings()
+        ]
+
+
+    async def create_balance_snapshots(self, taken_at: datetime) -> int:
+        # Per account: its latest snapshot before taken_at, then that plus what
+        # was posted since. '' sorts before every stored time, so an account
+        # without a snapshot sums everything it has posted.
+        previous_at = (
+            select(func.coalesce(func.max(BalanceSnapshot.taken_at), ""))
+            .where(BalanceSnapshot.account_id == AccountBalance.id)
+            .where(BalanceSnapshot.taken_at < taken_at)
+            .scalar_subquery()
+        )
+        latest = select(AccountBalance.id.label("account_id"), previous_at.label("previous_at")).subquery()
+        previous = BalanceSnapshot.__table__.alias("previous")
+        processed, voided = posting_conditions(latest.c.account_id, latest.c.previous_at, taken_at)
+
+        snapshots = (
+            select(
+                latest.c.account_id,
+                literal(taken_at, BalanceSnapshot.__table__.c.taken_at.type),
+                func.coalesce(previous.c.balance, 0) + postings_total(latest.c.account_id, latest.c.previous_at, taken_at),
+            )
+            .select_from(latest)
+            .outerjoin(previous, and_(previous.c.account_id == latest.c.account_id, previous.c.taken_at == latest.c.previous_at))
+            # An account with nothing posted since its last snapshot is still
+            # answered by that one, so it doesn't need another.
+            .where(or_(exists().where(processed), exists().where(voided)))
+        )
+        created = 0
+        for session in self.sessions.all():
+            result = await session.execute(
+                sqlite_insert(BalanceSnapshot)
+                .from_select(["account_id", "taken_at", "balance"], snapshots)
+                # Another worker got there first.
+                .on_conflict_do_nothing()
+            )
+            await session.commit()
+            created += result.rowcount
+        return created
+
+
+    async def get_balance_as_of(self, account_id: str, as_of: datetime) -> Optional[float]:
+        session = self.sessions.for_account(account_id)
+        if await session.get(AccountBalance, account_id) is None:
+            return None
+
+        snapshot = (await session.exec(
+            select(BalanceSnapshot)
+            .where(BalanceSnapshot.account_id == account_id)
+            .where(BalanceSnapshot.taken_at <= as_of)
+            .order_by(BalanceSnapshot.taken_at.desc())
+            .limit(1)
+        )).first()
+        after = snapshot.taken_at if snapshot else None
+        since = (await session.execute(select(postings_total(account_id, after, as_of)))).scalar()
+
+        # Archives that may hold postings since the snapshot.
+        query = select(TransactionArchive.month).where(TransactionArchive.month <= archive_month(as_of))
+        if after:
+            query = query.where(TransactionArchive.archived_before > after)
+        for month in (await session.exec(query)).all():
+            async with archives.session(database.for_account(account_id), month) as archive:
+                since += (await archive.execute(select(postings_total(account_id, after, as_of)))).scalar()
+
+        return (snapshot.balance if snapshot else 0.0) + since
+
+
+    async def archive_transactions(self, before: datetime, limit: int) -> int:
+        archived = 0
+        for shard in range(len(database.shards)):
+            archived += await self._archive_shard(shard, before, limit)
+        return archived
+
+
+    async def _archive_shard(self, shard: int, before: datetime, limit: int) -> int:
+        session = self.sessions[shard]
+        try:
+            # Read through the writer, which the session holds until the
+            # commit, so a void or update can't land between a row's copy
+            # and its delete; another worker's write fails ours instead.
+            settled = (await session.exec(
+                select(TransactionInDBModel)
+                .where(TransactionInDBModel.transaction_status.in_([TransactionStatus.PROCESSED, TransactionStatus.VOID]))
+                .where(TransactionInDBModel.created_at < before)
+                .where(or_(TransactionInDBModel.processed_at == None, TransactionInDBModel.processed_at < before))
+                .where(or_(TransactionInDBModel.voided_at == None, TransactionInDBModel.voided_at < before))
+                .order_by(TransactionInDBModel.created_at)
+                .limit(limit),
+                bind_arguments={"bind": session.writer},
+            )).all()
+            if not settled:
+                await session.rollback()
+                return 0
+
+            by_month: dict[str, list[TransactionInDBModel]] = {}
+            for transaction in settled:
+                by_month.setdefault(archive_month(transaction.created_at), []).append(transaction)
+
+            # Copied to the archives before leaving the ledger, so the next run
+            # finishes one that was cut short. A copy left by such a run may be
+            # older than the row, so it is overwritten.
+            for month, transactions in by_month.items():
+                async with archives.session(shard, month) as archive:
+                    copy = sqlite_insert(TransactionInDBModel)
+                    await archive.execute(
+                        copy.on_conflict_do_update(
+                            index_elements=[TransactionInDBModel.id],
+                            set_={column.name: copy.excluded[column.name] for column in TransactionInDBModel.__table__.columns if not column.primary_key},
+                        ),
+                        [transaction.dict() for transaction in transactions],
+                    )
+                    await archive.commit()
+
+            # A month first archived untracked stays untracked, its earlier accounts aren't listed.
+            months = sqlite_insert(TransactionArchive).values([{"month": month, "archived_before": before, "accounts_tracked": True} for month in by_month])
+            await session.execute(months.on_conflict_do_update(
+                index_elements=[TransactionArchive.month],
+                set_={"archived_before": func.max(TransactionArchive.archived_before, months.excluded.archived_before)},
+            ))
+            await session.execute(
+                sqlite_insert(AccountArchiveMonth).on_conflict_do_nothing(),
+                [{"account_id": account_id, "month": month} for account_id, month in {(transaction.account_id, archive_month(transaction.created_at)) for transaction in settled}],
+            )
+            await session.execute(
+                sqlite_insert(ArchivedTransaction).on_conflict_do_nothing(),
+                [{"id": transaction.id, "month": archive_month(transaction.created_at)} for transaction in settled],
+            )
+            deleted = await session.execute(delete(TransactionInDBModel).where(TransactionInDBModel.id.in_([transaction.id for transaction in settled])))
+            await session.commit()
+            return deleted.rowcount
+
+        except Exception:
+            await session.rollback()
+            raise
+
+
+    async def get_idempotency_key(self, key: str, now: float) -> Optional[IdempotencyKey]:
+        session = self.sessions.for_key(key)
+        idempotency_key = await session.get(IdempotencyKey, key, populate_existing=True)
+        # End the read transaction, so polling for a key another worker is
+        # completing sees its latest state rather than this snapshot.
+        await session.commit()
+        if idempotency_key is None or idempotency_key.expires_at <= now:
+            return None
+        return idempotency_key
+
+
+    async def reserve_idempotency_key(self, key: str, request_hash: str, now: float, expires_at: float) -> bool:
+        session = self.sessions.for_key(key)
+        values = {"request_hash": request_hash, "status_code": None, "response": None, "created_at": now, "expires_at": expires_at}
+        result = await session.execute(
+            sqlite_insert(IdempotencyKey)
+            .values(key=key, **values)
+            # Taking over an expired key is fine, a live one belongs to someone else.
+            .on_conflict_do_update(index_elements=[IdempotencyKey.key], set_=values, where=IdempotencyKey.expires_at <= now)
+        )
+        await session.commit()
+        return result.rowcount == 1
+
+
+    async def complete_idempotency_key(self, key: str, status_code: int, response: str):
+        session = self.sessions.for_key(key)
         try:
-            return self.session.exec(select(TransactionInDBModel).where(TransactionInDBModel.account_id == account_id and TransactionInDBModel.disputed == True)).all()
+            await session.execute(
+                update(IdempotencyKey).where(IdempotencyKey.key == key).values(status_code=status_code, response=response)
+            )
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise
 
-        except Exception as e:
-            print(e)
-            raise e
 
+    async def release_idempotency_key(self, key: str):
+        session = self.sessions.for_key(key)
+        try:
+            await session.execute(
+                delete(IdempotencyKey).where(IdempotencyKey.key == key).where(IdempotencyKey.status_code == None)
+            )
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise
+
+
+    async def purge_idempotency_keys(self, now: float) -> int:
+        purged = 0
+        for session in self.sessions.all():
+            result = await session.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at <= now))
+            await session.commit()
+            purged += result.rowcount
+        return purged
@@ -0,0 +1,108 @@
+import asyncio
+import contextvars
+from typing import Optional
+
+from sqlalchemy.orm import sessionmaker
+from sqlmodel import SQLModel
+
+
+class GroupCommitWriter:
+    """Batches inserts from concurrent callers into a single SQLite transaction.
+
+    A batch is flushed once max_batch_size rows are queued or max_delay_ms has
+    passed since the first row arrived, whichever comes first. Every caller
+    gets back its own row, or its own exception if that row could not be
+    written.
+    """
+
+    def __init__(self, session_factory: sessionmaker, max_batch_size: int, max_delay_ms: int):
+        self.session_factory = session_factory
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay_ms / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            # Start from an empty context, so the writer doesn't inherit the
+            # per-request state of whichever request happened to start it.
+            self._task = contextvars.Context().run(asyncio.create_task, self._run())
+
+
+    async def stop(self):
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        self._queue = None
+
+
+    async def submit(self, row: SQLModel) -> SQLModel:
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((row, future))
+        return await future
+
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+
+            batch = [item]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+
+
+    async def _flush(self, batch: list):
+        try:
+            async with self.session_factory() as session:
+                session.add_all([row for row, _ in batch])
+                await session.commit()
+        except Exception:
+            # One bad row fails the whole group, so retry each on its own to
+            # hand every caller its own result.
+            for row, future in batch:
+                await self._flush_one(row, future)
+            return
+
+        for row, future in batch:
+            if not future.done():
+                future.set_result(row)
+
+
+    async def _flush_one(self, row: SQLModel, future: asyncio.Future):
+        try:
+            async with self.session_factory() as session:
+                session.add(row)
+                await session.commit()
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            return
+
+        if not future.done():
+            future.set_result(row)
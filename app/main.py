@@ -1,15 +1,34 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Depends, HTTPException, APIRouter
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.api.accounts.router import router as accounts_router
 from app.api.transactions.router import router as transactions_router
+from app.api.metrics import MetricsMiddleware, router as metrics_router
+from app.api.profiler import SQLProfilerMiddleware
+from app.api.request_id import RequestIdMiddleware
+from app.api.responses import ORJSONResponse
+from app.core import config
+from app.core.logs import setup_logging
+from app.core.transactions.archive import transaction_archive
+from app.core.transactions.settlement import settlement
+from app.core.transactions.snapshots import balance_snapshots
+
+from app.db.registry import get_backend
+
+
+# Background work each worker runs while it is up.
+JOBS = [balance_snapshots, transaction_archive, settlement]
 
+setup_logging()
 
 app = FastAPI(
     title="FastAPI Boilerplate",
     description="A boilerplate for FastAPI",
     version="0.0.1",
     docs_url="/",
+    default_response_class=ORJSONResponse,
 )
 
 origins = [
@@ -26,10 +45,35 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+if config.SQL_PROFILE:
+    app.add_middleware(SQLProfilerMiddleware)
+# Outermost, so everything the other middlewares log carries the request id.
+app.add_middleware(RequestIdMiddleware)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open the storage backend once per worker, before it takes traffic, and close it on the way out."""
+    backend = get_backend()
+    await backend.startup()
+    for job in JOBS:
+        job.start()
+    try:
+        yield
+    finally:
+        for job in JOBS:
+            await job.stop()
+        await backend.shutdown()
+
+
+# FastAPI 0.90 doesn't take lifespan= yet, the router underneath does.
+app.router.lifespan_context = lifespan
+
 
 # app.include_router(users_router)
 app.include_router(accounts_router)
 app.include_router(transactions_router)
+app.include_router(metrics_router)
 
 @app.get("/")
 async def root():
@@ -0,0 +1,208 @@
+"""In-process HTTP load benchmark for the API.
+
+Drives app.main:app through an ASGI client, so no server or network is
+involved, and reports throughput and latency percentiles per route.
+
+    python -m benchmarks.http_bench --concurrency 32 --requests 2000 --output bench.json
+    python -m benchmarks.http_bench --compare bench.json
+
+Each run uses fresh SQLite files in a temporary directory unless --workdir
+is given. Pass --backend memory to measure the API without storage cost.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from itertools import count
+from pathlib import Path
+from time import perf_counter
+
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[rank]
+
+
+def summarize(latencies: list, errors: int, elapsed: float) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+async def run_route(client, method: str, make_request, total: int, concurrency: int, expect: int) -> tuple[dict, list]:
+    """Send `total` requests built by make_request(i) from `concurrency` workers."""
+    latencies, responses = [], []
+    errors = 0
+    counter = count()
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            if i >= total:
+                return
+            url, body = make_request(i)
+            started = perf_counter()
+            response = await client.request(method, url, json=body)
+            latencies.append(perf_counter() - started)
+            if response.status_code != expect:
+                errors += 1
+            else:
+                responses.append(response.json())
+
+    started = perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, perf_counter() - started), responses
+
+
+def new_account(i: int) -> dict:
+    return {
+        "accountName": f"bench-{i}",
+        "accountType": "checking",
+        "currency": "USD",
+        "accountHolderId": f"holder-{i % 100}",
+        "metadata": {},
+    }
+
+
+def new_transaction(account_id: str, i: int) -> dict:
+    return {
+        "accountId": account_id,
+        "destinationAccountId": "bench-destination",
+        "amount": f"{i % 500 + 1}.25",
+        "reference": f"bench-{i}",
+        "description": "benchmark transaction",
+        "transactionType": "credit" if i % 2 else "debit",
+        "transactionMethod": "debit_card",
+    }
+
+
+def check_same_timestamps(route: str, created: list, fetched: list):
+    """Fail the run if a GET renders a record's timestamps differently from the create that returned it."""
+    created_at = {row["id"]: (row["createdAt"], row["updatedAt"]) for row in created}
+    for row in fetched:
+        if created_at[row["id"]] != (row["createdAt"], row["updatedAt"]):
+            raise SystemExit(f"{route} renders {row['id']}'s timestamps as {row['createdAt']}, {row['updatedAt']}, its create as {created_at[row['id']]}")
+
+
+async def run(args) -> dict:
+    # Imported late so the SQLite files are created in the working directory.
+    from httpx import AsyncClient
+    from app.main import app
+
+    results = {}
+    async with app.router.lifespan_context(app), AsyncClient(app=app, base_url="http://bench") as client:
+        total, concurrency = args.requests, args.concurrency
+
+        results["POST /accounts/"], accounts = await run_route(client, "POST",
+            lambda i: ("/accounts/", new_account(i)), total, concurrency, 200)
+        account_ids = [account["id"] for account in accounts]
+        if not account_ids:
+            raise SystemExit("No accounts were created, nothing else to benchmark")
+
+        results["GET /accounts/{account_id}"], fetched = await run_route(client, "GET",
+            lambda i: (f"/accounts/{account_ids[i % len(account_ids)]}", None), total, concurrency, 200)
+        check_same_timestamps("GET /accounts/{account_id}", accounts, fetched)
+
+        results["GET /accounts/{account_id}/balance/"], _ = await run_route(client, "GET",
+            lambda i: (f"/accounts/{account_ids[i % len(account_ids)]}/balance/", None), total, concurrency, 200)
+
+        results["POST /transactions/"], transactions = await run_route(client, "POST",
+            lambda i: ("/transactions/", new_transaction(account_ids[i % len(account_ids)], i)), total, concurrency, 201)
+        transaction_ids = [transaction["id"] for transaction in transactions]
+        if not transaction_ids:
+            raise SystemExit("No transactions were created, nothing else to benchmark")
+
+        results["GET /transactions/{transaction_id}"], fetched = await run_route(client, "GET",
+            lambda i: (f"/transactions/{transaction_ids[i % len(transaction_ids)]}", None), total, concurrency, 200)
+        check_same_timestamps("GET /transactions/{transaction_id}", transactions, fetched)
+
+        results["PUT /transactions/{transaction_id}"], _ = await run_route(client, "PUT",
+            lambda i: (f"/transactions/{transaction_ids[i % len(transaction_ids)]}", {
+                "reference": f"bench-{i}",
+                "description": "updated by benchmark",
+                "transactionMethod": "debit_card",
+            }), total, concurrency, 200)
+
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def print_results(results: dict, baseline: dict = None):
+    header = f"{'route':<40} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}"
+    print(header)
+    print("-" * len(header))
+    for route, stats in results.items():
+        print(f"{route:<40} {stats['throughput_rps']:>9} {stats['p50_ms']:>9} {stats['p95_ms']:>9} {stats['p99_ms']:>9} {stats['errors']:>7}")
+        before = (baseline or {}).get(route)
+        if before:
+            deltas = []
+            for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms"):
+                if before[key]:
+                    deltas.append(f"{key} {(stats[key] - before[key]) / before[key] * 100:+.1f}%")
+            print(f"{'':<40} vs baseline: {', '.join(deltas)}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight at once")
+    parser.add_argument("--requests", type=int, default=1000, help="requests sent per route")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="a JSON results file from an earlier run to compare against")
+    parser.add_argument("--backend", help="storage backend to run against (default: STORAGE_BACKEND or sqlite)")
+    parser.add_argument("--workdir", help="directory for the SQLite files (default: a fresh temporary directory)")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())["routes"]
+
+    output = Path(args.output).resolve() if args.output else None
+
+    if args.backend:
+        os.environ["STORAGE_BACKEND"] = args.backend
+
+    sys.path.insert(0, str(REPO_ROOT))
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+
+    results = asyncio.run(run(args))
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "backend": os.environ.get("STORAGE_BACKEND", "sqlite"),
+        "concurrency": args.concurrency,
+        "requests_per_route": args.requests,
+        "routes": results,
+    }
+
+    print_results(results, baseline)
+    if output:
+        output.write_text(json.dumps(report, indent=2))
+        print(f"\nWrote {output}")
+
+
+if __name__ == "__main__":
+    main()